@@ -19,16 +19,36 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
       process_end timestamp DEFAULT NULL,
       uploaded_at timestamp DEFAULT date_trunc('second', CURRENT_TIMESTAMP),
       errors INTEGER DEFAULT 0,
-      error_msg VARCHAR(500) DEFAULT NULL
+      error_msg VARCHAR(500) DEFAULT NULL,
+      facts_backfilled boolean DEFAULT FALSE
   );
 
   CREATE TABLE IF NOT EXISTS mission_stats (
       file_name VARCHAR(500) REFERENCES mission_stat_files(file_name) ON DELETE CASCADE,
       pilot varchar(500),
       pilot_id INTEGER,
-      record json
+      record jsonb
   );
 
+  CREATE INDEX IF NOT EXISTS mission_stats_pilot_idx
+      ON mission_stats (pilot);
+
+  CREATE TABLE IF NOT EXISTS mission_stat_facts (
+      file_name VARCHAR(500) REFERENCES mission_stat_files(file_name) ON DELETE CASCADE,
+      pilot varchar(500),
+      session_start_date DATE,
+      stat_group varchar(100),
+      category varchar(500),
+      metric varchar(100),
+      equipment varchar(500),
+      value INTEGER
+  );
+
+  CREATE INDEX IF NOT EXISTS mission_stat_facts_file_idx
+      ON mission_stat_facts (file_name);
+  CREATE INDEX IF NOT EXISTS mission_stat_facts_date_idx
+      ON mission_stat_facts (session_start_date);
+
   CREATE TABLE IF NOT EXISTS mission_event_files (
       file_name VARCHAR(500) PRIMARY KEY,
       session_start_time TIMESTAMP WITH TIME ZONE,
@@ -44,9 +64,12 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
 
   CREATE TABLE IF NOT EXISTS mission_events (
       file_name VARCHAR(500) REFERENCES mission_event_files(file_name) ON DELETE CASCADE,
-      record json
+      record jsonb
   );
 
+  CREATE INDEX IF NOT EXISTS mission_events_type_idx
+      ON mission_events ((record->>'type'));
+
   CREATE TABLE IF NOT EXISTS frametime_files (
       file_name VARCHAR(500) PRIMARY KEY,
       session_start_time TIMESTAMP WITH TIME ZONE,
@@ -56,7 +79,8 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
       process_start timestamp DEFAULT NULL,
       process_end timestamp DEFAULT NULL,
       uploaded_at timestamp DEFAULT date_trunc('second', CURRENT_TIMESTAMP),
-      errors INTEGER DEFAULT 0
+      errors INTEGER DEFAULT 0,
+      error_msg VARCHAR(500) DEFAULT NULL
   );
 
 CREATE TABLE IF NOT EXISTS tacview_files (
@@ -67,15 +91,105 @@ CREATE TABLE IF NOT EXISTS tacview_files (
       processed boolean DEFAULT FALSE,
       process_start timestamp DEFAULT NULL,
       process_end timestamp DEFAULT NULL,
-      errors INTEGER DEFAULT 0
+      errors INTEGER DEFAULT 0,
+      worker_id VARCHAR(200) DEFAULT NULL,
+      heartbeat timestamp DEFAULT NULL,
+      bytes_total BIGINT,
+      bytes_read BIGINT,
+      lines_read BIGINT,
+      events_read BIGINT,
+      objects_read INTEGER,
+      flush_count INTEGER,
+      flush_secs float,
+      flush_max_secs float,
+      download_secs float,
+      read_secs float,
+      parse_secs float,
+      ingest_secs float,
+      refresh_secs float
   );
 
 CREATE TABLE IF NOT EXISTS frametimes (
       file_name VARCHAR(500) REFERENCES frametime_files(file_name) ON DELETE CASCADE,
       frame_ts TIMESTAMP,
-      ts_fps INT
+      ts_fps float,
+      fps_p1 float,
+      fps_p50 float,
+      fps_p99 float
   );
 
+CREATE INDEX IF NOT EXISTS frametimes_file_idx
+      ON frametimes (file_name);
+
+CREATE TABLE IF NOT EXISTS frametime_rollups (
+      file_name VARCHAR(500) REFERENCES frametime_files(file_name) ON DELETE CASCADE,
+      resolution INTEGER,
+      frame_ts TIMESTAMP,
+      ts_fps float,
+      fps_p1 float,
+      fps_p50 float,
+      fps_p99 float
+  );
+
+CREATE INDEX IF NOT EXISTS frametime_rollups_file_idx
+      ON frametime_rollups (file_name, resolution, frame_ts);
+
+CREATE TABLE IF NOT EXISTS gcs_sync_state (
+      prefix VARCHAR(100) PRIMARY KEY,
+      watermark TIMESTAMP,
+      last_sync TIMESTAMP,
+      sync_seconds float,
+      blobs_scanned INTEGER,
+      blobs_diffed INTEGER,
+      blobs_changed INTEGER
+  );
+
+CREATE TABLE IF NOT EXISTS tacview_kills (
+      kill_timestamp TIMESTAMP WITH TIME ZONE,
+      start_time TIMESTAMP WITH TIME ZONE,
+      killer_name VARCHAR,
+      killer_type VARCHAR,
+      killer_id INTEGER,
+      target_name VARCHAR,
+      target_type VARCHAR,
+      target_id INTEGER,
+      weapon_name VARCHAR,
+      weapon_type VARCHAR,
+      weapon_id INTEGER,
+      impact_id INTEGER,
+      weapon_first_time REAL,
+      weapon_last_time REAL,
+      session_id INTEGER,
+      impact_dist NUMERIC,
+      kill_duration NUMERIC,
+      weapon_color VARCHAR,
+      target_color VARCHAR,
+      killer_color VARCHAR,
+      first_seen REAL,
+      last_seen REAL
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS tacview_kills_impact_id_idx
+      ON tacview_kills (impact_id);
+
+CREATE INDEX IF NOT EXISTS tacview_kills_session_idx
+      ON tacview_kills (session_id);
+
+CREATE INDEX IF NOT EXISTS tacview_kills_listing_idx
+      ON tacview_kills (kill_timestamp DESC)
+      WHERE weapon_type IS NOT NULL AND impact_dist <= 5 AND
+          kill_duration > 1 AND kill_duration < 120;
+
+CREATE TABLE IF NOT EXISTS kill_replays (
+      impact_id INTEGER PRIMARY KEY,
+      session_id INTEGER,
+      created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+      payload BYTEA NOT NULL
+  );
+
+CREATE INDEX IF NOT EXISTS kill_replays_session_idx
+      ON kill_replays (session_id);
+
 create or replace view impacts_valid as (
     select * from impact_comb ic
     inner join (select session_id, id as target_id, first_seen, last_seen from object ) op
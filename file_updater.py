@@ -1,18 +1,23 @@
 import asyncio
 from asyncio import CancelledError
+from multiprocessing import Process
 import os
 from pathlib import Path
 import signal
+import socket
 import sys
+import time
 
 import asyncpg
 import databases
-from tacview_client import serve_file, client, db
+from tacview_client import db
 import uvloop
 
 from horrible.database import (DATABASE_URL, stat_files, frametime_files,
-                               tacview_files, event_files)
-from horrible import read_stats, gcs
+                               tacview_files, event_files, create_tables)
+from horrible import read_stats, gcs, killcam
+from horrible.tacview_reader import (consume_file, IngestMetrics,
+                                     METRIC_COLUMNS)
 from horrible.config import get_logger
 
 log = get_logger(__name__)
@@ -39,6 +44,8 @@ async def update_files(prefix, table):
             pass
         # SW
         else:
+            if prefix == "mission-stats":
+                await read_stats.backfill_stat_facts(db)
             log.info("Processing new records...")
             await read_stats.process_lua_records(prefix, db)
         log.info('Job complete...disconnecting...')
@@ -50,81 +57,225 @@ async def update_files(prefix, table):
     return exit_status
 
 
-async def proc_tac():
-    await db.create_tables()
-    await update_files("tacview", tacview_files)
+async def refresh_kills(session_start_time):
+    """Update the kill table and replays for a newly processed session."""
+    kill_db = databases.Database(DATABASE_URL, min_size=1,
+                                 max_size=killcam.REPLAY_CONCURRENCY)
+    await kill_db.connect()
+    try:
+        await killcam.ensure_kill_table(kill_db)
+        await killcam.refresh_kill_table(kill_db, session_start_time)
+        await killcam.build_kill_replays(kill_db, session_start_time)
+    finally:
+        await kill_db.disconnect()
+
+
+# A claim is stale, and may be taken over, once its worker has not
+# heartbeated for this many seconds.
+STALE_CLAIM_SECONDS = 600
+HEARTBEAT_SECONDS = 30
+
+CLAIM_QUERY = """
+    UPDATE tacview_files t
+    SET process_start = CURRENT_TIMESTAMP,
+        process_end = NULL,
+        worker_id = $1,
+        heartbeat = CURRENT_TIMESTAMP
+    FROM (
+        SELECT file_name, process_start IS NOT NULL AS reclaimed
+        FROM tacview_files
+        WHERE processed = FALSE AND (
+            (process_start IS NULL AND
+             session_start_time NOT IN (
+                SELECT start_time
+                FROM session
+                WHERE status IN ('In Progress', 'Success'))) OR
+            (process_start IS NOT NULL AND process_end IS NULL AND
+             COALESCE(heartbeat, process_start) <
+                CURRENT_TIMESTAMP - make_interval(secs => $2)))
+        ORDER BY session_start_time DESC
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ) claim
+    WHERE t.file_name = claim.file_name
+    RETURNING t.file_name, t.session_start_time, claim.reclaimed
+"""
+
+
+METRICS_UPDATE = f"""
+    UPDATE tacview_files
+    SET heartbeat = CURRENT_TIMESTAMP,
+        {', '.join(f'{col} = ${i}' for i, col in enumerate(METRIC_COLUMNS, 3))}
+    WHERE file_name = $1 AND worker_id = $2
+"""
+
+
+async def heartbeat(file_name: str, worker_id: str,
+                    metrics: IngestMetrics) -> None:
+    """Keep a claim fresh so other workers do not take it over.
+
+    Each beat also records the ingest's progress so far.
+    """
+    con = await asyncpg.connect(DATABASE_URL)
+    try:
+        while True:
+            await con.execute(METRICS_UPDATE, file_name, worker_id,
+                              *metrics.values())
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+    finally:
+        await con.close()
+
+
+async def while_beating(aw, beat: asyncio.Task):
+    """Await aw, cancelling it and raising if the heartbeat stops first.
+
+    A worker whose heartbeat died would otherwise keep writing a session
+    that another worker may already have reclaimed and be overwriting.
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        await asyncio.wait({task, beat}, return_when=asyncio.FIRST_COMPLETED)
+    except CancelledError:
+        task.cancel()
+        raise
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise RuntimeError(f"Heartbeat stopped: {beat.exception()!r}")
+    return task.result()
+
+
+async def refresh_session(con, session_start_time) -> None:
+    """Analyze the tacview tables and refresh kills for an ingested session.
+
+    Failures are logged but do not fail the ingest: the session is already
+    written, and the kill refresh of the next ingest covers it again.
+    """
+    try:
+        await con.execute("ANALYZE object; ANALYZE event; ANALYZE impact;")
+    except Exception as err:
+        log.error(f"Error analyzing tacview tables: {err}")
+    try:
+        await refresh_kills(session_start_time)
+    except Exception as err:
+        log.error(f"Error refreshing kills for {session_start_time}: {err}")
+
+
+async def proc_tac(worker_id: str,
+                   stale_after: int = STALE_CLAIM_SECONDS):
+    """Claim and process a single tacview file, returning None if none is due.
+
+    Files are claimed with SKIP LOCKED, so any number of workers, in this or
+    other replicas, can share the queue. Files whose worker stopped
+    heartbeating are reclaimed and their partial session overwritten.
+    """
     con = await asyncpg.connect(DATABASE_URL)
     await con.execute("SET application_name = tacview_reader;")
-    rec  = await con.fetchval(
-                """WITH tmp as (
-                    SELECT file_name
-                    FROM tacview_files
-                    WHERE processed = FALSE AND
-                        process_start IS NULL AND
-                        session_start_time NOT IN (
-                            SELECT start_time
-                            FROM session
-                            WHERE status IN ('In Progress', 'Success'))
-            )
-            UPDATE tacview_files SET process_start = CURRENT_TIMESTAMP
-            WHERE file_name = (SELECT file_name
-                                FROM tmp
-                                ORDER BY session_start_time DESC
-                                LIMIT 1)
-            returning file_name
-    """)
+    rec = await con.fetchrow(CLAIM_QUERY, worker_id, float(stale_after))
     if not rec:
         await con.close()
-        return
-    bucket = gcs.get_gcs_bucket()
-    log.info(f"Parsing {rec}")
-    local_path = Path('horrible').joinpath(rec)
-    local_path.parent.mkdir(exist_ok=True, parents=True)
-    blob = bucket.get_blob(rec)
-    log.info(f"Downloading blob object to file: {local_path}....")
-    fp_ = local_path.open('wb')
-    blob.download_to_file(fp_)
-    fp_.close()
-
-    log.info("Download complete...creating server task...")
-    server = asyncio.create_task(serve_file.serve_file(local_path, 5555))
-
-    reader = asyncio.create_task(
-        client.consumer(host='127.0.0.1', port=5555,
-                        max_iters=None,
-                        client_password="tacview-client",
-                        client_username="0",
-                        overwrite=False,
-                        batch_size=100000))
+        return None
+    rec, session_start_time, reclaimed = (rec['file_name'],
+                                          rec['session_start_time'],
+                                          rec['reclaimed'])
+    log.info(f"Worker {worker_id} parsing {rec}"
+             f"{' (reclaimed stale claim)' if reclaimed else ''}")
+    metrics = IngestMetrics()
+    beat = reader = None
     try:
-        await asyncio.gather(reader)
+        # A failed download is recorded against the file like any other
+        # error, so the claim is released rather than kept fresh and retried.
+        beat = asyncio.create_task(heartbeat(rec, worker_id, metrics))
+        local_path = Path('horrible').joinpath(rec)
+        log.info(f"Fetching blob object to file: {local_path}....")
+        start = time.perf_counter()
+        await while_beating(asyncio.get_event_loop().run_in_executor(
+            None, gcs.get_blob_cache().fetch, rec, local_path), beat)
+        metrics.download_secs = time.perf_counter() - start
+
+        log.info("Download complete...starting reader...")
+        reader = asyncio.create_task(
+            consume_file(local_path, overwrite=reclaimed, batch_size=100000,
+                         metrics=metrics))
+        await while_beating(reader, beat)
         log.info('Reader complete...updating database...')
+        metrics.objects_read = await con.fetchval(
+            """SELECT COUNT(*) FROM object
+               WHERE session_id IN (SELECT session_id FROM session
+                                    WHERE start_time = $1)""",
+            session_start_time)
         await con.execute(f"""UPDATE tacview_files
                             SET processed = TRUE,
                             process_end = CURRENT_TIMESTAMP
                             WHERE file_name = $1""", rec)
-        await con.execute("ANALYZE object; ANALYZE event; ANALYZE impact;")
+        start = time.perf_counter()
+        await refresh_session(con, session_start_time)
+        metrics.refresh_secs = time.perf_counter() - start
+        beat.cancel()
+        await con.execute(METRICS_UPDATE, rec, worker_id, *metrics.values())
         log.info('File processed successfully!')
 
         exit_status = 0
     except CancelledError:
-        reader.cancel()
+        if reader is not None:
+            reader.cancel()
         exit_status = -1
     except Exception as err:
         log.error(err)
+        beat.cancel()
+        await con.execute(METRICS_UPDATE, rec, worker_id, *metrics.values())
         await con.execute(f"""UPDATE tacview_files
                     SET processed = FALSE,
                     process_end = CURRENT_TIMESTAMP,
                     errors = 1
-                    WHERE file_name = $1""", rec)
+                    WHERE file_name = $1 AND worker_id = $2""",
+                          rec, worker_id)
         exit_status = 0
     finally:
-        log.info('Canceling fileserver...')
-        server.cancel()
+        if beat is not None:
+            beat.cancel()
         await con.close()
     return exit_status
 
 
+async def tac_worker(worker_id: str, interval: int,
+                     stale_after: int) -> int:
+    """Process tacview files until the queue is empty, then poll every interval."""
+    while True:
+        result = await proc_tac(worker_id, stale_after)
+        if result == -1:
+            return -1
+        if result is None:
+            log.info(f"Worker {worker_id} idle...sleeping for {interval}")
+            await asyncio.sleep(interval)
+
+
+def run_tac_worker(index: int, interval: int,
+                   stale_after: int) -> None:
+    """Entry point for a tacview worker process."""
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    uvloop.install()
+    # Never reuse the loop inherited from the parent across fork.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            sig, lambda sig=sig: asyncio.create_task(shutdown(sig, loop)))
+    task = loop.create_task(tac_worker(worker_id, interval, stale_after))
+    try:
+        result = loop.run_until_complete(task)
+    except (CancelledError, RuntimeError):
+        result = -1
+    sys.exit(1 if result == -1 else 0)
+
+
+async def sync_tac():
+    """Create tacview and kill tables and sync the tacview file listing from GCS."""
+    await db.create_tables()
+    create_tables()
+    return await update_files("tacview", tacview_files)
+
+
 async def shutdown(signal, loop):
     log.info(f"Received exit signal {signal.name}...")
     tasks = [t for t in asyncio.all_tasks() if t is not
@@ -148,9 +299,19 @@ if __name__=='__main__':
                             'should be updated')
     parser.add_argument('--interval', type=int, default=120,
                         help='Number of seconds between updates.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of concurrent tacview worker processes.')
+    parser.add_argument('--stale-after', type=int, default=STALE_CLAIM_SECONDS,
+                        help='Seconds without a heartbeat after which a '
+                             'tacview claim is taken over.')
     args = parser.parse_args()
 
     table = TABLE_KEY[args.prefix]
+    workers = []
+    if args.prefix == 'tacview':
+        workers = [Process(target=run_tac_worker,
+                           args=(i, args.interval, args.stale_after))
+                   for i in range(args.workers)]
     uvloop.install()
     loop = asyncio.get_event_loop()
     signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
@@ -158,14 +319,32 @@ if __name__=='__main__':
         loop.add_signal_handler(
             sig, lambda sig=sig: asyncio.create_task(shutdown(sig, loop)))
 
-    while True:
-        if args.prefix == 'tacview':
-            task = loop.create_task(proc_tac())
-        else:
-            task = loop.create_task(update_files(args.prefix, table))
-        result = loop.run_until_complete(asyncio.gather(task))
-        log.info(result)
-        if result and result[0] == -1:
-            sys.exit(1)
-        log.info(f'Sleeping for {args.interval}')
-        loop.run_until_complete(asyncio.gather(asyncio.sleep(args.interval)))
+    started = False
+    try:
+        while True:
+            if args.prefix == 'tacview':
+                task = loop.create_task(sync_tac())
+            else:
+                task = loop.create_task(update_files(args.prefix, table))
+            result = loop.run_until_complete(asyncio.gather(task))
+            log.info(result)
+            if result and result[0] == -1:
+                sys.exit(1)
+            if not started:
+                # Workers start once the tables exist and the first sync is done.
+                for worker in workers:
+                    worker.start()
+                started = True
+            for i, worker in enumerate(workers):
+                if not worker.is_alive():
+                    log.warning(f"Tacview worker {i} exited...restarting...")
+                    workers[i] = Process(target=run_tac_worker,
+                                         args=(i, args.interval, args.stale_after))
+                    workers[i].start()
+            log.info(f'Sleeping for {args.interval}')
+            loop.run_until_complete(asyncio.gather(asyncio.sleep(args.interval)))
+    finally:
+        # Workers are not signalled by the orchestrator, only this process.
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
@@ -0,0 +1,78 @@
+"""In-process result caching, invalidated when new files are ingested."""
+import inspect
+from functools import wraps
+from typing import Dict
+
+from cachetools import TTLCache
+
+from horrible.config import get_logger
+
+log = get_logger('cache')
+
+
+def _freeze(value):
+    """Make list arguments usable as part of a cache key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class WatermarkCache:
+    """TTL cache whose entries are all dropped when the ingest watermark moves.
+
+    The watermark is whatever row watermark_query returns; it should be cheap
+    to compute and change whenever the underlying data does.
+    """
+
+    def __init__(self, watermark_query: str, maxsize: int = 64, ttl: int = 900):
+        self.watermark_query = watermark_query
+        self.entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.watermark = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def check_watermark(self, db) -> None:
+        """Clear all entries if the watermark has moved since the last check."""
+        row = await db.fetch_one(self.watermark_query)
+        watermark = tuple(row.values())
+        if watermark != self.watermark:
+            if self.watermark is not None:
+                log.info(f"Watermark moved to {watermark}...clearing "
+                         f"{len(self.entries)} cached results.")
+                self.invalidations += 1
+            self.entries.clear()
+            self.watermark = watermark
+
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': len(self.entries),
+            'watermark': [str(w) for w in self.watermark or []],
+        }
+
+    def cached(self, func):
+        """Cache a coroutine returning a DataFrame, keyed on all args but db."""
+        sig = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            await self.check_watermark(bound.arguments['db'])
+            key = (func.__name__,) + tuple(
+                (name, _freeze(value))
+                for name, value in bound.arguments.items() if name != 'db')
+            try:
+                result = self.entries[key]
+                self.hits += 1
+            except KeyError:
+                self.misses += 1
+                result = await func(*args, **kwargs)
+                self.entries[key] = result
+            # Callers sort and rename in place, so never hand out the original.
+            return result.copy()
+
+        return wrapper
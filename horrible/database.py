@@ -1,12 +1,14 @@
 import datetime
+import json
 import logging
 from pathlib import Path
 import re
-from typing import Optional
+from typing import Dict, List, Optional
 import pytz
 
 from starlette.config import Config
 import sqlalchemy
+from sqlalchemy.dialects.postgresql import JSONB
 
 
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +34,87 @@ def create_tables():
         LOG.error(err)
 
 
+def migrate_tables():
+    """Bring tables created by earlier versions up to date.
+
+    json record columns are converted to jsonb in place, and columns and
+    indexes added since are created, as create_tables skips existing tables.
+    """
+    try:
+        eng = sqlalchemy.create_engine(DATABASE_URL)
+        with eng.begin() as con:
+            for table in [mission_stats, mission_events]:
+                data_type = con.execute(
+                    sqlalchemy.text("""SELECT data_type
+                                       FROM information_schema.columns
+                                       WHERE table_name = :table AND
+                                           column_name = 'record'"""),
+                    table=table.name).scalar()
+                if data_type == 'json':
+                    LOG.info(f"Migrating {table.name}.record to jsonb...")
+                    con.execute(f"""ALTER TABLE {table.name}
+                                    ALTER COLUMN record TYPE jsonb
+                                    USING record::jsonb""")
+            con.execute("""CREATE INDEX IF NOT EXISTS mission_events_type_idx
+                           ON mission_events ((record->>'type'))""")
+            con.execute("""ALTER TABLE frametime_files
+                           ADD COLUMN IF NOT EXISTS error_msg VARCHAR(500)""")
+            ts_fps_type = con.execute(
+                sqlalchemy.text("""SELECT data_type
+                                   FROM information_schema.columns
+                                   WHERE table_name = 'frametimes' AND
+                                       column_name = 'ts_fps'""")).scalar()
+            if ts_fps_type == 'integer':
+                con.execute("ALTER TABLE frametimes ALTER COLUMN ts_fps TYPE float")
+            for col in ['fps_p1', 'fps_p50', 'fps_p99']:
+                con.execute(f"""ALTER TABLE frametimes
+                                ADD COLUMN IF NOT EXISTS {col} float""")
+            con.execute("""CREATE INDEX IF NOT EXISTS frametimes_file_idx
+                           ON frametimes (file_name)""")
+            con.execute("""ALTER TABLE tacview_files
+                           ADD COLUMN IF NOT EXISTS worker_id VARCHAR(200),
+                           ADD COLUMN IF NOT EXISTS heartbeat TIMESTAMP""")
+            con.execute("""CREATE INDEX IF NOT EXISTS mission_stats_pilot_idx
+                           ON mission_stats (pilot)""")
+            con.execute("""ALTER TABLE mission_stat_files
+                           ADD COLUMN IF NOT EXISTS facts_backfilled
+                               boolean DEFAULT FALSE""")
+            con.execute("""ALTER TABLE tacview_files
+                           ADD COLUMN IF NOT EXISTS bytes_total BIGINT,
+                           ADD COLUMN IF NOT EXISTS bytes_read BIGINT,
+                           ADD COLUMN IF NOT EXISTS lines_read BIGINT,
+                           ADD COLUMN IF NOT EXISTS events_read BIGINT,
+                           ADD COLUMN IF NOT EXISTS objects_read INTEGER,
+                           ADD COLUMN IF NOT EXISTS flush_count INTEGER,
+                           ADD COLUMN IF NOT EXISTS flush_secs float,
+                           ADD COLUMN IF NOT EXISTS flush_max_secs float,
+                           ADD COLUMN IF NOT EXISTS download_secs float,
+                           ADD COLUMN IF NOT EXISTS read_secs float,
+                           ADD COLUMN IF NOT EXISTS parse_secs float,
+                           ADD COLUMN IF NOT EXISTS ingest_secs float,
+                           ADD COLUMN IF NOT EXISTS refresh_secs float""")
+    except Exception as err:
+        LOG.error(err)
+
+
+async def copy_rows(con, table: sqlalchemy.Table, rows: List[Dict]) -> None:
+    """Bulk load dict rows into table with a single binary COPY.
+
+    con is a raw asyncpg connection. JSON columns are serialized here since
+    COPY bypasses the sqlalchemy type processors.
+    """
+    columns = [c.name for c in table.columns]
+    json_cols = {c.name for c in table.columns
+                 if isinstance(c.type, sqlalchemy.JSON)}
+    records = [
+        tuple(json.dumps(row.get(col)) if col in json_cols else row.get(col)
+              for col in columns)
+        for row in rows
+    ]
+    await con.copy_records_to_table(table.name, records=records,
+                                    columns=columns)
+
+
 def convert_to_utc(ts):
     if ts > datetime.datetime(2020, 3, 20, 1, 1, 1):
         tzone = pytz.timezone('US/Mountain')
@@ -103,6 +186,8 @@ stat_files = sqlalchemy.Table(
     sqlalchemy.Column("process_end", sqlalchemy.TIMESTAMP()),
     sqlalchemy.Column("errors", sqlalchemy.Integer),
     sqlalchemy.Column("error_msg", sqlalchemy.String()),
+    sqlalchemy.Column("facts_backfilled", sqlalchemy.Boolean(),
+                      server_default=sqlalchemy.false()),
 )
 
 
@@ -113,7 +198,25 @@ mission_stats = sqlalchemy.Table(
                       sqlalchemy.ForeignKey('mission_stat_files.file_name')),
     sqlalchemy.Column("pilot", sqlalchemy.String()),
     sqlalchemy.Column("pilot_id", sqlalchemy.Integer),
-    sqlalchemy.Column("record", sqlalchemy.JSON())
+    sqlalchemy.Column("record", JSONB()),
+    sqlalchemy.Index("mission_stats_pilot_idx", "pilot"),
+)
+
+mission_stat_facts = sqlalchemy.Table(
+    "mission_stat_facts",
+    metadata,
+    sqlalchemy.Column("file_name", sqlalchemy.String(),
+                      sqlalchemy.ForeignKey('mission_stat_files.file_name',
+                                            ondelete='CASCADE')),
+    sqlalchemy.Column("pilot", sqlalchemy.String()),
+    sqlalchemy.Column("session_start_date", sqlalchemy.Date()),
+    sqlalchemy.Column("stat_group", sqlalchemy.String()),
+    sqlalchemy.Column("category", sqlalchemy.String()),
+    sqlalchemy.Column("metric", sqlalchemy.String()),
+    sqlalchemy.Column("equipment", sqlalchemy.String()),
+    sqlalchemy.Column("value", sqlalchemy.Integer),
+    sqlalchemy.Index("mission_stat_facts_file_idx", "file_name"),
+    sqlalchemy.Index("mission_stat_facts_date_idx", "session_start_date"),
 )
 
 event_files = sqlalchemy.Table(
@@ -136,9 +239,12 @@ mission_events = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("file_name", sqlalchemy.String(),
                       sqlalchemy.ForeignKey('mission_event_files.file_name')),
-    sqlalchemy.Column("record", sqlalchemy.JSON())
+    sqlalchemy.Column("record", JSONB())
 )
 
+sqlalchemy.Index("mission_events_type_idx",
+                 mission_events.c.record['type'].astext)
+
 
 frametime_files = sqlalchemy.Table(
     "frametime_files", metadata,
@@ -149,7 +255,8 @@ frametime_files = sqlalchemy.Table(
     sqlalchemy.Column("processed", sqlalchemy.Boolean()),
     sqlalchemy.Column("process_start", sqlalchemy.TIMESTAMP()),
     sqlalchemy.Column("process_end", sqlalchemy.TIMESTAMP()),
-    sqlalchemy.Column("errors", sqlalchemy.Integer))
+    sqlalchemy.Column("errors", sqlalchemy.Integer),
+    sqlalchemy.Column("error_msg", sqlalchemy.String()))
 
 
 tacview_files = sqlalchemy.Table(
@@ -161,7 +268,22 @@ tacview_files = sqlalchemy.Table(
     sqlalchemy.Column("processed", sqlalchemy.Boolean()),
     sqlalchemy.Column("process_start", sqlalchemy.TIMESTAMP()),
     sqlalchemy.Column("process_end", sqlalchemy.TIMESTAMP()),
-    sqlalchemy.Column("errors", sqlalchemy.Integer))
+    sqlalchemy.Column("errors", sqlalchemy.Integer),
+    sqlalchemy.Column("worker_id", sqlalchemy.String()),
+    sqlalchemy.Column("heartbeat", sqlalchemy.TIMESTAMP()),
+    sqlalchemy.Column("bytes_total", sqlalchemy.BigInteger),
+    sqlalchemy.Column("bytes_read", sqlalchemy.BigInteger),
+    sqlalchemy.Column("lines_read", sqlalchemy.BigInteger),
+    sqlalchemy.Column("events_read", sqlalchemy.BigInteger),
+    sqlalchemy.Column("objects_read", sqlalchemy.Integer),
+    sqlalchemy.Column("flush_count", sqlalchemy.Integer),
+    sqlalchemy.Column("flush_secs", sqlalchemy.Float()),
+    sqlalchemy.Column("flush_max_secs", sqlalchemy.Float()),
+    sqlalchemy.Column("download_secs", sqlalchemy.Float()),
+    sqlalchemy.Column("read_secs", sqlalchemy.Float()),
+    sqlalchemy.Column("parse_secs", sqlalchemy.Float()),
+    sqlalchemy.Column("ingest_secs", sqlalchemy.Float()),
+    sqlalchemy.Column("refresh_secs", sqlalchemy.Float()))
 
 
 frametimes = sqlalchemy.Table(
@@ -170,10 +292,41 @@ frametimes = sqlalchemy.Table(
     sqlalchemy.Column("file_name", sqlalchemy.String(),
                       sqlalchemy.ForeignKey('frametime_files.file_name')),
     sqlalchemy.Column("frame_ts", sqlalchemy.TIMESTAMP()),
-    sqlalchemy.Column("ts_fps", sqlalchemy.FLOAT())
+    sqlalchemy.Column("ts_fps", sqlalchemy.FLOAT()),
+    sqlalchemy.Column("fps_p1", sqlalchemy.FLOAT()),
+    sqlalchemy.Column("fps_p50", sqlalchemy.FLOAT()),
+    sqlalchemy.Column("fps_p99", sqlalchemy.FLOAT()),
+    sqlalchemy.Index("frametimes_file_idx", "file_name"),
+)
+
+frametime_rollups = sqlalchemy.Table(
+    "frametime_rollups",
+    metadata,
+    sqlalchemy.Column("file_name", sqlalchemy.String(),
+                      sqlalchemy.ForeignKey('frametime_files.file_name',
+                                            ondelete='CASCADE')),
+    sqlalchemy.Column("resolution", sqlalchemy.Integer),
+    sqlalchemy.Column("frame_ts", sqlalchemy.TIMESTAMP()),
+    sqlalchemy.Column("ts_fps", sqlalchemy.FLOAT()),
+    sqlalchemy.Column("fps_p1", sqlalchemy.FLOAT()),
+    sqlalchemy.Column("fps_p50", sqlalchemy.FLOAT()),
+    sqlalchemy.Column("fps_p99", sqlalchemy.FLOAT()),
+    sqlalchemy.Index("frametime_rollups_file_idx", "file_name", "resolution",
+                     "frame_ts"),
 )
 
 
+gcs_sync_state = sqlalchemy.Table(
+    "gcs_sync_state", metadata,
+    sqlalchemy.Column("prefix", sqlalchemy.String(), primary_key=True),
+    sqlalchemy.Column("watermark", sqlalchemy.TIMESTAMP()),
+    sqlalchemy.Column("last_sync", sqlalchemy.TIMESTAMP()),
+    sqlalchemy.Column("sync_seconds", sqlalchemy.Float()),
+    sqlalchemy.Column("blobs_scanned", sqlalchemy.Integer),
+    sqlalchemy.Column("blobs_diffed", sqlalchemy.Integer),
+    sqlalchemy.Column("blobs_changed", sqlalchemy.Integer))
+
+
 file_format_ref = {
     'mission-stats': parse_mission_stat_ts,
     'frametime': parse_frametime_ts,
@@ -182,3 +335,50 @@ file_format_ref = {
 }
 
 
+# Materialized copy of the tacview impacts_valid view, rebuilt per session by
+# killcam.refresh_kill_table.
+tacview_kills = sqlalchemy.Table(
+    "tacview_kills", metadata,
+    sqlalchemy.Column("kill_timestamp", sqlalchemy.TIMESTAMP(timezone=True)),
+    sqlalchemy.Column("start_time", sqlalchemy.TIMESTAMP(timezone=True)),
+    sqlalchemy.Column("killer_name", sqlalchemy.String()),
+    sqlalchemy.Column("killer_type", sqlalchemy.String()),
+    sqlalchemy.Column("killer_id", sqlalchemy.Integer),
+    sqlalchemy.Column("target_name", sqlalchemy.String()),
+    sqlalchemy.Column("target_type", sqlalchemy.String()),
+    sqlalchemy.Column("target_id", sqlalchemy.Integer),
+    sqlalchemy.Column("weapon_name", sqlalchemy.String()),
+    sqlalchemy.Column("weapon_type", sqlalchemy.String()),
+    sqlalchemy.Column("weapon_id", sqlalchemy.Integer),
+    sqlalchemy.Column("impact_id", sqlalchemy.Integer),
+    sqlalchemy.Column("weapon_first_time", sqlalchemy.REAL()),
+    sqlalchemy.Column("weapon_last_time", sqlalchemy.REAL()),
+    sqlalchemy.Column("session_id", sqlalchemy.Integer),
+    sqlalchemy.Column("impact_dist", sqlalchemy.Numeric()),
+    sqlalchemy.Column("kill_duration", sqlalchemy.Numeric()),
+    sqlalchemy.Column("weapon_color", sqlalchemy.String()),
+    sqlalchemy.Column("target_color", sqlalchemy.String()),
+    sqlalchemy.Column("killer_color", sqlalchemy.String()),
+    sqlalchemy.Column("first_seen", sqlalchemy.REAL()),
+    sqlalchemy.Column("last_seen", sqlalchemy.REAL()),
+    sqlalchemy.Index("tacview_kills_impact_id_idx", "impact_id", unique=True),
+    sqlalchemy.Index("tacview_kills_session_idx", "session_id"),
+)
+
+sqlalchemy.Index("tacview_kills_listing_idx",
+                 tacview_kills.c.kill_timestamp.desc(),
+                 postgresql_where=sqlalchemy.text(
+                     "weapon_type IS NOT NULL AND impact_dist <= 5 AND "
+                     "kill_duration > 1 AND kill_duration < 120"))
+
+
+kill_replays = sqlalchemy.Table(
+    "kill_replays", metadata,
+    sqlalchemy.Column("impact_id", sqlalchemy.Integer, primary_key=True,
+                      autoincrement=False),
+    sqlalchemy.Column("session_id", sqlalchemy.Integer),
+    sqlalchemy.Column("created", sqlalchemy.TIMESTAMP(),
+                      server_default=sqlalchemy.func.current_timestamp()),
+    sqlalchemy.Column("payload", sqlalchemy.LargeBinary(), nullable=False),
+    sqlalchemy.Index("kill_replays_session_idx", "session_id"),
+)
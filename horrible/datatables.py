@@ -0,0 +1,111 @@
+"""Server-side processing for DataTables requests.
+
+When a request carries DataTables' draw/start/length/order/search parameters
+the table is paged, sorted and filtered in SQL rather than in the browser.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+
+from horrible.config import get_logger
+
+log = get_logger('datatables')
+
+MAX_PAGE_LENGTH = 1000
+
+
+class DataTableParams(NamedTuple):
+    draw: int
+    start: int
+    length: int
+    order: List[Tuple[int, str]]
+    search: str
+
+
+def _int_param(query_params, name: str, default: int = 0) -> int:
+    try:
+        return int(query_params.get(name, default))
+    except ValueError:
+        raise HTTPException(status_code=400,
+                            detail=f"{name} must be an integer")
+
+
+def parse_datatable_params(query_params) -> Optional[DataTableParams]:
+    """Parse DataTables server-side parameters, or None if not requested.
+
+    Malformed parameters raise a 400.
+    """
+    if 'draw' not in query_params:
+        return None
+    order = []
+    i = 0
+    while f"order[{i}][column]" in query_params:
+        direction = query_params.get(f"order[{i}][dir]", 'asc').lower()
+        order.append((_int_param(query_params, f"order[{i}][column]"),
+                      'desc' if direction == 'desc' else 'asc'))
+        i += 1
+    draw = _int_param(query_params, 'draw')
+    start = _int_param(query_params, 'start')
+    if draw < 0 or start < 0:
+        raise HTTPException(status_code=400,
+                            detail="draw and start must not be negative")
+    # DataTables sends -1 for 'show all'; pages are capped either way.
+    length = _int_param(query_params, 'length', 50)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+    return DataTableParams(
+        draw=draw,
+        start=start,
+        length=length,
+        order=order,
+        search=query_params.get('search[value]', '').strip())
+
+
+def _titles(columns: List[str]) -> List[Dict]:
+    return [{'title': c.replace("_", " ").title()} for c in columns]
+
+
+async def query_datatable(db, base_query: str, columns: List[str],
+                          params: DataTableParams,
+                          key: Optional[str] = None) -> Dict:
+    """Page, sort and filter base_query in SQL.
+
+    columns are the output columns of base_query, in display order. key, a
+    unique column, breaks ties so pages are stable. Pages are selected with
+    OFFSET, as DataTables addresses them by row offset and any column can
+    be sorted on.
+    """
+    values: Dict = {}
+    where = ''
+    if params.search:
+        where = 'WHERE (' + ' OR '.join(
+            f"CAST({col} AS TEXT) ILIKE :search" for col in columns) + ')'
+        values['search'] = f"%{params.search}%"
+
+    order = [(columns[idx], direction) for idx, direction in params.order
+             if 0 <= idx < len(columns)]
+    order_by = ', '.join(f"{col} {direction}" for col, direction in order)
+    if key and key not in [col for col, _ in order]:
+        order_by = f"{order_by}, {key}" if order_by else key
+
+    total = await db.fetch_val(f"SELECT COUNT(*) FROM ({base_query}) t")
+    if params.search:
+        filtered = await db.fetch_val(
+            f"SELECT COUNT(*) FROM ({base_query}) t {where}",
+            values=values)
+    else:
+        filtered = total
+
+    rows = await db.fetch_all(
+        f"""SELECT {', '.join(columns)} FROM ({base_query}) t {where}
+            {'ORDER BY ' + order_by if order_by else ''}
+            LIMIT :length OFFSET :start""",
+        values={**values, 'length': params.length, 'start': params.start})
+    return {
+        'draw': params.draw,
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'data': [[row[col] for col in columns] for row in rows],
+        'columns': _titles(columns),
+    }
+
@@ -1,30 +1,121 @@
-# import datetime
-# import logging
-# import json
-# import re
-# from pathlib import Path
-# import threading
-# import traceback
-# from typing import List, Dict, NoReturn
-#
-# import asyncpg
-# from lupa import LuaRuntime
-# import numpy as np
-# import pandas as pd
-# import sqlalchemy as sa
-#
-# from . import db, frametimes, frametime_files, get_gcs_bucket
-#
-#
-# logging.basicConfig(level=logging.INFO)
-# log = logging.getLogger(__name__)
-# log.setLevel(level=logging.INFO)
-#
-#
-# def parse_frametimes() -> NoReturn:
-#
-#     """Collect a list of frametime export files and compute framerate for each
-#         line, writing the results to a database.
-#     """
-#     bucket = get_gcs_bucket()
-#     framefiles = bucket.client.list_blobs(bucket, prefix="frametime/")
+"""Per-second FPS rollups from fps_tracklog frametime logs.
+
+Each log line is the timestamp (epoch seconds) of a rendered frame. Files are
+read in fixed size chunks, so memory stays flat however long the session.
+"""
+import gzip
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from horrible.config import get_logger
+
+log = get_logger('frametime')
+
+CHUNK_BYTES = 8 * 1024**2
+PERCENTILES = [1, 50, 99]
+# Rollup resolutions in seconds, finest first.
+RESOLUTIONS = [1, 10, 60]
+
+
+def _open(file_name: Path):
+    with open(file_name, 'rb') as fp_:
+        magic = fp_.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(file_name, 'rb')
+    return open(file_name, 'rb')
+
+
+def iter_frame_times(file_name: Path,
+                     chunk_bytes: int = CHUNK_BYTES) -> Iterator[np.ndarray]:
+    """Yield arrays of frame timestamps, parsing chunk_bytes of text at a time."""
+    tail = b''
+    with _open(file_name) as fp_:
+        while True:
+            chunk = fp_.read(chunk_bytes)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            # Hold back a possibly partial trailing number for the next chunk.
+            cut = max(chunk.rfind(b'\n'), chunk.rfind(b' '))
+            if cut == -1:
+                tail = chunk
+                continue
+            chunk, tail = chunk[:cut], chunk[cut + 1:]
+            times = np.fromstring(chunk.decode(), sep=' ')
+            if times.size:
+                yield times
+    if tail.strip():
+        yield np.fromstring(tail.decode(), sep=' ')
+
+
+def group_percentiles(keys: np.ndarray, values: np.ndarray,
+                      percentiles: List[int]):
+    """Linear-interpolated percentiles of values within runs of equal keys.
+
+    keys must be sorted. Returns the unique keys, their counts and one array
+    per percentile, without a Python loop over groups.
+    """
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    uniq, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    out = []
+    for pct in percentiles:
+        pos = starts + (counts - 1) * pct / 100
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, starts + counts - 1)
+        frac = pos - lo
+        out.append(values[lo] + (values[hi] - values[lo]) * frac)
+    return uniq, counts, out
+
+
+def frametime_batches(file_name: Path,
+                      chunk_bytes: int = CHUNK_BYTES) -> Iterator[List[Dict]]:
+    """Yield rollup rows of frame counts and FPS percentiles at each resolution.
+
+    Rows carry their resolution in seconds: 1 second rows belong in
+    frametimes, coarser ones in frametime_rollups. ts_fps is the average FPS
+    over the interval; fps_p1/p50/p99 are percentiles of the instantaneous
+    frame rate. An interval may continue into the next chunk, so its frames
+    are carried over rather than rolled up early.
+    """
+    prev_time = None
+    carry = {res: (np.empty(0), np.empty(0)) for res in RESOLUTIONS}
+
+    def rollup(res, keys, fps) -> List[Dict]:
+        uniq, counts, (p1, p50, p99) = group_percentiles(keys, fps, PERCENTILES)
+        frame_ts = pd.to_datetime(uniq, unit='s').to_pydatetime()
+        return [{'file_name': str(file_name), 'resolution': res, 'frame_ts': ts,
+                 'ts_fps': n / res, 'fps_p1': float(a), 'fps_p50': float(b),
+                 'fps_p99': float(c)}
+                for ts, n, a, b, c in zip(frame_ts, counts, p1, p50, p99)]
+
+    for times in iter_frame_times(file_name, chunk_bytes):
+        if prev_time is not None:
+            times = np.concatenate([[prev_time], times])
+        prev_time = times[-1]
+        deltas = np.diff(times)
+        # Repeated or out of order stamps would give infinite/negative FPS.
+        valid = deltas > 0
+        new_secs = times[1:][valid]
+        new_fps = 1.0 / deltas[valid]
+        rows: List[Dict] = []
+        for res in RESOLUTIONS:
+            keys = np.concatenate([carry[res][0],
+                                   np.floor(new_secs / res) * res])
+            fps = np.concatenate([carry[res][1], new_fps])
+            if not keys.size:
+                continue
+            done = keys < keys[-1]
+            carry[res] = (keys[~done], fps[~done])
+            if done.any():
+                rows.extend(rollup(res, keys[done], fps[done]))
+        if rows:
+            yield rows
+
+    rows = [row for res in RESOLUTIONS if carry[res][0].size
+            for row in rollup(res, *carry[res])]
+    if rows:
+        yield rows
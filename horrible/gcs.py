@@ -1,9 +1,150 @@
+import hashlib
 import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+from typing import Callable, NamedTuple, Optional
+import uuid
+
 from google.cloud import storage
 
+from horrible.config import get_logger
+
+log = get_logger('gcs')
+
 
 def get_gcs_bucket(bucket="horrible-server"):
     """Initialize a client object and return a bucket."""
     client = storage.Client()
     return client.get_bucket(bucket)
 
+
+class BlobInfo(NamedTuple):
+    version: str
+    size: int
+    download: Callable[[Path], None]
+
+
+class GCSStorage:
+    """Blob storage backed by a GCS bucket."""
+
+    def __init__(self, bucket=None):
+        self.bucket = bucket or get_gcs_bucket()
+
+    def get(self, name: str) -> BlobInfo:
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            raise FileNotFoundError(name)
+        return BlobInfo(version=f"{blob.generation}-{blob.md5_hash}",
+                        size=blob.size or 0,
+                        download=blob.download_to_filename)
+
+
+class LocalStorage:
+    """Blob storage backed by a local directory, standing in for GCS."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def get(self, name: str) -> BlobInfo:
+        path = self.root.joinpath(name)
+        stat = path.stat()
+        return BlobInfo(version=f"{stat.st_mtime_ns}-{stat.st_size}",
+                        size=stat.st_size,
+                        download=lambda dest: shutil.copyfile(path, dest))
+
+
+class BlobCache:
+    """On-disk cache of downloaded blobs, keyed by name and blob version.
+
+    Entries are content addressed, so a re-uploaded blob gets a new entry and
+    the stale one ages out. Least recently used entries are evicted once the
+    cache grows beyond max_bytes. Destinations get their own copy, so
+    eviction always frees the space it counts.
+    """
+
+    def __init__(self, storage, cache_dir: Path = Path('.blob-cache'),
+                 max_bytes: int = 5 * 1024**3):
+        self.storage = storage
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+    def key(self, name: str, version: str) -> str:
+        return hashlib.sha1(f"{name}:{version}".encode()).hexdigest()
+
+    def fetch(self, name: str, dest: Optional[Path] = None) -> Path:
+        """Return a local copy of blob name, downloading only on a cache miss.
+
+        If dest is given, the cached file is also copied there. An entry
+        evicted between the lookup and the copy, here or by another process,
+        is treated as a miss.
+        """
+        info = self.storage.get(name)
+        cached = self.cache_dir.joinpath(self.key(name, info.version))
+        if dest is not None:
+            dest = Path(dest)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            try:
+                os.utime(cached)
+                if dest is not None:
+                    shutil.copyfile(cached, dest)
+            except FileNotFoundError:
+                pass
+            else:
+                self.hits += 1
+                log.info(f"Blob cache hit for {name}...")
+                return dest or cached
+
+        self.misses += 1
+        log.info(f"Blob cache miss for {name}...downloading...")
+        tmp_path = cached.with_name(f"{cached.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            info.download(tmp_path)
+            if dest is not None:
+                shutil.copyfile(tmp_path, dest)
+            with self._lock:
+                os.replace(tmp_path, cached)
+                self.evict(keep=cached)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return dest or cached
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """Remove least recently used entries until the cache fits max_bytes."""
+        with self._lock:
+            entries = [p for p in self.cache_dir.iterdir()
+                       if p.is_file() and p.suffix != '.tmp']
+            stats = {p: p.stat() for p in entries}
+            total = sum(s.st_size for s in stats.values())
+            for path in sorted(entries, key=lambda p: stats[p].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                log.info(f"Evicting {path.name} from blob cache...")
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= stats[path].st_size
+
+
+BLOB_CACHE: Optional[BlobCache] = None
+
+
+def get_blob_cache() -> BlobCache:
+    """Return the process-wide cache of blobs from the default GCS bucket."""
+    global BLOB_CACHE
+    if BLOB_CACHE is None:
+        BLOB_CACHE = BlobCache(
+            GCSStorage(),
+            cache_dir=Path(os.getenv('BLOB_CACHE_DIR', '.blob-cache')),
+            max_bytes=int(os.getenv('BLOB_CACHE_MAX_MB', '5000')) * 1024**2)
+    return BLOB_CACHE
@@ -1,49 +1,153 @@
-from typing import Dict
+import asyncio
+import gzip
+import json
+import random
+from typing import Dict, List, Optional
+
+from horrible import trajectory
 from horrible.config import get_logger
-from horrible.read_stats import dict_to_js_datatable_friendly_fmt
+from horrible.database import kill_replays, tacview_kills
 
 log = get_logger('killcam')
 
 
-async def get_all_kills(db) -> Dict:
-    """Get a table of all kills."""
-    log.info('Querying for all kills...')
-    data = await db.fetch_all("""SELECT
+KILL_TABLE = tacview_kills.name
+REPLAY_TABLE = kill_replays.name
+# Named rather than positional, as impacts_valid's column order follows the
+# tacview client's views.
+KILL_COLUMNS = ', '.join(c.name for c in tacview_kills.columns)
+
+# Default radius, in meters, within which other objects appear in a replay.
+KILL_RADIUS = 20000
+# Replays built at once after an ingest, each holding a database connection.
+REPLAY_CONCURRENCY = 4
+
+# Kills eligible for kill_id=-1.
+RANDOM_KILL_FILTER = """weapon_type = 'Air-to-Air' AND impact_dist < 10 AND
+                        kill_duration > 10 AND kill_duration < 120"""
+# Kills worth a replay: the listing filter, widened to also cover the pool
+# random kills are drawn from.
+REPLAY_FILTER = """weapon_type IS NOT NULL AND impact_dist < 10 AND
+                   kill_duration > 1 AND kill_duration < 120"""
+
+
+async def ensure_kill_table(db) -> None:
+    """Fill the kill table if it is empty.
+
+    The table itself is created with the others by database.create_tables.
+    """
+    populated = await db.fetch_val(f"SELECT EXISTS (SELECT 1 FROM {KILL_TABLE})")
+    if not populated:
+        await refresh_kill_table(db)
+
+
+async def refresh_kill_table(db, session_start_time=None) -> None:
+    """Rebuild kill rows from impacts_valid.
+
+    If session_start_time is given only sessions starting at that time are
+    rebuilt, otherwise the whole table is.
+    """
+    log.info(f"Refreshing {KILL_TABLE} for session: {session_start_time}...")
+    async with db.transaction():
+        if session_start_time is None:
+            await db.execute(f"TRUNCATE {KILL_TABLE}, {REPLAY_TABLE}")
+            await db.execute(f"""INSERT INTO {KILL_TABLE} ({KILL_COLUMNS})
+                                 SELECT {KILL_COLUMNS} FROM impacts_valid""")
+        else:
+            sessions = "SELECT session_id FROM session WHERE start_time = :start_time"
+            values = {'start_time': session_start_time}
+            await db.execute(f"""DELETE FROM {REPLAY_TABLE}
+                                 WHERE session_id IN ({sessions})""", values=values)
+            await db.execute(f"""DELETE FROM {KILL_TABLE}
+                                 WHERE session_id IN ({sessions})""", values=values)
+            await db.execute(f"""INSERT INTO {KILL_TABLE} ({KILL_COLUMNS})
+                                 SELECT {KILL_COLUMNS} FROM impacts_valid
+                                 WHERE session_id IN ({sessions})""", values=values)
+    await db.execute(f"ANALYZE {KILL_TABLE}")
+    log.info(f"{KILL_TABLE} refreshed...")
+
+
+KILLS_QUERY = f"""SELECT
             TO_CHAR(kill_timestamp, 'YYYY-MM-DD HH24:MI:SS') as kill_timestamp,
         killer_name, killer_type,
         weapon_name, weapon_type, target_name, target_type,
         impact_dist,
         kill_duration,
         impact_id as id
-        FROM impacts_valid
+        FROM {KILL_TABLE} kills
         WHERE weapon_type IS NOT NULL AND
             impact_dist <= 5 AND kill_duration > 1 AND
             kill_duration < 120 AND
-            ((killer_name in (SELECT DISTINCT pilot FROM mission_stats)) OR
-            (target_name in (SELECT DISTINCT pilot FROM mission_stats)))
-        ORDER BY kill_timestamp DESC
-    """)
-    log.info('Formatting and returning kills...')
-    return dict_to_js_datatable_friendly_fmt(data)
+            (EXISTS (SELECT 1 FROM mission_stats WHERE pilot = kills.killer_name) OR
+             EXISTS (SELECT 1 FROM mission_stats WHERE pilot = kills.target_name))
+    """
+KILLS_COLUMNS = ['kill_timestamp', 'killer_name', 'killer_type', 'weapon_name',
+                 'weapon_type', 'target_name', 'target_type', 'impact_dist',
+                 'kill_duration', 'id']
 
 
-async def get_kill(kill_id: int, db):
-    """Return coordinates for a single kill-id."""
-    if kill_id == -1:
+class RandomKillPool:
+    """In-memory list of kill ids eligible for random replay.
+
+    The list is reloaded whenever the highest impact_id in the kill table
+    changes, ie after new tacview data lands.
+    """
+
+    def __init__(self):
+        self.kill_ids: List[int] = []
+        self.watermark = None
+
+    async def refresh(self, db, force: bool = False) -> None:
+        watermark = await db.fetch_val(f"SELECT MAX(impact_id) FROM {KILL_TABLE}")
+        if watermark == self.watermark and not force:
+            return
+        rows = await db.fetch_all(
+            f"SELECT impact_id FROM {KILL_TABLE} WHERE {RANDOM_KILL_FILTER}")
+        self.kill_ids = [row['impact_id'] for row in rows]
+        self.watermark = watermark
+        log.info(f"Loaded {len(self.kill_ids)} random kill candidates...")
+
+    async def pick(self, db) -> Optional[int]:
+        await self.refresh(db)
+        if not self.kill_ids:
+            return None
+        return random.choice(self.kill_ids)
+
+
+RANDOM_KILLS = RandomKillPool()
+
+
+async def lookup_kill(kill_id: int, db):
+    """Return the kill row for kill_id, or a random air-to-air kill if -1.
+
+    Explicit ids that no longer exist give None. A random pick removed since
+    the pool was loaded, eg by a resync, reloads the pool and picks again.
+    """
+    retries = 1 if kill_id == -1 else 0
+    while True:
+        if kill_id == -1:
+            pick = await RANDOM_KILLS.pick(db)
+            if pick is None:
+                return None
+        else:
+            pick = kill_id
+        log.info(f'Looking up specs for kill: {pick}...')
+        resp = await db.fetch_one(
+            f"SELECT * FROM {KILL_TABLE} WHERE impact_id = :impact_id",
+            values={'impact_id': pick})
+        if resp is not None or not retries:
+            log.info(resp)
+            return resp
+        retries -= 1
+        await RANDOM_KILLS.refresh(db, force=True)
 
-        filter_clause = """
-            WHERE
-                weapon_type = 'Air-to-Air' AND
-                impact_dist < 10 AND kill_duration > 10 AND kill_duration < 120
-            ORDER BY random()
-        """
-    else:
-        filter_clause = f"""WHERE impact_id = {kill_id}"""
 
-    log.info(f'Looking up specs for kill: {kill_id}...')
-    resp = await db.fetch_one(
-        f"SELECT * FROM impacts_valid {filter_clause} limit 1")
-    log.info(resp)
+async def build_kill(resp, db, radius: float = KILL_RADIUS) -> Dict:
+    """Collect the coordinates of every object in flight around a kill.
+
+    Objects other than the killer, target and weapon are only included if
+    they come within radius meters of one of them.
+    """
     key_dict = {
         k: v
         for k, v in
@@ -56,8 +160,35 @@ async def get_kill(kill_id: int, db):
         with time range: {resp['weapon_first_time']-30} - {resp['weapon_last_time']+10}..."""
     )
 
+    # Other objects are prefiltered to those passing through the bounding box
+    # of the killer, target and weapon tracks, grown by radius.
     points_query = f"""
-        WITH TMP AS (
+        WITH win AS (
+            SELECT *
+            FROM obj_events
+            WHERE
+                session_id = {resp['session_id']} AND
+        		type in ('Weapon+Missile', 'Air+FixedWing') AND
+                last_seen >= {resp['weapon_first_time']-30} AND
+                last_seen <= {resp['weapon_last_time']+10}
+            ),
+        box AS (
+            SELECT
+                MIN(v_coord) - {radius} min_v, MAX(v_coord) + {radius} max_v,
+                MIN(u_coord) - {radius} min_u, MAX(u_coord) + {radius} max_u,
+                MIN(alt) - {radius} min_alt, MAX(alt) + {radius} max_alt
+            FROM win
+            WHERE id IN ({resp['killer_id']}, {resp['target_id']}, {resp['weapon_id']})
+            ),
+        near AS (
+            SELECT DISTINCT id
+            FROM win, box
+            WHERE
+                v_coord BETWEEN min_v AND max_v AND
+                u_coord BETWEEN min_u AND max_u AND
+                alt BETWEEN min_alt AND max_alt
+            ),
+        TMP AS (
             SELECT
                 id, session_id,
                 ARRAY_AGG(ARRAY[v_coord, alt, u_coord] ORDER BY last_seen) coord,
@@ -66,12 +197,8 @@ async def get_kill(kill_id: int, db):
                 ARRAY_AGG(last_seen ORDER BY last_seen) time_step
             FROM (
                 SELECT *
-                FROM obj_events
-                WHERE
-                    session_id = {resp['session_id']} AND
-            		type in ('Weapon+Missile', 'Air+FixedWing') AND
-                    last_seen >= {resp['weapon_first_time']-30} AND
-                    last_seen <= {resp['weapon_last_time']+10}
+                FROM win
+                WHERE id IN (SELECT id FROM near)
                 ORDER BY updates
                 ) upd
             GROUP BY id, session_id
@@ -113,20 +240,7 @@ async def get_kill(kill_id: int, db):
         except KeyError:
             data['other'].append(rec)
 
-    # min_killer = data['killer']['coord'][0]
-    # for obj in ['killer', 'target', 'weapon']:
-    #     for i in range(len(data[obj]['coord'])):
-    #         data[obj]['coord'][i][0] -= min_killer[0]
-    #         data[obj]['coord'][i][1] -= min_killer[1]
-    #         data[obj]['coord'][i][2] -= min_killer[2]
-    #     log.info(data[obj]['coord'][-1])
-
-    # for i in range(len(data['other']['coord'])):
-    #     data['other']['coord'][i][0] -= min_killer[0]
-    #     data['other']['coord'][i][1] -= min_killer[1]
-    #     data['other']['coord'][i][2] -= min_killer[2]
-
-    # log.info(min_killer)
+    data = trajectory.filter_nearby(data, radius)
 
     log.info(f"Killer: {data['killer']['id']}")
     log.info(f"Target: {data['target']['id']} -- ")
@@ -135,3 +249,99 @@ async def get_kill(kill_id: int, db):
     log.info(f" Total other: {len(data['other'])}")
 
     return data
+
+
+def compress_replay(data: Dict) -> bytes:
+    return gzip.compress(json.dumps(data, separators=(',', ':')).encode(),
+                         compresslevel=6)
+
+
+async def store_replay(db, resp, data: Dict) -> None:
+    await db.execute(
+        f"""INSERT INTO {REPLAY_TABLE} (impact_id, session_id, payload)
+            VALUES (:impact_id, :session_id, :payload)
+            ON CONFLICT (impact_id) DO UPDATE
+            SET session_id = EXCLUDED.session_id,
+                payload = EXCLUDED.payload,
+                created = CURRENT_TIMESTAMP""",
+        values={'impact_id': resp['impact_id'],
+                'session_id': resp['session_id'],
+                'payload': compress_replay(data)})
+
+
+async def build_kill_replays(db, session_start_time=None) -> int:
+    """Precompute and store replays for valid kills that do not have one yet.
+
+    If session_start_time is given only kills from sessions starting at that
+    time are considered. Up to REPLAY_CONCURRENCY replays are built at once,
+    so db's pool should allow that many connections.
+    """
+    values = {}
+    session_filter = ''
+    if session_start_time is not None:
+        session_filter = """AND session_id IN (SELECT session_id FROM session
+                                               WHERE start_time = :start_time)"""
+        values['start_time'] = session_start_time
+    kills = await db.fetch_all(
+        f"""SELECT * FROM {KILL_TABLE} kills
+            WHERE {REPLAY_FILTER} {session_filter} AND
+                NOT EXISTS (SELECT 1 FROM {REPLAY_TABLE} r
+                            WHERE r.impact_id = kills.impact_id)""",
+        values=values)
+    log.info(f"Building {len(kills)} kill replays...")
+    slots = asyncio.Semaphore(REPLAY_CONCURRENCY)
+
+    async def build_one(resp) -> bool:
+        async with slots:
+            try:
+                data = await build_kill(resp, db)
+                await store_replay(db, resp, data)
+            except Exception as err:
+                # Kills missing one of their objects are left for live lookups.
+                log.warning(f"Could not build replay for {resp['impact_id']}: {err}")
+                return False
+            return True
+
+    built = sum(await asyncio.gather(*[build_one(resp) for resp in kills]))
+    log.info(f"Stored {built} kill replays...")
+    return built
+
+
+async def get_kill_replay(kill_id: int, db) -> Optional[bytes]:
+    """Return the gzipped replay for kill_id, or a random kill if -1.
+
+    Stored replays are a primary key lookup; kills without one are computed
+    live and stored for next time.
+    """
+    if kill_id == -1:
+        resp = await lookup_kill(kill_id, db)
+        if not resp:
+            return None
+        kill_id = resp['impact_id']
+    payload = await db.fetch_val(
+        f"SELECT payload FROM {REPLAY_TABLE} WHERE impact_id = :impact_id",
+        values={'impact_id': kill_id})
+    if payload is not None:
+        return bytes(payload)
+
+    log.info(f"No stored replay for kill: {kill_id}...computing live...")
+    resp = await lookup_kill(kill_id, db)
+    if not resp:
+        return None
+    data = await build_kill(resp, db)
+    try:
+        await store_replay(db, resp, data)
+    except Exception as err:
+        log.warning(f"Could not store replay for {kill_id}: {err}")
+    return compress_replay(data)
+
+
+async def get_kill(kill_id: int, db, radius: float = KILL_RADIUS):
+    """Return coordinates for a single kill-id, computed from obj_events.
+
+    Returns None if the kill does not exist.
+    """
+    resp = await lookup_kill(kill_id, db)
+    if resp is None:
+        return None
+    return await build_kill(resp, db, radius)
@@ -1,82 +1,143 @@
-import collections
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import json
 from pathlib import Path
 import re
 import gzip
-from functools import partial
-import threading
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from datetime import datetime
 import traceback
-from typing import Dict, List, Optional, cast
-from multiprocessing import Process
+from typing import Dict, Iterator, List, Optional, cast
 import os
+import time
 
 import asyncpg
-from lupa import LuaRuntime # type:ignore
+from lupa import LuaRuntime, lua_type # type:ignore
 import numpy as np
 import pandas as pd
 import sqlalchemy as sa
-from tacview_client import client, serve_file
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from horrible.database import (LOG, mission_stats, stat_files,
                                weapon_types, event_files, mission_events,
-                               event_files, file_format_ref)
-from horrible.gcs import get_gcs_bucket
+                               event_files, file_format_ref,
+                               mission_stat_facts, copy_rows,
+                               gcs_sync_state, frametime_files, frametimes,
+                               frametime_rollups)
+from horrible.frametime import frametime_batches, RESOLUTIONS
+from horrible.gcs import get_gcs_bucket, get_blob_cache, BlobCache
+from horrible.cache import WatermarkCache
 from horrible.config import get_logger
 
 log = get_logger('statreader')
 
+# The fact backfill runs in the updater process and sets facts_backfilled
+# without touching process_start, so it is counted to move the watermark.
+STAT_CACHE = WatermarkCache("""SELECT MAX(process_start) AS last_processed,
+                                   COUNT(*) FILTER (WHERE processed) AS processed,
+                                   COUNT(*) FILTER (WHERE facts_backfilled)
+                                       AS facts_backfilled
+                               FROM mission_stat_files""")
+
+
+async def upsert_file_rows(table: sa.Table, rows: List[Dict], db,
+                           chunk_size: int = 1000) -> int:
+    """Insert new file rows and reset modified ones, returning the changed count."""
+    changed = 0
+    for i in range(0, len(rows), chunk_size):
+        stmt = pg_insert(table).values(rows[i:i + chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['file_name'],
+            set_={
+                'file_size_kb': stmt.excluded.file_size_kb,
+                'session_last_update': stmt.excluded.session_last_update,
+                'processed': False,
+                'process_start': None,
+            },
+            where=table.c.session_last_update.is_distinct_from(
+                stmt.excluded.session_last_update))
+        changed += len(await db.fetch_all(stmt.returning(table.c.file_name)))
+    return changed
+
 
 async def sync_gs_files_with_db(bucket_prefix: str, table: sa.Table,
                                 db) -> None:
-    """Ensure all gs files are in database."""
-    inserts = []
+    """Ensure all gs files are in database.
+
+    Only blobs updated at or after the watermark recorded for the prefix by
+    the previous sync are diffed, and they are applied in batched upserts.
+    """
     if not db.is_connected:
         await db.connect()
     log.info(f"Syncing gs files at {bucket_prefix} to table {table.name}...")
+    sync_start = time.perf_counter()
+    watermark = await db.fetch_val(
+        "SELECT watermark FROM gcs_sync_state WHERE prefix = :prefix",
+        values={'prefix': bucket_prefix})
     bucket = get_gcs_bucket()
-    stats_list = bucket.client.list_blobs(bucket, prefix=bucket_prefix)
-    files = await db.fetch_all(f"""SELECT file_name, session_last_update
-                               FROM {table.name}""")
-    files = {f_["file_name"]:f_['session_last_update'] for f_ in files}
+    stats_list = bucket.client.list_blobs(
+        bucket, prefix=bucket_prefix,
+        fields='items(name,updated,size),nextPageToken')
+
+    scanned = 0
+    new_watermark = watermark
+    candidates = []
     for stat_file in stats_list:
+        scanned += 1
         if stat_file.name.replace("/", "") == bucket_prefix:
             continue
         last_update = datetime.fromtimestamp(stat_file.updated.timestamp())
         last_update = last_update.replace(microsecond=0)
-
-        if stat_file.name in files.keys():
-            if files[stat_file.name] == last_update:
-                log.debug(f"File: {stat_file.name} already recorded with same timestamp...")
-                continue
-            else:
-                log.info(f"Updating modified date of file: {stat_file.name}...")
-                await db.execute(f"""
-                                 UPDATE {table.name} SET
-                                 file_size_kb = {round(stat_file.size/1000, 2)},
-                                 session_last_update = '{last_update}',
-                                 processed = FALSE,
-                                 process_start = NULL
-                                 WHERE file_name = '{stat_file.name}'
-                                 """)
-                continue
-
-        if stat_file.name == bucket_prefix:
+        # Blobs sharing the watermark second are diffed again; the upsert
+        # ignores them if nothing changed.
+        if watermark and last_update < watermark:
             continue
+        if not new_watermark or last_update > new_watermark:
+            new_watermark = last_update
 
-        file_ts = file_format_ref[bucket_prefix](stat_file.name)
-        inserts.append({
+        candidates.append({
                 'file_name': stat_file.name,
-                'session_start_time': file_ts,
+                'session_start_time': file_format_ref[bucket_prefix](stat_file.name),
                 'session_last_update': last_update,
                 'file_size_kb': round(stat_file.size/1000, 2),
                 'processed': False,
                 'process_start': None,
                 'errors': 0
             })
-    log.info(f"Inserting {len(inserts)} files to {table.name}")
-    await db.execute_many(table.insert(), inserts)
-    log.info("Files inserted successfully!")
+
+    changed = await upsert_file_rows(table, candidates, db)
+    sync_seconds = round(time.perf_counter() - sync_start, 2)
+    log.info(f"Scanned {scanned} blobs, diffed {len(candidates)} newer than "
+             f"{watermark}, {changed} new or changed in {sync_seconds}s...")
+
+    stmt = pg_insert(gcs_sync_state).values(
+        prefix=bucket_prefix, watermark=new_watermark,
+        last_sync=datetime.utcnow().replace(microsecond=0),
+        sync_seconds=sync_seconds, blobs_scanned=scanned,
+        blobs_diffed=len(candidates), blobs_changed=changed)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['prefix'],
+        set_={c.name: c for c in stmt.excluded if c.name != 'prefix'})
+    await db.execute(stmt)
+    log.info("Files synced successfully!")
+
+
+async def resync_stat_file(db, file_name: str) -> None:
+    """Mark a stats file for reprocessing on the next mission-stats cycle.
+
+    The file row is kept: the sync only diffs blobs newer than its
+    watermark, so a deleted row for an older file would never come back.
+    Reprocessing replaces the file's records and facts.
+    """
+    await db.execute("""UPDATE mission_stat_files
+                        SET processed = FALSE,
+                            process_start = NULL,
+                            process_end = NULL,
+                            errors = 0
+                        WHERE file_name = :file_name""",
+                     values={'file_name': file_name})
 
 
 def dict_to_js_datatable_friendly_fmt(data: List) -> Dict:
@@ -95,101 +156,99 @@ def dict_to_js_datatable_friendly_fmt(data: List) -> Dict:
     return output
 
 
-async def query_tacview_files(db) -> Dict:
-    """Return a list of remote tacview files."""
-    log.info("Reading tacview files...")
-    output = {'data': [],
-              'index': [],
-              'columns': []}
-    i = 0
-    recs = await db.fetch_all(
-        """SELECT file_name, session_start_time, session_last_update,
+TACVIEW_FILES_QUERY = """SELECT file_name, session_start_time, session_last_update,
             ROUND(CAST((file_size_kb / 1000) as NUMERIC), 2) file_size_mb,
             processed,
             DATE_TRUNC('seconds', process_start) process_start,
             DATE_TRUNC('seconds', process_end) process_end,
             errors
-        FROM tacview_files""")
-    for record in recs:
-        if i == 0:
-            output['columns'] = [{'title': c.replace("_", " ").title()} for c in record.keys()]
-        output['data'].append(list(record.values()))
-        output['index'].append(i)
-        i += 1
-    return output
-
-
-def process_tacview_file(filename) -> None:
-    """process a single tacview file."""
-    bucket = get_gcs_bucket()
-    local_path = Path('horrible').joinpath(filename)
-    local_path.parent.mkdir(exist_ok=True, parents=True)
-    blob = bucket.get_blob(filename)
-    log.info(f"Downloading blob object to file: {filename}....")
-    blob.download_to_file(local_path.open('wb'))
-    log.info('File downloaded...starting reader...')
-    dsn = os.getenv("TACVIEW_DSN")
-
-    server_proc = Process(target=partial(
-        serve_file.main, filename=local_path, port=5555))
-    server_proc.start()
-
-    client.main(host='127.0.0.1',
-                port=5555,
-                debug=False,
-                max_iters=50000000,
-                batch_size=50000,
-                dsn=dsn)
-    server_proc.terminate()
-    log.info('Reader compete...')
-
-
-def lua_tbl_to_py(lua_tbl: Dict) -> Dict:
-    """Coerce lua table to python object."""
-    flatten_these = ['names', 'friendlyKills', 'friendlyHits']
-    out = {}
-    try:
-        for k, v in lua_tbl.items():
-            match_key = [
-                flat_k for flat_k in flatten_these if flat_k == k.decode()
-            ]
-            if match_key:
-                try:
-                    out[match_key[0]] = ', '.join(
-                        [val.decode() for val in dict(v).values()])
-                except Exception:
-                    pass
+        FROM tacview_files"""
+TACVIEW_FILES_COLUMNS = ['file_name', 'session_start_time', 'session_last_update',
+                         'file_size_mb', 'processed', 'process_start',
+                         'process_end', 'errors']
+
+# Ingest progress and throughput of tacview files, recorded by file_updater.
+TACVIEW_METRICS_QUERY = """SELECT file_name, worker_id, processed,
+            ROUND(CAST(100.0 * bytes_read / NULLIF(bytes_total, 0) AS NUMERIC),
+                  1) pct_read,
+            ROUND(CAST(bytes_total / 1e6 AS NUMERIC), 2) file_size_mb,
+            lines_read, events_read, objects_read,
+            ROUND(CAST(lines_read / NULLIF(ingest_secs, 0) AS NUMERIC))
+                lines_per_sec,
+            ROUND(CAST(bytes_read / 1e6 / NULLIF(read_secs, 0) AS NUMERIC), 1)
+                read_mb_per_sec,
+            flush_count,
+            ROUND(CAST(1000 * flush_secs / NULLIF(flush_count, 0) AS NUMERIC), 1)
+                flush_avg_ms,
+            ROUND(CAST(1000 * flush_max_secs AS NUMERIC), 1) flush_max_ms,
+            ROUND(CAST(download_secs AS NUMERIC), 2) download_secs,
+            ROUND(CAST(read_secs AS NUMERIC), 2) read_secs,
+            ROUND(CAST(parse_secs AS NUMERIC), 2) parse_secs,
+            ROUND(CAST(flush_secs AS NUMERIC), 2) flush_secs,
+            ROUND(CAST(refresh_secs AS NUMERIC), 2) refresh_secs,
+            DATE_TRUNC('seconds', process_start) process_start,
+            DATE_TRUNC('seconds', heartbeat) last_update
+        FROM tacview_files
+        WHERE bytes_total IS NOT NULL"""
+TACVIEW_METRICS_COLUMNS = ['file_name', 'worker_id', 'processed', 'pct_read',
+                           'file_size_mb', 'lines_read', 'events_read',
+                           'objects_read', 'lines_per_sec', 'read_mb_per_sec',
+                           'flush_count', 'flush_avg_ms', 'flush_max_ms',
+                           'download_secs', 'read_secs', 'parse_secs',
+                           'flush_secs', 'refresh_secs', 'process_start',
+                           'last_update']
+
+
+@contextmanager
+def timed(phase: str, file_name) -> Iterator[None]:
+    """Log the wall-clock duration of one phase of processing a file."""
+    start = time.perf_counter()
+    yield
+    log.info(f"{phase} took {time.perf_counter() - start:.3f}s for {file_name}")
+
+
+LUA_RUNTIME: Optional[LuaRuntime] = None
+FLATTEN_KEYS = ('names', 'friendlyKills', 'friendlyHits')
+
+
+def get_lua_runtime() -> LuaRuntime:
+    """Return this process's Lua runtime, creating it on first use."""
+    global LUA_RUNTIME
+    if LUA_RUNTIME is None:
+        LUA_RUNTIME = LuaRuntime(encoding=None)
+    return LUA_RUNTIME
+
+
+def flatten_lua_table(lua_tbl, parent: str = '', sep: str = '__',
+                      out: Optional[Dict] = None) -> Dict:
+    """Flatten a nested lua table straight into a single-level dict.
+
+    Nested keys are joined with sep, except for weapon tables which restart
+    the key. The name/friendly-fire tables are collapsed into comma separated
+    strings, with names stored as pilot.
+    """
+    if out is None:
+        out = {}
+    for k, v in lua_tbl.items():
+        key = k.decode() if isinstance(k, bytes) else str(k)
+        if key in FLATTEN_KEYS:
+            try:
+                v = ', '.join([val.decode() for val in v.values()])
+            except Exception:
                 continue
+            if key == 'names':
+                key = 'pilot'
 
-            if v and isinstance(v, (int, bytes, float, str)):
-                out[k.decode()] = v  # type:ignore
-            else:
-                out[k.decode()] = lua_tbl_to_py(v)  # type:ignore
-
-        # rename names to pilot.
-        if "names" in out.keys():
-            out['pilot'] = out.pop('names')
-
-    except AttributeError:
-        return lua_tbl
-    return out
-
-
-def result_to_flat_dict(record: collections.MutableMapping,
-                        parent: str = '',
-                        sep: str = '__') -> Dict:
-    items: List = []
-    for k, v in record.items():
-        if not parent or k.startswith('weapon'):
-            new_key = k
+        if not parent or key.startswith('weapon'):
+            new_key = key
         else:
-            new_key = f"{parent}{sep}{k}"
+            new_key = f"{parent}{sep}{key}"
 
-        if isinstance(v, collections.MutableMapping):
-            items.extend(result_to_flat_dict(v, new_key, sep=sep).items())
+        if lua_type(v) == 'table':
+            flatten_lua_table(v, new_key, sep, out)
         else:
-            items.append((new_key, v))
-    return dict(items)
+            out[new_key] = v
+    return out
 
 
 def get_filehandle_maybe_gzip(file_name: Path):
@@ -207,130 +266,344 @@ def get_filehandle_maybe_gzip(file_name: Path):
     return fp_
 
 
-def read_event_table(file_name: Path) -> Optional[List]:
-    """Read a single event file."""
-    results = []
-    fp_ = get_filehandle_maybe_gzip(file_name)
-
-    for line in fp_.readlines():
-        line = line.decode('utf-8')
-        if line.strip() == 'slmod.events = {}':
+EVENT_PREFIX = re.compile(r"\s*slmod\.events\[[0-9]+\]\s*=\s*")
+# One match per table field: an optional [key] =, the value, a trailing comma.
+LUA_TOKEN = re.compile(r"""\s*(?:\[\s*(?P<key>"(?:[^"\\]|\\.)*"|-?[0-9]+)\s*\]\s*=\s*)?
+    (?:(?P<open>\{) | (?P<close>\}) |
+    (?P<str>"(?:[^"\\]|\\.)*") |
+    (?P<num>-?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?) |
+    (?P<word>true|false|nil)
+    )\s*,?""", re.VERBOSE)
+LUA_ESCAPE = re.compile(r"\\(.)")
+LUA_ESCAPE_CHARS = {'n': '\n', 't': '\t', 'r': '\r'}
+LUA_WORDS = {'true': True, 'false': False, 'nil': None}
+
+
+def _lua_string(token: str) -> str:
+    token = token[1:-1]
+    if '\\' in token:
+        token = LUA_ESCAPE.sub(
+            lambda m: LUA_ESCAPE_CHARS.get(m.group(1), m.group(1)), token)
+    return token
+
+
+def _lua_number(token: str):
+    if '.' in token or 'e' in token or 'E' in token:
+        return float(token)
+    return int(token)
+
+
+def parse_lua_table(text: str, pos: int = 0) -> Dict:
+    """Parse a Lua table literal like {["type"] = "kill", ["t"] = 1.5}."""
+    stack: List = []
+    match = LUA_TOKEN.match
+    while True:
+        token = match(text, pos)
+        if not token:
+            raise ValueError(f"Unexpected lua at {pos}: {text[pos:pos + 50]}")
+        pos = token.end()
+        kind = token.lastgroup
+        key = token.group('key')
+        if key is not None:
+            key = _lua_string(key) if key[0] == '"' else int(key)
+
+        if kind == 'str':
+            value = _lua_string(token.group(kind))
+        elif kind == 'num':
+            value = _lua_number(token.group(kind))
+        elif kind == 'open':
+            stack.append(({}, key))
             continue
-        try:
-            line = re.sub("slmod.events\\[[0-9]{1,}\\] = ", "", line)
-            rec = eval(line.replace('[', "").replace('] =', ':'))
-            results.append({
-                'file_name': str(file_name),
-                'record': rec
-            })
-        except Exception as err:
-            log.error(err)
-            log.error(line)
-            fp_.close()
-            raise err
+        elif kind == 'close':
+            if not stack:
+                raise ValueError(f"Unbalanced lua at {pos}: {text[:pos]}")
+            value, key = stack.pop()
+            if not stack:
+                return value
+        else:
+            value = LUA_WORDS[token.group(kind)]
+
+        if not stack:
+            raise ValueError(f"Expected a table at {pos}: {text[pos:pos + 50]}")
+        parent = stack[-1][0]
+        parent[len(parent) + 1 if key is None else key] = value
+
+
+def iter_event_records(file_name: Path) -> Iterator[Dict]:
+    """Stream records from a single event file, one line at a time."""
+    with get_filehandle_maybe_gzip(file_name) as fp_:
+        for line in fp_:
+            line = line.decode('utf-8')
+            prefix = EVENT_PREFIX.match(line)
+            if not prefix:
+                if line.strip() and line.strip() != 'slmod.events = {}':
+                    raise ValueError(f"Unexpected event line: {line}")
+                continue
+            try:
+                yield {
+                    'file_name': str(file_name),
+                    'record': parse_lua_table(line, prefix.end())
+                }
+            except Exception as err:
+                log.error(err)
+                log.error(line)
+                raise err
+
+
+def read_event_batches(file_name: Path,
+                       batch_size: int = 5000) -> Iterator[List[Dict]]:
+    """Yield fixed-size batches of event records from a single event file."""
+    records = iter_event_records(file_name)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
 
-    return results
+
+def read_event_table(file_name: Path) -> Optional[List]:
+    """Read a single event file."""
+    return list(iter_event_records(file_name))
 
 
 def read_lua_table(file_name: Path) -> Optional[List]:
     """Read a single lua stat file, returning a dict."""
-    fp_ = get_filehandle_maybe_gzip(file_name)
-    file_contents = " ".join([f.decode('UTF-8') for f in fp_.readlines()])
-    fp_.close()
-    if file_contents == "placeholder":
+    with timed('decompress', file_name):
+        with get_filehandle_maybe_gzip(file_name) as fp_:
+            file_contents = fp_.read().decode('UTF-8')
+    if file_contents.strip() == "placeholder":
         return None
 
     lua_code = f"\n function() \r\n local {file_contents} return misStats end"
 
-    thread_count = 1
-    lua_funcs = [
-        LuaRuntime(encoding=None).eval(lua_code) for _ in range(thread_count)
-    ]
-
-    results: List[Dict] = [{}]
-
-    def read_tab_func(i, lua_func):
-        results[i] = lua_func()
+    lua = get_lua_runtime()
+    with timed('eval', file_name):
+        mis_stats = lua.eval(lua_code)()
 
-    threads = [
-        threading.Thread(target=read_tab_func, args=(i, lua_func))
-        for i, lua_func in enumerate(lua_funcs)
-    ]
-    for thread in threads:
-        thread.start()
-    for thread in threads:
-        thread.join()
-
-    result = lua_tbl_to_py(results[0])
     results_out = []
-    for res in result.values():
-        tmp = result_to_flat_dict(res)
-        entry = {
-            'file_name': str(file_name),
-            'pilot': tmp.pop('pilot'),
-            'pilot_id': tmp.pop('id'),
-            'record': tmp
-        }
-        results_out.append(entry)
+    with timed('convert', file_name):
+        for res in mis_stats.values():
+            tmp = flatten_lua_table(res)
+            entry = {
+                'file_name': str(file_name),
+                'pilot': tmp.pop('pilot'),
+                'pilot_id': tmp.pop('id'),
+                'record': tmp
+            }
+            results_out.append(entry)
+    del mis_stats
+    lua.execute("collectgarbage()")
     return results_out
 
 
-async def process_lua_records(file_type, db) -> None:
-    """Parse a directory of Sl-Mod stats files, returning a pandas dataframe."""
+def stat_records_to_facts(records: List[Dict],
+                          session_start_time: Optional[datetime]) -> List[Dict]:
+    """Normalize flat stat records into long-format mission_stat_facts rows."""
+    session_start_date = session_start_time.date() if session_start_time else None
+    facts = []
+    for rec in records:
+        for key, value in rec['record'].items():
+            try:
+                parsed_rec = parse_rec_keys(key)
+            except ValueError as err:
+                log.warning(err)
+                continue
+            if parsed_rec and value != "" and parsed_rec['category'] != "crash":
+                parsed_rec['value'] = int(value)
+                parsed_rec['file_name'] = rec['file_name']
+                parsed_rec['pilot'] = rec['pilot']
+                parsed_rec['session_start_date'] = session_start_date
+                facts.append(parsed_rec)
+    return facts
+
+
+async def backfill_stat_facts(db) -> None:
+    """Populate mission_stat_facts for processed files ingested before it existed.
+
+    Each file is backfilled once: facts_backfilled is set in the same
+    transaction as its facts, so files that yield no facts are not retried.
+    """
+    missing = await db.fetch_all("""
+        SELECT file_name, session_start_time
+        FROM mission_stat_files files
+        WHERE processed AND NOT facts_backfilled AND
+            EXISTS (SELECT 1 FROM mission_stats stats
+                    WHERE stats.file_name = files.file_name)
+        """)
+    if not missing:
+        return
+    log.info(f"Backfilling stat facts for {len(missing)} files...")
+    for stat in missing:
+        recs = await db.fetch_all(
+            "SELECT file_name, pilot, record FROM mission_stats WHERE file_name = :file_name",
+            values={'file_name': stat['file_name']})
+        recs = [{'file_name': r['file_name'], 'pilot': r['pilot'],
+                 'record': json.loads(r['record'])} for r in recs]
+        facts = stat_records_to_facts(recs, stat['session_start_time'])
+        async with db.connection() as connection:
+            async with connection.transaction():
+                con = connection.raw_connection
+                await con.execute(
+                    "DELETE FROM mission_stat_facts WHERE file_name = $1",
+                    stat['file_name'])
+                await copy_rows(con, mission_stat_facts, facts)
+                await mark_facts_backfilled(con, stat['file_name'])
+    log.info("Stat fact backfill complete...")
+
+
+async def mark_facts_backfilled(con, file_name: str) -> None:
+    """Flag a file's facts as written so the backfill skips it."""
+    await con.execute("""UPDATE mission_stat_files
+                         SET facts_backfilled = TRUE
+                         WHERE file_name = $1""", file_name)
+
+
+def download_blob(blob_cache: BlobCache, file_name: str,
+                  local_path: Path) -> None:
+    """Download a single blob to local_path, via the local blob cache."""
+    log.info(f"Downloading {file_name} to {local_path}...")
+    try:
+        blob_cache.fetch(file_name, local_path)
+    except Exception as e:
+        log.error(f"Error downloading file! {e}")
+        raise ValueError("File could not be downloaded")
+
+
+async def write_parsed_file(db, stat, rec_table: sa.Table,
+                            batches: Iterator[List[Dict]]) -> None:
+    """Replace the records for a single file with its freshly parsed rows.
+
+    Batches are pulled lazily in a worker thread, so a streaming parser only
+    ever holds a single batch in memory. The delete and one COPY per batch
+    run in a single transaction.
+    """
+    log.info(f"Writing records for {stat['file_name']} to database...")
+    loop = asyncio.get_event_loop()
+    batch = await loop.run_in_executor(None, next, batches, None)
+    if not batch:
+        log.info('No results in data...')
+        return
+
+    tables = [rec_table]
+    if rec_table is mission_stats:
+        tables.append(mission_stat_facts)
+    if rec_table is frametimes:
+        tables.append(frametime_rollups)
+
+    total = 0
+    with timed('insert', stat['file_name']):
+        async with db.connection() as connection:
+            async with connection.transaction():
+                con = connection.raw_connection
+                log.info('Deleting existing records...')
+                for table in tables:
+                    await con.execute(
+                        f"DELETE FROM {table.name} WHERE file_name = $1",
+                        stat['file_name'])
+                while batch:
+                    if rec_table is frametimes:
+                        # Second resolution rows go to frametimes, coarser
+                        # tiers to frametime_rollups.
+                        await copy_rows(con, frametime_rollups,
+                                        [r for r in batch if r['resolution'] > 1])
+                        batch = [r for r in batch if r['resolution'] == 1]
+                    await copy_rows(con, rec_table, batch)
+                    if rec_table is mission_stats:
+                        facts = stat_records_to_facts(
+                            batch, stat['session_start_time'])
+                        await copy_rows(con, mission_stat_facts, facts)
+                    total += len(batch)
+                    batch = await loop.run_in_executor(None, next, batches, None)
+                if rec_table is mission_stats:
+                    await mark_facts_backfilled(con, stat['file_name'])
+    log.info(f"Wrote {total} records...")
+
+
+async def process_lua_records(file_type, db, max_downloads: int = 4,
+                              max_parsers: Optional[int] = None) -> None:
+    """Parse a directory of Sl-Mod stats files, writing records to the database.
+
+    Files move through three stages: up to max_downloads concurrent GCS
+    downloads, parsing in a pool of max_parsers processes, and a single
+    writer that inserts records and updates the status of each file.
+    Event and frametime files skip the pool and are streamed to the writer
+    in batches.
+    """
     Path(file_type).mkdir(parents=True, exist_ok=True)
-    bucket = get_gcs_bucket()
+    blob_cache = get_blob_cache()
     if file_type == "mission-stats":
         proc_files = await db.fetch_all(
             stat_files.select(sa.text("processed=FALSE")))
         rec_table = mission_stats
         file_table = 'mission_stat_files'
         proc_fun = read_lua_table
+        stream_fun = None
     elif file_type == "mission-events":
         proc_files = await db.fetch_all(
             event_files.select(sa.text("processed=FALSE")))
         rec_table = mission_events
         file_table = 'mission_event_files'
-        proc_fun = read_event_table
+        proc_fun = None
+        stream_fun = read_event_batches
+    elif file_type == "frametime":
+        proc_files = await db.fetch_all(
+            frametime_files.select(sa.text("processed=FALSE")))
+        rec_table = frametimes
+        file_table = 'frametime_files'
+        proc_fun = None
+        stream_fun = frametime_batches
     else:
         raise NotImplementedError
 
-    for stat in proc_files:
+    proc_files = [stat for stat in proc_files
+                  if stat['file_name'] != f"{file_type}/"]
+    if not proc_files:
+        return
+
+    max_parsers = max_parsers or os.cpu_count() or 1
+    loop = asyncio.get_event_loop()
+    download_sem = asyncio.Semaphore(max_downloads)
+    parse_sem = asyncio.Semaphore(max_parsers)
+    parsed_queue: asyncio.Queue = asyncio.Queue(maxsize=max_parsers)
+
+    async def fetch_and_parse(stat, pool) -> None:
         try:
-            if stat['file_name'] == "mission-stats/":
-                continue
             log.info(f"Handing {stat['file_name']}")
             local_path = Path(f"{stat['file_name']}")
+            async with download_sem:
+                await loop.run_in_executor(None, download_blob, blob_cache,
+                                           stat['file_name'], local_path)
+            if stream_fun:
+                await parsed_queue.put((stat, stream_fun(local_path), None))
+                return
+            # Hold the parse slot until the writer has room, so parsed files
+            # never pile up in memory faster than they can be inserted.
+            async with parse_sem:
+                stat_parsed = await loop.run_in_executor(pool, proc_fun,
+                                                         local_path)
+                batches = iter([stat_parsed] if stat_parsed else [])
+                await parsed_queue.put((stat, batches, None))
+        except Exception as err:
+            await parsed_queue.put((stat, None, err))
 
-            log.info(f"Downloading {stat['file_name']} to {local_path}...")
-            try:
-                blob = bucket.get_blob(stat['file_name'])
-                blob.download_to_filename(local_path)
-            except Exception as e:
-                log.error(f"Error downloading file! {e}")
-                raise ValueError("File could not be downloaded")
-
-            stat_parsed = proc_fun(local_path)
-
-            log.info("Writing record to database...")
-            if stat_parsed:
-                log.info('Deleting existing records...')
-                await db.execute(f"""DELETE FROM {rec_table.name}
-                                 WHERE file_name = '{stat['file_name']}'""")
-
-                await db.execute_many(rec_table.insert(), stat_parsed)
-            else:
-                log.info('No results in data...')
-
-            await db.execute(f"""UPDATE {file_table}
-                             SET
-                                processed = TRUE,
-                                errors = 0,
-                                process_start = date_trunc('second', CURRENT_TIMESTAMP)
-                                WHERE file_name = '{stat['file_name']}'
-                            """)
-            log.info("Record processing complete...")
+    async def write_all() -> None:
+        for _ in range(len(proc_files)):
+            stat, batches, err = await parsed_queue.get()
+            if err is None:
+                try:
+                    await write_parsed_file(db, stat, rec_table, batches)
+                    await db.execute(f"""UPDATE {file_table}
+                                     SET
+                                        processed = TRUE,
+                                        errors = 0,
+                                        process_start = date_trunc('second', CURRENT_TIMESTAMP)
+                                        WHERE file_name = '{stat['file_name']}'
+                                    """)
+                    log.info("Record processing complete...")
+                    continue
+                except Exception as write_err:
+                    err = write_err
 
-        except Exception as err:
             log.error(f"Error handling file: \n\t{stat['file_name']}\n\t{err}")
             traceback.print_tb(err.__traceback__)
             await db.execute(f"""UPDATE {file_table}
@@ -344,148 +617,130 @@ async def process_lua_records(file_type, db) -> None:
                              WHERE file_name = '{stat['file_name']}'
                                 """, values={'err': str(err)})
 
+    log.info(f"Processing {len(proc_files)} files with {max_downloads} "
+             f"downloaders and {max_parsers} parsers...")
+    with ProcessPoolExecutor(max_workers=max_parsers) as pool:
+        await asyncio.gather(write_all(),
+                             *[fetch_and_parse(stat, pool) for stat in proc_files])
 
-def format_cols(df: pd.DataFrame) -> pd.DataFrame:
-    """Format a dataframe for display in HTML."""
-    not_ints = ['kills__A/A Kill Ratio']
-    for c in df.columns: # type: ignore
-        if "times__" in c:
-            df[c] = df[c].apply(lambda x: int(round(x / 60))) # type: ignore
-
-    to_int_cols = []
-    df = cast(pd.DataFrame, df)
-    for c in df.columns:
-        if (any([x in c for x in ['weapons__', 'kills__', 'losses__']])
-                and c not in not_ints):
-            to_int_cols.append(c)
-    if to_int_cols:
-        df[to_int_cols] = df[to_int_cols].applymap(int) # type: ignore
-
-    cleaned_cols = [c.replace("__", "_").replace("_", " ") for c in df.columns] # type: ignore
-    df.columns = cleaned_cols
-    return df
+
+REC_KEY_FIELDS = ('category', 'metric', 'stat_group', 'equipment')
+IGNORED_REC_KEYS = ('lastJoin', 'friendlyHits', 'friendlyKills')
+
+
+def _is_word_char(char: str) -> bool:
+    return char == '_' or char.isalnum()
+
+
+def _is_alpha_range(char: str) -> bool:
+    # Mirrors the [A-z] class of the original patterns, underscores included.
+    return 'A' <= char <= 'z'
+
+
+def _split_on(field_key: str, sep: str):
+    """Yield (head, tail) around each sep, rightmost first, as (\\w.*)sep would."""
+    if not field_key or not _is_word_char(field_key[0]):
+        return
+    pos = field_key.rfind(sep)
+    while pos >= 1:
+        yield field_key[:pos], field_key[pos + len(sep):]
+        pos = field_key.rfind(sep, 0, pos + len(sep) - 1)
+
+
+def _split_tail(field_key: str):
+    """Split on the last __ that is followed by a metric name."""
+    for head, tail in _split_on(field_key, '__'):
+        if tail and _is_alpha_range(tail[0]):
+            return head, tail
+    return None
+
+
+def _classify_times(rest: str) -> Optional[tuple]:
+    for stat_group in ('kills', 'actions', 'losses'):
+        for equipment, tail in _split_on(rest, f"__{stat_group}__"):
+            parts = _split_tail(tail)
+            if not parts:
+                continue
+            if stat_group == 'kills':
+                # eg: times__JF-17__kills__Planes__total
+                return (parts[0], parts[1], stat_group, equipment)
+            # eg: times__JF-17__actions__losses__pilotDeath
+            return (parts[1], 'total',
+                    parts[0] if stat_group == 'actions' else stat_group,
+                    equipment)
+
+    parts = _split_tail(rest)
+    if parts:
+        # eg: times__AV8BNA__total
+        return ('times', parts[1], 'usage', parts[0])
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _classify_rec_key(field_key: str) -> Optional[tuple]:
+    """Classify a flattened stat key, dispatching on its leading token.
+
+    Returns a tuple ordered as REC_KEY_FIELDS, None for keys that should be
+    dropped, or raises ValueError for keys that cannot be parsed.
+    """
+    head, sep, rest = field_key.partition('__')
+    if sep:
+        if head == 'times':
+            cats = _classify_times(rest)
+            if cats:
+                return cats
+        elif head == 'weapons':
+            parts = _split_tail(rest)
+            if parts:
+                # eg: weapons__Mk-20 Rockeye__kills
+                if parts[1] in ('gun', 'hit'):
+                    # These are always wrong.
+                    return None
+                return (None, parts[1], 'weapons', parts[0])
+        elif head in ('losses', 'kills'):
+            parts = _split_tail(rest)
+            if parts:
+                return (parts[0], parts[1], head, 'N/A')
+        elif head == 'PvP' and rest and _is_word_char(rest[0]):
+            # old format losses only
+            return ('PvP', rest, 'PvP', 'N/A')
+
+    # old format losses only, eg: losses__pilotDeath
+    pos = field_key.rfind('__')
+    while pos >= 0:
+        prefix, suffix = field_key[:pos], field_key[pos + 2:]
+        if (suffix and _is_word_char(suffix[0])
+                and all(_is_alpha_range(c) for c in prefix)):
+            return (suffix, 'total', prefix, 'N/A')
+        pos = field_key.rfind('__', 0, pos + 1)
+
+    if field_key in IGNORED_REC_KEYS:
+        return None
+
+    raise ValueError(f"Could not parse: {field_key}")
 
 
 def parse_rec_keys(field_key: str) -> Optional[Dict]:
     """Extract fields from concatenated dict key."""
-    cats: Dict[str, Optional[str]]
-    matches = re.match(r"^(times)__(\w.*)__(kills)__(\w.*)__([A-z].*)$",
-                       field_key)
-    if matches:
-        # eg: times__JF-17__kills__Planes__total
-        # times/actions per airframe
-        cats = {
-            'category': matches.groups()[3],  # eg planes
-            'metric': matches.groups()[4],  # eg: total
-            'stat_group': matches.groups()[2],  # eg kills
-            'equipment': matches.groups()[1],  # eg F/A-18C
-        }
-        return cats
-
-    matches = re.match(r"^(times)__(\w.*)__(actions)__(\w.*)__([A-z].*)$",
-                       field_key)
-    if matches:
-        # eg: times__JF-17__actions__losses__pilotDeath
-        # times/actions per airframe
-        cats = {
-            'category': matches.groups()[4],  # eg losses
-            'metric': 'total',  # eg: eject
-            'stat_group': matches.groups()[3],  # eg actions
-            'equipment': matches.groups()[1],  # eg F/A-18C
-        }
-        return cats
-
-    matches = re.match(r"^(times)__(\w.*)__(losses)__(\w.*)__([A-z].*)$",
-                       field_key)
-    if matches:
-        # eg: times__JF-17__actions__losses__pilotDeath
-        # times/actions per airframe
-        cats = {
-            'category': matches.groups()[4],  # eg losses
-            'metric': 'total',  # eg: eject
-            'stat_group': matches.groups()[2],  # eg actions
-            'equipment': matches.groups()[1],  # eg F/A-18C
-        }
-        return cats
-
-    matches = re.match(r"^(weapons)__(\w.*)__([A-z].*)$", field_key)
-    if matches:
-        # eg: weapons__Mk-20 Rockeye__kills
-        # weapons
-        cats = {
-            'category': None,
-            'metric': matches.groups()[2],  # eg: shot, numHits
-            'stat_group': matches.groups()[0],  # eg: weapons
-            'equipment': matches.groups()[1],  #eg: AIM-120C
-        }
-        if cats['metric'] == 'gun' or cats['metric'] == 'hit':
-            # These are always wrong.
-            return None
-        return cats
-
-    matches = re.match(r"^(losses)__(\w.*)__([A-z].*)$", field_key)
-    if matches:
-        # losses
-        cats = {
-            'category': matches.groups()[1],
-            'metric': matches.groups()[2],  # eg: shot, numHits
-            'stat_group': matches.groups()[0],  # eg: weapons
-            'equipment': "N/A",  #eg: AIM-120C
-        }
-        return cats
-
-    matches = re.match(r"^(kills)__(\w.*)__([A-z].*)$", field_key)
-    if matches:
-        # losses
-        cats = {
-            'category': matches.groups()[1],
-            'metric': matches.groups()[2],  # eg: shot, numHits
-            'stat_group': matches.groups()[0],  # eg: weapons
-            'equipment': "N/A",  #eg: AIM-120C
-        }
-        return cats
-
-    matches = re.match(r"^(times)__(\w.*)__([A-z].*)$", field_key)
-    if matches:
-        #eg: times__AV8BNA__total
-        # times air/total
-        cats = {
-            'category': matches.groups()[0],
-            'metric': matches.groups()[2],  # eg: shot, total/inair
-            'stat_group': 'usage',
-            'equipment': matches.groups()[1],  #eg: AIM-120C
-        }
-        return cats
-
-    matches = re.match(r"^(PvP)__(\w.*)$", field_key)
-    if matches:
-        # old format losses only
-        cats = {
-            'category': matches.groups()[0],  #
-            'metric': matches.groups()[1],  # eg: shot, numHits
-            'stat_group': matches.groups()[0],  # eg: weapons
-            'equipment': 'N/A',
-        }
-        return cats
-
-    matches = re.match(r"^([A-z]*)__(\w.*)$", field_key)
-    if matches:
-        # old format losses only
-        cats = {
-            'category': matches.groups()[1],  # eg: pilotdeath
-            'metric': "total",
-            'stat_group': matches.groups()[0],  # eg: losses
-            'equipment': 'N/A',
-        }
-
-        return cats
-
-    if field_key in ['lastJoin', 'friendlyHits', 'friendlyKills']:
+    cats = _classify_rec_key(field_key)
+    if cats is None:
         return None
+    return dict(zip(REC_KEY_FIELDS, cats))
+
+
+def concat_cols(df: pd.DataFrame, cols: List[str], sep: str) -> pd.Series:
+    """Join the string form of cols with sep, once per distinct combination."""
+    combos = pd.MultiIndex.from_frame(df[cols].astype(str))
+    codes, uniques = combos.factorize()
+    labels = np.array([sep.join(map(str, combo)) for combo in uniques],
+                      dtype=object)
+    return pd.Series(labels[codes], index=df.index)
 
-    raise ValueError(f"Could not parse: {field_key}")
-    # return {'category': None, 'metric': None,
-    #         'stat_group': None, 'equipment': None}
+
+def zero_gun_kills(data: pd.DataFrame) -> None:
+    """Gun kill counts are unreliable, so zero them in place."""
+    gun_kills = (data['category'] == 'Gun') & (data['metric'] == 'kills')
+    data.loc[gun_kills, 'value'] = 0
 
 
 async def collect_recs_kv(db) -> pd.DataFrame:
@@ -500,36 +755,21 @@ async def collect_recs_kv(db) -> pd.DataFrame:
                 axis=1,
                 inplace=True)
 
-    query = """SELECT pilot, record, files.session_start_time
-                FROM mission_stats
-                LEFT JOIN mission_stat_files files
-                USING (file_name)
-                WHERE files.session_start_time > (now() - INTERVAL '180 DAYS')
+    query = """SELECT pilot, session_start_date, stat_group, category,
+                    metric, equipment, SUM(value) AS value
+                FROM mission_stat_facts
+                WHERE session_start_date > (now() - INTERVAL '180 DAYS')::date
+                GROUP BY pilot, session_start_date, stat_group, category,
+                    metric, equipment
             """
 
-    data_row_dicts: List[Dict] = []
-    async for rec in db.iterate(query=query):
-        rec_elements = json.loads(rec['record'])
-        LOG.debug(rec_elements)
-        for key, value in rec_elements.items():
-            parsed_rec = parse_rec_keys(key)
-            if parsed_rec and value != "" and parsed_rec['category'] != "crash":
-                parsed_rec['value'] = int(value)
-                parsed_rec['key_orig'] = key
-                parsed_rec['pilot'] = rec['pilot']
-                parsed_rec['session_start_time'] = rec['session_start_time']
-                data_row_dicts.append(parsed_rec)
-
+    data_row_dicts = [dict(rec) for rec in await db.fetch_all(query=query)]
     data = pd.DataFrame.from_records(data_row_dicts, index=None)
     if data.shape[0] == 0:
         return data
-    data['session_start_date'] = data['session_start_time'].dt.date # type: ignore
     data = data.merge(weapons, how='left', on='equipment')
     data["category"] = data.category.combine_first(data.weapon_cat)
-    data.value = data.apply(
-        lambda x: 0
-        if x['category'] == 'Gun' and x['metric'] == 'kills' else x['value'],
-        axis=1)
+    zero_gun_kills(data)
 
     return data
 
@@ -542,6 +782,7 @@ async def all_category_grouped(db) -> pd.DataFrame:
     return data
 
 
+@STAT_CACHE.cached
 async def calculate_overall_stats(grouping_cols: List, db) -> pd.DataFrame:
     """Calculate per-user/category/sub-type metrics."""
     df = await collect_recs_kv(db)
@@ -551,10 +792,11 @@ async def calculate_overall_stats(grouping_cols: List, db) -> pd.DataFrame:
     # df = df[~df['metric'].isin(['hit', 'crash', 'inAir'])]
     df = df[~df['metric'].isin(['hit', 'crash'])] # type: ignore
 
+    # Only value is summed; other columns would be dropped as nuisance.
     df = df.groupby(grouping_cols + ["category", "metric"], # type: ignore
-                    as_index=False).sum() # type: ignore
+                    as_index=False)['value'].sum() # type: ignore
 
-    df['col'] = df[['category', 'metric']].apply(lambda x: ' '.join(x), axis=1)
+    df['col'] = concat_cols(df, ['category', 'metric'], sep=' ')
     df.drop(labels=['category', 'metric'], axis=1, inplace=True)
 
     df = df.pivot_table(index=grouping_cols, columns="col", values="value")
@@ -620,6 +862,7 @@ async def calculate_overall_stats(grouping_cols: List, db) -> pd.DataFrame:
     return df
 
 
+@STAT_CACHE.cached
 async def get_dataframe(db, subset: Optional[List] = None,
                         user_name: Optional[str] = None) -> pd.DataFrame:
     """Get stats in dataframe format suitable for HTML display."""
@@ -648,8 +891,7 @@ async def get_dataframe(db, subset: Optional[List] = None,
             idx_key = ['pilot', 'equipment']
             col_key = ['category', 'metric', 'stat_group']
 
-        stat_data['key'] = stat_data[col_key].apply( # type: ignore
-            lambda x: '__'.join(x.map(str)), axis=1) # type: ignore
+        stat_data['key'] = concat_cols(stat_data, col_key, sep='__')
 
         stat_data = stat_data.pivot_table(index=idx_key,
                                           fill_value=0,
@@ -664,93 +906,74 @@ async def get_dataframe(db, subset: Optional[List] = None,
         raise e
 
 
+EVENTS_QUERY = """
+    SELECT
+        TO_CHAR(date_trunc('second', (f.session_start_time +
+                make_interval(secs => (e.record->>'t')::float))
+                AT TIME ZONE 'UTC'), 'YYYY-MM-DD HH24:MI:SS+00:00') AS event_timestamp,
+        e.record->>'type' AS event_type,
+        COALESCE(e.record->>'initiatorPilotName', e.record->>'initiator') AS initiator,
+        e.record->>'initiator_objtype' AS initiator_type,
+        e.record->>'weapon' AS weapon,
+        COALESCE(e.record->>'targetPilotName', e.record->>'target') AS target,
+        e.record->>'target_objtype' AS target_type,
+        (e.record->>'numtimes')::float AS numtimes
+    FROM mission_events e
+    INNER JOIN mission_event_files f USING (file_name)
+    WHERE e.record->>'type' IN ('kill', 'hit')
+"""
+EVENTS_COLUMNS = ['event_timestamp', 'event_type', 'initiator', 'initiator_type',
+                  'weapon', 'target', 'target_type', 'numtimes']
+
+
 async def read_events(db) -> pd.DataFrame:
     """Return a dataframe of event log data."""
-    return_types = ['kill', 'hit']
-    evt = await db.fetch_all(event_files.select())
-    evt_files = {r['file_name']: r['session_start_time'] for r in evt}
-    resp = await db.fetch_all(mission_events.select())
-    recs = []
+    resp = await db.fetch_all(EVENTS_QUERY)
     if not resp:
         log.info("Empty response! No events!")
         return pd.DataFrame()
-    for item in resp:
-        if item['record']['type'] in return_types:
-            tmp = item['record']
-            tmp['event_timestamp'] = evt_files[item['file_name']] + timedelta(seconds=float(tmp['t']))
-            tmp['event_timestamp'] = str(tmp['event_timestamp'].replace(microsecond=0))
-            tmp['event_duration'] = float(tmp['stoptime']) - tmp['t']
-            recs.append(tmp)
-
-    events = pd.DataFrame(recs, index=None)
-    events['initiator'] = events.initiatorPilotName.combine_first(events.initiator) # type: ignore
-    events['target'] = events.targetPilotName.combine_first(events.target) # type: ignore
-    events.rename(columns={'target_objtype': 'target_type',
-                           'type': 'event_type',
-                           'initiator_objtype': 'initiator_type'},
-                  inplace=True)
-
-    events = events[[
-        'event_timestamp',
-        'event_type',
-        'initiator',
-        'initiator_type',
-        'weapon',
-        'target',
-        'target_type',
-        'numtimes',
-    ]]
-
+    events = pd.DataFrame([dict(r) for r in resp])
     events = events.fillna('None') # type: ignore
     log.info(f"Returning data with {events.shape[0]} rows and {events.shape[1]} cols...")
     return events # type: ignore
 
 
-# def read_frametime(filename: str, pctile: int = 50) -> Dict:
-#     """Given a google-storage blob, return a dataframe with frametime stats."""
-#     Path("frametimes").mkdir(parents=True, exist_ok=True)
-#     local_file = Path('frametimes').joinpath(Path(filename).name)
-#     if not local_file.exists():
-#         bucket = get_gcs_bucket()
-#         log.info(f"Downloading file: {filename} to location: {local_file}...")
-#         log.info(f"{str(filename)==str(local_file)}")
-#         blob = bucket.get_blob(str(filename))
-#         with local_file.open('wb') as fp_:
-#             blob.download_to_file(fp_)
-#         log.info("File downloaded successfully...")
-#     else:
-#         log.info("File exists in local cache...")
-
-#     with local_file.open('rb') as fp_:
-#         raw_text = fp_.read().decode().split()
-#     rec = np.array(raw_text, dtype=np.float)
-#     fps = float(1) / (rec[1:, ] - rec[:-1])
-#     fps = fps.astype(pd.Int64Dtype)
-
-#     tstamp_fps = np.stack([fps, rec[1:, ]], axis=1)
-#     df = pd.DataFrame(tstamp_fps, columns=['fps', 'tstamp'])
-
-#     df['tstamp'] = pd.to_datetime(df['tstamp'], unit='s')
-#     dfgroup = df.groupby(pd.Grouper(key='tstamp', freq='1s'))
-
-#     max = 5000
-#     # nrows = len(dfgroup.groups)
-#     nrows = max
-#     out = {
-#         'labels': [None] * nrows,
-#         'data': [None] * nrows,
-#         'points': [None] * nrows,
-#         'name': f"FPS: {pctile} Percentile"
-#     }
-#     i = 0
-#     max_it = 50
-#     for group, data in dfgroup:
-#         ptile = int(np.percentile(data.fps, pctile))
-#         tstamp = group.strftime("%Y-%M-%d %H:%m:%S")
-#         out['labels'][i] = tstamp
-#         out['data'][i] = {'x': i, 'y': ptile}
-#         out['points'][i] = ptile
-#         i += 1
-#         if i >= max_it:
-#             break
-#     return out
\ No newline at end of file
+FRAMETIME_POINTS = 500
+
+
+async def read_frametime(db, file_name: str,
+                         points: int = FRAMETIME_POINTS) -> Dict:
+    """Return FPS percentiles for a frametime file, for charting.
+
+    The finest rollup tier with no more than points intervals over the
+    session is used, falling back to the coarsest.
+    """
+    span = await db.fetch_one(
+        """SELECT EXTRACT(EPOCH FROM MAX(frame_ts) - MIN(frame_ts)) AS secs
+           FROM frametimes WHERE file_name = :file_name""",
+        values={'file_name': file_name})
+    secs = float(span['secs'] or 0) if span else 0
+    resolution = next((res for res in RESOLUTIONS if secs / res <= points),
+                      RESOLUTIONS[-1])
+    log.info(f"Reading {resolution}s frametime tier for {file_name}...")
+    if resolution == 1:
+        query = """SELECT frame_ts, ts_fps, fps_p1, fps_p50, fps_p99
+                   FROM frametimes WHERE file_name = :file_name
+                   ORDER BY frame_ts"""
+        values = {'file_name': file_name}
+    else:
+        query = """SELECT frame_ts, ts_fps, fps_p1, fps_p50, fps_p99
+                   FROM frametime_rollups
+                   WHERE file_name = :file_name AND resolution = :resolution
+                   ORDER BY frame_ts"""
+        values = {'file_name': file_name, 'resolution': resolution}
+    rows = await db.fetch_all(query, values=values)
+    return {
+        'file_name': file_name,
+        'resolution': resolution,
+        'labels': [r['frame_ts'].strftime("%Y-%m-%d %H:%M:%S") for r in rows],
+        'fps': [r['ts_fps'] for r in rows],
+        'p1': [r['fps_p1'] for r in rows],
+        'p50': [r['fps_p50'] for r in rows],
+        'p99': [r['fps_p99'] for r in rows],
+    }
@@ -0,0 +1,106 @@
+"""orjson-backed JSON responses, skipping FastAPI's jsonable_encoder."""
+import datetime
+import decimal
+from typing import AsyncIterator, Dict, List
+
+import numpy as np
+import orjson
+import pandas as pd
+from starlette.responses import JSONResponse, StreamingResponse
+
+from horrible.config import get_logger
+
+log = get_logger('responses')
+
+ORJSON_OPTIONS = getattr(orjson, 'OPT_SERIALIZE_NUMPY', 0)
+STREAM_CHUNK_ROWS = 5000
+
+
+def _default(obj):
+    """Serialize the types orjson does not handle natively."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime.datetime, datetime.date,
+                        datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def frame_response(df: pd.DataFrame, title=str.title) -> ORJSONResponse:
+    """Return a DataFrame in the split format the front-end tables expect."""
+    return ORJSONResponse({
+        'columns': [{'title': title(c)} for c in df.columns],
+        'index': df.index.tolist(),
+        'data': df.values.tolist(),
+    })
+
+
+def _title(col: str) -> Dict:
+    return {'title': col.replace("_", " ").title()}
+
+
+async def _prepend(first, rows: AsyncIterator) -> AsyncIterator:
+    if first is not None:
+        yield first
+    async for row in rows:
+        yield row
+
+
+async def _stream_rows(rows: AsyncIterator) -> AsyncIterator[bytes]:
+    yield b'{"data":['
+    columns: List[str] = []
+    count = 0
+    chunk: List[List] = []
+    async for row in rows:
+        if not columns:
+            columns = list(row.keys())
+        chunk.append(list(row.values()))
+        if len(chunk) == STREAM_CHUNK_ROWS:
+            yield (b',' if count else b'') + dumps(chunk)[1:-1]
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        yield (b',' if count else b'') + dumps(chunk)[1:-1]
+        count += len(chunk)
+    yield (b'],"columns":' + dumps([_title(c) for c in columns]) +
+           b',"index":' + dumps(list(range(count))) + b'}')
+    log.info(f"Streamed {count} rows...")
+
+
+async def stream_query(db, query: str) -> StreamingResponse:
+    """Stream the rows of query as a datatables.js friendly JSON object.
+
+    Rows are fetched from a cursor and written in chunks, so the table is
+    never held in memory whole. The output matches
+    read_stats.dict_to_js_datatable_friendly_fmt.
+
+    The first row is fetched before the response starts, so a failing query
+    raises here rather than once a 200 has been sent. Errors after that can
+    only cut the body short.
+    """
+    rows = db.iterate(query)
+    try:
+        first = await rows.__anext__()
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(_stream_rows(_prepend(first, rows)),
+                             media_type="application/json")
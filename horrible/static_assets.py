@@ -0,0 +1,165 @@
+"""Precompressed, content-hashed serving of files under static/.
+
+Compressible assets are gzipped (and brotli'd, if the brotli package is
+installed) once into a content addressed cache, so restarts only compress
+files that changed. Files changed while the server runs are re-indexed on
+their next request. Run as a module to build the cache ahead of time:
+    python -m horrible.static_assets
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+import threading
+from typing import Dict, NamedTuple, Optional, Set
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+from horrible.config import get_logger
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+log = get_logger('static_assets')
+
+COMPRESSIBLE = {'.obj', '.mtl', '.js', '.css', '.html', '.json', '.svg', '.txt'}
+# Preference order when the client accepts several encodings.
+ENCODINGS = ['br', 'gzip']
+GZIP_LEVEL = 9
+# brotli defaults to 11, which is far too slow for the meshes.
+BROTLI_QUALITY = 9
+REVALIDATE = "no-cache"
+
+
+class StaticAsset(NamedTuple):
+    path: Path
+    etag: str
+    media_type: str
+    variants: Dict[str, Path]
+    mtime_ns: int
+    size: int
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open('rb') as fp_:
+        for chunk in iter(lambda: fp_.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    """Encodings an Accept-Encoding header allows, leaving out q=0 ones."""
+    accepted, refused = set(), set()
+    for item in header.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else refused).add(name.lower())
+    if '*' in accepted:
+        accepted.update(ENCODINGS)
+    return accepted - refused
+
+
+def _write_atomic(dest: Path, data: bytes) -> None:
+    tmp_path = dest.with_name(f"{dest.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, dest)
+
+
+class AssetStore:
+    """Manifest of static files with their ETags and compressed variants."""
+
+    def __init__(self, root: Path = Path('static'),
+                 cache_dir: Path = Path('.static-cache')):
+        self.root = Path(root).resolve()
+        self.cache_dir = Path(cache_dir)
+        self.assets: Dict[Path, StaticAsset] = {}
+        self._lock = threading.Lock()
+
+    def build(self) -> None:
+        """Hash and precompress every file under root."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.root.rglob('*')):
+            if path.is_file():
+                self.add(path)
+        log.info(f"Indexed {len(self.assets)} static assets...")
+
+    def add(self, path: Path) -> StaticAsset:
+        stat = path.stat()
+        digest = _sha256(path)
+        variants = {}
+        if path.suffix.lower() in COMPRESSIBLE:
+            raw = None
+            compressors = {'gzip': lambda data: gzip.compress(data, GZIP_LEVEL)}
+            if brotli is not None:
+                compressors['br'] = lambda data: brotli.compress(
+                    data, quality=BROTLI_QUALITY)
+            for encoding, compress in compressors.items():
+                dest = self.cache_dir.joinpath(f"{digest}.{encoding}")
+                if not dest.exists():
+                    raw = raw if raw is not None else path.read_bytes()
+                    _write_atomic(dest, compress(raw))
+                # Tiny files can grow when compressed; serve those as-is.
+                if dest.stat().st_size < stat.st_size:
+                    variants[encoding] = dest
+        media_type = mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+        asset = StaticAsset(path=path, etag=f'"{digest[:32]}"',
+                            media_type=media_type, variants=variants,
+                            mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        with self._lock:
+            self.assets[path] = asset
+        return asset
+
+    def get(self, rel_path: str) -> Optional[StaticAsset]:
+        """Look up rel_path under root, indexing it if it is new or changed."""
+        path = self.root.joinpath(rel_path).resolve()
+        if self.root not in path.parents or not path.is_file():
+            return None
+        stat = path.stat()
+        asset = self.assets.get(path)
+        if (asset is None or asset.mtime_ns != stat.st_mtime_ns or
+                asset.size != stat.st_size):
+            if asset is not None:
+                log.info(f"{path} changed...re-indexing...")
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            asset = self.add(path)
+        return asset
+
+    def serve(self, request: Request, rel_path: str,
+              cache_control: str = REVALIDATE) -> Response:
+        """Serve rel_path, honouring If-None-Match and Accept-Encoding."""
+        asset = self.get(rel_path)
+        if asset is None:
+            return Response(status_code=404)
+        headers = {'ETag': asset.etag, 'Cache-Control': cache_control,
+                   'Vary': 'Accept-Encoding'}
+        if_none_match = request.headers.get('if-none-match', '')
+        if if_none_match.strip() == '*' or asset.etag in [
+                tag.strip().lstrip('W/') for tag in if_none_match.split(',')]:
+            return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request.headers.get('accept-encoding', ''))
+        for encoding in ENCODINGS:
+            if encoding in accepted and encoding in asset.variants:
+                headers['Content-Encoding'] = encoding
+                return FileResponse(asset.variants[encoding], headers=headers,
+                                    media_type=asset.media_type)
+        return FileResponse(asset.path, headers=headers,
+                            media_type=asset.media_type)
+
+
+if __name__ == '__main__':
+    AssetStore().build()
@@ -0,0 +1,243 @@
+"""Feed a local tacview file straight into tacview_client's consumer.
+
+The stock pipeline serves the file on a loopback port with
+serve_file.serve_file and reads it back with client.AsyncStreamReader.
+FileStreamReader has the same interface but reads the file itself, in large
+chunks (memory mapped when uncompressed), so no socket is involved and any
+number of files can be ingested at once, one per process.
+
+IngestMetrics tracks the progress and phase timings of an ingest, in the
+shape of the matching tacview_files columns.
+"""
+import gzip
+import mmap
+from pathlib import Path
+import time
+from typing import Dict, List, Optional
+import zipfile
+
+from tacview_client import client
+
+try:
+    from tacview_client import copy_writer
+except ImportError:
+    copy_writer = None
+
+from horrible.config import get_logger
+
+log = get_logger('tacview_reader')
+
+CHUNK_BYTES = 4 * 1024**2
+METRIC_COLUMNS = ['bytes_total', 'bytes_read', 'lines_read', 'events_read',
+                  'objects_read', 'flush_count', 'flush_secs', 'flush_max_secs',
+                  'download_secs', 'read_secs', 'parse_secs', 'ingest_secs',
+                  'refresh_secs']
+
+
+class IngestMetrics:
+    """Progress and phase timings of one tacview file ingest.
+
+    bytes_total and bytes_read are on-disk (compressed) bytes, so their ratio
+    is the fraction of the file read. read_secs covers reading, decompressing
+    and splitting lines, flush_secs the client's COPY batches, and parse_secs
+    the rest of the ingest: line parsing and single object inserts.
+
+    Flush times are read from the client's BinCopyWriter.event_times, which
+    each COPY batch appends its duration to. Client builds without it leave
+    the flush metrics, and so parse_secs, as None.
+    """
+
+    def __init__(self):
+        self.bytes_total = 0
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.events_read = 0
+        self.objects_read: Optional[int] = None
+        self.download_secs = 0.0
+        self.read_secs = 0.0
+        self.refresh_secs = 0.0
+        self.ingest_start: Optional[float] = None
+        self.ingest_end: Optional[float] = None
+        self._flush_times: Optional[List[float]] = None
+        self._flush_base = 0
+
+    def watch_flushes(self) -> None:
+        """Count flushes the client records from now on."""
+        times = getattr(getattr(copy_writer, 'BinCopyWriter', None),
+                        'event_times', None)
+        if not isinstance(times, list):
+            log.warning("tacview_client does not record flush times; "
+                        "flush metrics are unavailable...")
+            return
+        self._flush_times, self._flush_base = times, len(times)
+
+    def _flushes(self) -> Optional[List[float]]:
+        if self._flush_times is None:
+            return None
+        return self._flush_times[self._flush_base:]
+
+    @property
+    def flush_count(self) -> Optional[int]:
+        flushes = self._flushes()
+        return None if flushes is None else len(flushes)
+
+    @property
+    def flush_secs(self) -> Optional[float]:
+        flushes = self._flushes()
+        return None if flushes is None else float(sum(flushes))
+
+    @property
+    def flush_max_secs(self) -> Optional[float]:
+        flushes = self._flushes()
+        return None if flushes is None else float(max(flushes, default=0.0))
+
+    @property
+    def ingest_secs(self) -> float:
+        if self.ingest_start is None:
+            return 0.0
+        return (self.ingest_end or time.perf_counter()) - self.ingest_start
+
+    @property
+    def parse_secs(self) -> Optional[float]:
+        flush_secs = self.flush_secs
+        if flush_secs is None:
+            return None
+        return max(self.ingest_secs - self.read_secs - flush_secs, 0.0)
+
+    def values(self) -> List:
+        """Metric values in METRIC_COLUMNS order."""
+        return [getattr(self, col) for col in METRIC_COLUMNS]
+
+    def as_dict(self) -> Dict:
+        return dict(zip(METRIC_COLUMNS, self.values()))
+
+
+class FileStreamReader:
+    """Drop-in replacement for client.AsyncStreamReader reading a local file."""
+
+    def __init__(self, file_name: Path, chunk_bytes: int = CHUNK_BYTES,
+                 metrics: Optional[IngestMetrics] = None):
+        self.file_name = Path(file_name)
+        self.chunk_bytes = chunk_bytes
+        self.metrics = metrics or IngestMetrics()
+        self.lines: List[str] = []
+        self.pos = 0
+        self.tail = b''
+        self.bytes_read = 0
+        self._raw = None
+        self._fp = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._offset = 0
+
+    async def open_connection(self) -> None:
+        log.info(f"Opening {self.file_name} for in-process reading...")
+        # Compressed streams wrap _raw, whose position gives the progress.
+        self._raw = self.file_name.open("rb")
+        if self.file_name.suffix == ".gz":
+            self._fp = gzip.GzipFile(fileobj=self._raw, mode="rb")
+        elif zipfile.is_zipfile(self._raw):
+            zfile = zipfile.ZipFile(self._raw)
+            self._fp = zfile.open(zfile.filelist[0], "r")
+        elif self.file_name.stat().st_size:
+            self._mmap = mmap.mmap(self._raw.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        else:
+            self._fp = self._raw
+        # AsyncStreamReader consumes one line as the server's handshake reply;
+        # with a served file that is the file's first line, so skip it too.
+        await self.read_stream()
+
+    def _read_chunk(self) -> bytes:
+        if self._mmap is not None:
+            chunk = self._mmap[self._offset:self._offset + self.chunk_bytes]
+            self._offset += len(chunk)
+            return chunk
+        return self._fp.read(self.chunk_bytes)
+
+    def _fill(self) -> bool:
+        """Decode the next chunk of complete lines, returning False at EOF."""
+        start = time.perf_counter()
+        try:
+            while True:
+                chunk = self._read_chunk()
+                self.metrics.bytes_read = (self._offset if self._mmap is not None
+                                           else self._raw.tell())
+                if not chunk:
+                    # A zip's central directory is never read; count it anyway.
+                    self.metrics.bytes_read = self.file_name.stat().st_size
+                    # Like readuntil on the socket, drop a final unterminated line.
+                    return False
+                self.bytes_read += len(chunk)
+                chunk = self.tail + chunk
+                cut = chunk.rfind(b"\n")
+                if cut == -1:
+                    self.tail = chunk
+                    continue
+                self.tail = chunk[cut + 1:]
+                chunk = chunk[:cut]
+                self.lines = chunk.decode("UTF-8").split("\n")
+                self.pos = 0
+                # Lines starting with '#' are time frames, the rest events.
+                frames = chunk.count(b"\n#") + chunk.startswith(b"#")
+                self.metrics.lines_read += len(self.lines)
+                self.metrics.events_read += len(self.lines) - frames
+                return True
+        finally:
+            self.metrics.read_secs += time.perf_counter() - start
+
+    async def read_stream(self) -> str:
+        """Return the next line, without its newline."""
+        if self.pos >= len(self.lines) and not self._fill():
+            raise client.EndOfFileException
+        line = self.lines[self.pos]
+        self.pos += 1
+        return line
+
+    def close_file(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._fp is not None:
+            self._fp.close()
+        if self._raw is not None:
+            self._raw.close()
+
+    async def close(self, status, session_id=None) -> None:
+        self.close_file()
+        log.info(f"Marking session status: {status}...")
+        await client.ASYNC_CON.execute(
+            "UPDATE session SET status = $1 WHERE session_id = $2",
+            status, session_id)
+
+
+async def consume_file(file_name: Path, overwrite: bool = False,
+                       batch_size: int = 100000,
+                       max_iters: Optional[int] = None,
+                       metrics: Optional[IngestMetrics] = None) -> IngestMetrics:
+    """Ingest a local (optionally gzipped or zipped) tacview file in-process.
+
+    client.consumer builds its reader from the module level AsyncStreamReader,
+    so it is swapped for the duration of the call. That is process wide;
+    run one ingest per process. Progress is recorded on metrics as the
+    ingest runs, so it can be read concurrently; objects_read is left to
+    the caller, which can count them once the session is written.
+    """
+    metrics = metrics or IngestMetrics()
+    if not metrics.bytes_total:
+        metrics.bytes_total = Path(file_name).stat().st_size
+    stock_reader = client.AsyncStreamReader
+    client.AsyncStreamReader = lambda *args, **kwargs: FileStreamReader(
+        file_name, metrics=metrics)
+    metrics.watch_flushes()
+    metrics.ingest_start = time.perf_counter()
+    try:
+        await client.consumer(host=None, port=None,
+                              client_username="0",
+                              client_password="tacview-client",
+                              max_iters=max_iters,
+                              overwrite=overwrite,
+                              batch_size=batch_size)
+    finally:
+        metrics.ingest_end = time.perf_counter()
+        client.AsyncStreamReader = stock_reader
+        log.info(f"Ingest metrics for {file_name}: {metrics.as_dict()}")
+    return metrics
@@ -0,0 +1,267 @@
+"""Resampling, simplification and binary encoding of killcam trajectories."""
+import json
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from horrible.config import get_logger
+
+log = get_logger('trajectory')
+
+TRACK_GROUPS = ['killer', 'target', 'weapon']
+TRACK_ARRAYS = {'coord': 3, 'rot': 3, 'heading': 1, 'time_step': 1}
+BINARY_MEDIA_TYPE = 'application/octet-stream'
+BINARY_VERSION = 1
+# Highest resampling rate, in frames per second, and the fewest points a
+# simplified track keeps.
+MAX_RATE = 60
+MIN_POINTS = 2
+
+
+def _interp_angles(new_t: np.ndarray, t: np.ndarray,
+                   angles: np.ndarray) -> np.ndarray:
+    """Interpolate angles in degrees without spinning the long way round."""
+    unwrapped = np.rad2deg(np.unwrap(np.deg2rad(angles), axis=0))
+    out = np.column_stack([np.interp(new_t, t, unwrapped[:, i])
+                           for i in range(unwrapped.shape[1])])
+    # Wrap back into the convention of the source: [0, 360) or [-180, 180).
+    signed = (angles < 0).any(axis=0)
+    return np.where(signed, (out + 180) % 360 - 180, out % 360)
+
+
+def resample_track(rec: Dict, rate: float) -> Dict:
+    """Resample one object's samples onto a fixed rate of frames per second.
+
+    Positions are interpolated linearly and rotations/headings along the
+    shortest arc. Samples are sorted by time and repeated timestamps keep
+    their first sample. Objects spanning less than two distinct timestamps
+    are returned unchanged. rate must be positive and at most MAX_RATE.
+    """
+    if not 0 < rate <= MAX_RATE:
+        raise ValueError(f"rate must be in (0, {MAX_RATE}], got {rate}")
+    t, first = np.unique(np.asarray(rec['time_step'], dtype=float),
+                         return_index=True)
+    if t.size < 2:
+        return rec
+    new_t = np.arange(t[0], t[-1], 1.0 / rate)
+    if new_t[-1] < t[-1]:
+        new_t = np.append(new_t, t[-1])
+
+    coord = np.asarray(rec['coord'], dtype=float)[first]
+    rot = np.asarray(rec['rot'], dtype=float)[first]
+    heading = np.asarray(rec['heading'], dtype=float).reshape(-1, 1)[first]
+
+    out = dict(rec)
+    out['coord'] = np.column_stack([np.interp(new_t, t, coord[:, i])
+                                    for i in range(3)]).round(2).tolist()
+    out['rot'] = _interp_angles(new_t, t, rot).round(2).tolist()
+    out['heading'] = _interp_angles(new_t, t, heading)[:, 0].round(2).tolist()
+    out['time_step'] = new_t.round(3).tolist()
+    return out
+
+
+def dp_significance(points: np.ndarray) -> np.ndarray:
+    """Douglas-Peucker significance of each point of a polyline.
+
+    Each interior point gets the distance at which Douglas-Peucker would
+    split on it; keeping points whose significance exceeds a tolerance gives
+    the usual simplification, and keeping the largest N gives a point budget.
+    Endpoints are always infinitely significant.
+    """
+    n = points.shape[0]
+    sig = np.zeros(n)
+    sig[0] = sig[-1] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        inner = points[first + 1:last]
+        start, end = points[first], points[last]
+        seg = end - start
+        seg_len = np.linalg.norm(seg)
+        if seg_len == 0:
+            dist = np.linalg.norm(inner - start, axis=1)
+        else:
+            dist = np.linalg.norm(np.cross(inner - start, seg), axis=1) / seg_len
+        idx = int(dist.argmax())
+        # Clamp so a child never outranks the split that exposed it.
+        split_sig = min(dist[idx], parent)
+        split = first + 1 + idx
+        sig[split] = split_sig
+        stack.append((first, split, split_sig))
+        stack.append((split, last, split_sig))
+    return sig
+
+
+def simplify_track(rec: Dict, tolerance: Optional[float] = None,
+                   max_points: Optional[int] = None) -> Dict:
+    """Drop samples that lie within tolerance meters of the simplified path.
+
+    If max_points is given at most that many of the most significant samples
+    are kept, ties going to the earlier sample; the endpoints are always
+    kept and budgets beyond the track's length keep every sample.
+    """
+    if tolerance is not None and tolerance <= 0:
+        raise ValueError(f"tolerance must be positive, got {tolerance}")
+    if max_points is not None and max_points < MIN_POINTS:
+        raise ValueError(f"max_points must be at least {MIN_POINTS}, got {max_points}")
+    coord = np.asarray(rec['coord'], dtype=float)
+    if coord.shape[0] <= 2:
+        return rec
+    sig = dp_significance(coord)
+    keep = np.ones(coord.shape[0], dtype=bool)
+    if tolerance is not None:
+        keep &= sig > tolerance
+    idx = np.flatnonzero(keep)
+    if max_points is not None and idx.size > max_points:
+        # Endpoints are infinitely significant, so they always rank first.
+        ranked = idx[np.argsort(-sig[idx], kind='stable')]
+        idx = np.sort(ranked[:max_points])
+
+    out = dict(rec)
+    for col in ['coord', 'rot', 'heading', 'time_step']:
+        out[col] = [rec[col][i] for i in idx]
+    return out
+
+
+def reduce_kill(data: Dict, rate: Optional[float] = None,
+                tolerance: Optional[float] = None,
+                max_points: Optional[int] = None) -> Dict:
+    """Resample and/or simplify every track of a killcam payload."""
+    def reduce(rec):
+        if rec is None:
+            return rec
+        if rate:
+            rec = resample_track(rec, rate)
+        if tolerance is not None or max_points is not None:
+            rec = simplify_track(rec, tolerance, max_points)
+        return rec
+
+    before = sum(len(r['time_step']) for r in _tracks(data))
+    out = dict(data)
+    for group in TRACK_GROUPS:
+        out[group] = reduce(data[group])
+    out['other'] = [reduce(rec) for rec in data['other']]
+    after = sum(len(r['time_step']) for r in _tracks(out))
+    log.info(f"Reduced kill {data['impact_id']} from {before} to {after} samples...")
+    return out
+
+
+def _tracks(data: Dict):
+    for group in TRACK_GROUPS:
+        if data[group] is not None:
+            yield data[group]
+    yield from data['other']
+
+
+def _positions_at(rec: Dict, times: np.ndarray):
+    """Interpolate rec's coordinates at times, with a mask of times it spans."""
+    t = np.asarray(rec['time_step'], dtype=float)
+    coord = np.asarray(rec['coord'], dtype=float).reshape(-1, 3)
+    pos = np.column_stack([np.interp(times, t, coord[:, i]) for i in range(3)])
+    return pos, (times >= t[0]) & (times <= t[-1])
+
+
+def filter_nearby(data: Dict, radius: float) -> Dict:
+    """Keep only 'other' objects that come within radius meters of the killer,
+    target or weapon at the same moment during the window."""
+    keys = [data[group] for group in TRACK_GROUPS
+            if data[group] is not None and data[group]['time_step']]
+    nearby = []
+    for rec in data['other']:
+        times = np.asarray(rec['time_step'], dtype=float)
+        coord = np.asarray(rec['coord'], dtype=float).reshape(-1, 3)
+        for key in keys:
+            pos, alive = _positions_at(key, times)
+            dist = np.linalg.norm(coord[alive] - pos[alive], axis=1)
+            if dist.size and dist.min() <= radius:
+                nearby.append(rec)
+                break
+    log.info(f"Kept {len(nearby)} of {len(data['other'])} other objects "
+             f"within {radius}m...")
+    return dict(data, other=nearby, radius=radius)
+
+
+def _origin(data: Dict) -> List[float]:
+    for rec in _tracks(data):
+        if rec['coord']:
+            return [float(c) for c in rec['coord'][0]]
+    return [0.0, 0.0, 0.0]
+
+
+def encode_kill_binary(data: Dict) -> bytes:
+    """Pack a killcam payload as a JSON header followed by float32 buffers.
+
+    Layout, all little-endian:
+        uint32 header length, the UTF-8 JSON header space-padded so the body
+        starts 4-byte aligned, then a body holding each object's coord, rot,
+        heading and time_step arrays as float32, in header order.
+    Coordinates are rebased to header['origin'] (the killer's first
+    position) and times to header['min_ts'], so float32 keeps sub-meter and
+    millisecond precision. Each object in header['objects'] gives its sample
+    count and the byte offset of each array from the start of the body.
+    """
+    origin = np.array(_origin(data))
+    min_ts = data['min_ts'] or 0.0
+    tracks = [(group, data[group]) for group in TRACK_GROUPS
+              if data[group] is not None]
+    tracks += [('other', rec) for rec in data['other']]
+
+    objects, buffers = [], []
+    body_len = 0
+    for group, rec in tracks:
+        n = len(rec['time_step'])
+        arrays = {
+            'coord': np.asarray(rec['coord'], dtype=float).reshape(n, 3) - origin,
+            'rot': np.asarray(rec['rot'], dtype=float).reshape(n, 3),
+            'heading': np.asarray(rec['heading'], dtype=float),
+            'time_step': np.asarray(rec['time_step'], dtype=float) - min_ts,
+        }
+        meta = {k: v for k, v in rec.items() if k not in TRACK_ARRAYS}
+        meta.update({'group': group, 'count': n, 'offsets': {}})
+        for name in TRACK_ARRAYS:
+            buf = arrays[name].astype('<f4').tobytes()
+            meta['offsets'][name] = body_len
+            buffers.append(buf)
+            body_len += len(buf)
+        objects.append(meta)
+
+    header = {k: v for k, v in data.items() if k not in TRACK_GROUPS + ['other']}
+    header.update({'version': BINARY_VERSION, 'origin': origin.tolist(),
+                   'objects': objects})
+    raw = json.dumps(header, separators=(',', ':')).encode()
+    # Pad so the float32 body starts 4-byte aligned.
+    raw += b' ' * (-(4 + len(raw)) % 4)
+    return struct.pack('<I', len(raw)) + raw + b''.join(buffers)
+
+
+def decode_kill_binary(payload: bytes) -> Dict:
+    """Inverse of encode_kill_binary, returning absolute coordinates and times."""
+    header_len = struct.unpack_from('<I', payload)[0]
+    header = json.loads(payload[4:4 + header_len])
+    body = 4 + header_len
+    origin = np.array(header.pop('origin'))
+    min_ts = header['min_ts'] or 0.0
+    header.pop('version')
+    objects = header.pop('objects')
+    data = dict(header, other=[], **{group: None for group in TRACK_GROUPS})
+    for meta in objects:
+        group, n, offsets = meta.pop('group'), meta.pop('count'), meta.pop('offsets')
+        rec = dict(meta)
+        for name, width in TRACK_ARRAYS.items():
+            arr = np.frombuffer(payload, dtype='<f4', count=n * width,
+                                offset=body + offsets[name]).astype(float)
+            if name == 'coord':
+                arr = arr.reshape(n, 3) + origin
+            elif name == 'rot':
+                arr = arr.reshape(n, 3)
+            elif name == 'time_step':
+                arr = arr + min_ts
+            rec[name] = arr.tolist()
+        if group == 'other':
+            data['other'].append(rec)
+        else:
+            data[group] = rec
+    return data
@@ -1,20 +1,26 @@
+import asyncio
+import gzip
+import json
 from pathlib import Path
 import urllib.parse
 
 import databases
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse, Response
 from starlette.requests import Request
 from fastapi.staticfiles import StaticFiles
 from horrible.database import DATABASE_URL
-from horrible import read_stats, killcam
+from horrible import read_stats, killcam, datatables, trajectory
+from horrible.responses import ORJSONResponse, frame_response, stream_query
+from horrible.static_assets import AssetStore, REVALIDATE
 from horrible.config import get_logger
 
 db = databases.Database(DATABASE_URL, min_size=1, max_size=3)
 log = get_logger('horrible')
 MESHES = [str(p.name) for p in list(Path("static/mesh/").glob("*.obj"))]
 # MESHES = [str(p.name) for p in list(Path("static/mesh/").glob("*.glb"))]
-app = FastAPI(title="Stat-Server")
+ASSETS = AssetStore(Path("static"))
+app = FastAPI(title="Stat-Server", default_response_class=ORJSONResponse)
 # app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
@@ -23,6 +29,7 @@ async def database_connect():
     try:
         await db.connect()
         await db.execute("SET application_name to app_server")
+        await asyncio.get_event_loop().run_in_executor(None, ASSETS.build)
         log.info('Startup complete...')
     except Exception as err:
         log.error(f"Could not conect to database at {db.url}!")
@@ -45,8 +52,8 @@ def healthz():
 
 
 @app.get("/")
-async def serve_index():
-    return FileResponse("./static/index.html")
+async def serve_index(request: Request):
+    return ASSETS.serve(request, "index.html")
 
 
 @app.get("/static/mesh")
@@ -57,64 +64,74 @@ async def serve_mesh(request: Request, obj_name: str):
     obj_name = obj_name.replace("F-4E", "F-4")
     obj_name = obj_name.replace("F-15C", "F-15")
 
+    # These URLs carry no content hash, and an unknown name gets a fallback
+    # mesh until the real one is added, so clients revalidate by ETag.
     if obj_name in MESHES:
-        return FileResponse(f"./static/mesh/{obj_name}")
+        return ASSETS.serve(request, f"mesh/{obj_name}", REVALIDATE)
     log.info(f"Direct match not found for {obj_name}")
     if not 'FixedWing' in obj_name:
-        return FileResponse('./static/mesh/Missile.AIM-120C.obj')
+        return ASSETS.serve(request, 'mesh/Missile.AIM-120C.obj', REVALIDATE)
     else:
-        return FileResponse('./static/mesh/FixedWing.F-18C.obj')
+        return ASSETS.serve(request, 'mesh/FixedWing.F-18C.obj', REVALIDATE)
 
 
 @app.get("/static/images/{img_name}")
-async def serve_mesh(img_name: str):
-    return FileResponse(f"./static/images/{img_name}")
+async def serve_image(request: Request, img_name: str):
+    return ASSETS.serve(request, f"images/{img_name}", REVALIDATE)
 
 
 @app.get("/static/textures/{img_name}")
-async def serve_texture(img_name: str):
-    return FileResponse(f"./static/textures/{img_name}")
+async def serve_texture(request: Request, img_name: str):
+    return ASSETS.serve(request, f"textures/{img_name}", REVALIDATE)
 
 
 @app.get("/static/main-bundle.js")
-async def serve_js():
-    return FileResponse("./static/main-bundle.js")
+async def serve_js(request: Request):
+    return ASSETS.serve(request, "main-bundle.js", REVALIDATE)
 
 
 @app.get("/static/css/main.css")
-async def serve_css():
-    return FileResponse("./static/css/main.css")
+async def serve_css(request: Request):
+    return ASSETS.serve(request, "css/main.css", REVALIDATE)
 
 
 @app.get("/resync_file/")
 async def resync_file(request: Request, file_name: str):
-    """Delete a previously processed file from the database, triggering a re-sync."""
+    """Mark a previously processed file for reprocessing on the next sync."""
     stat_file_name = Path(urllib.parse.unquote(file_name))
     if 'mission-stats' in file_name:
         log.info(f"Attempting to resync stats-file: {stat_file_name}...")
-        log.info(f"Deleting filename: {stat_file_name} from database...")
-        async with db.transaction():
-            await db.execute(f"""DELETE FROM mission_stats
-                WHERE file_name = '{stat_file_name}'""")
-            await db.execute(f"""DELETE FROM mission_stat_files
-                WHERE file_name = '{stat_file_name}'""")
-            if stat_file_name.exists():
-                stat_file_name.unlink()
-            else:
-                log.warning("Local cached copy of file not found!")
+        await read_stats.resync_stat_file(db, str(stat_file_name))
+        if stat_file_name.exists():
+            stat_file_name.unlink()
+        else:
+            log.warning("Local cached copy of file not found!")
     return "ok"
 
 
+FILE_LOG_QUERY = """SELECT
+        file_name, session_start_time, session_last_update, processed,
+        file_size_kb, process_start, errors
+        FROM {table}
+        """
+FILE_LOG_COLUMNS = ['file_name', 'session_start_time', 'session_last_update',
+                    'processed', 'file_size_kb', 'process_start', 'errors']
+
+
+async def file_log_table(request: Request, table: str):
+    query = FILE_LOG_QUERY.format(table=table)
+    params = datatables.parse_datatable_params(request.query_params)
+    if params:
+        return ORJSONResponse(await datatables.query_datatable(
+            db, query, FILE_LOG_COLUMNS, params, key='file_name'))
+    return await stream_query(db, query)
+
+
 @app.get("/stat_logs")
 async def get_stat_logs(request: Request):
     """Get a json dictionary of mission-stat file status data."""
     try:
-        data = await db.fetch_all("""SELECT
-        file_name, session_start_time, session_last_update, processed,
-        file_size_kb, process_start, errors
-        FROM mission_stat_files
-        """)
-        return read_stats.dict_to_js_datatable_friendly_fmt(data)
+        return await file_log_table(request, 'mission_stat_files')
     except Exception as e:
         log.error(e)
         return {}
@@ -124,12 +141,7 @@ async def get_stat_logs(request: Request):
 async def get_event_logs(request: Request):
     """Get a json dictionary of mission-event file status data."""
     try:
-        data = await db.fetch_all("""SELECT
-        file_name, session_start_time, session_last_update, processed,
-        file_size_kb, process_start, errors
-        FROM mission_event_files
-        """)
-        return read_stats.dict_to_js_datatable_friendly_fmt(data)
+        return await file_log_table(request, 'mission_event_files')
     except Exception as e:
         log.error(e)
         return {}
@@ -138,13 +150,22 @@ async def get_event_logs(request: Request):
 @app.get("/frametime_logs")
 async def get_frametime_logs(request: Request):
     """Get a json dictionary of mission-stat file status data."""
-    data = await db.fetch_all("""SELECT
-        file_name, session_start_time, session_last_update, processed,
-        file_size_kb, process_start, errors
-        FROM frametime_files
-        """
-    )
-    return read_stats.dict_to_js_datatable_friendly_fmt(data)
+    return await file_log_table(request, 'frametime_files')
+
+
+@app.get("/frametime")
+async def get_frametime(request: Request, file_name: str,
+                        points: int = read_stats.FRAMETIME_POINTS):
+    """Get FPS p1/p50/p99 for a frametime file at no more than ~points intervals."""
+    data = await read_stats.read_frametime(db, urllib.parse.unquote(file_name),
+                                           points)
+    return ORJSONResponse(data)
+
+
+@app.get("/sync_state")
+async def get_sync_state(request: Request):
+    """Get a json dictionary of GCS sync watermarks and scan counts per prefix."""
+    return await stream_query(db, "SELECT * FROM gcs_sync_state")
 
 
 @app.get("/weapon_db")
@@ -154,16 +175,20 @@ async def get_weapon_db_logs(request: Request):
     content = {"data": [], "columns": [{'title': c.title()} for c in data[0].keys()]}
     for row in data:
         content['data'].append(list(row.values()))
-    return content
+    return ORJSONResponse(content)
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """Hit/miss counters for the in-process stats result cache."""
+    return ORJSONResponse(read_stats.STAT_CACHE.stats())
 
 
 @app.get("/overall")
 async def get_overall_stats(request: Request):
     """Get a json dictionary of grouped statistics as key-value pairs."""
     data = await read_stats.calculate_overall_stats(grouping_cols=['pilot'], db=db)
-    data = data.to_dict('split')
-    data['columns'] = [{'title': c.title()} for c in data['columns']]
-    return data
+    return frame_response(data)
 
 
 @app.get("/session_performance")
@@ -175,43 +200,53 @@ async def get_session_perf_stats(request: Request):
     data.sort_values(by=['session_start_date', 'A/A Kills'],
                      ascending=False,
                      inplace=True)
-    data = data.to_dict('split')
-    data['columns'] = [{'title': c.replace("_", " ").title()} for c in data['columns']]
-    return data
+    return frame_response(data, title=lambda c: c.replace("_", " ").title())
 
 
 @app.get("/weapons")
 async def weapon_stats(request: Request):
     """Return a rendered template with a table displaying per-weapon stats."""
     data = await read_stats.get_dataframe(db, subset=["weapons"])
-    data = data.to_dict('split')
-    data['columns'] = [{'title': c.title()} for c in data['columns']]
-    return data
+    return frame_response(data)
 
 
 @app.get("/kills")
 async def kill_detail(request: Request):
     """Return a rendered template showing kill/loss statistics."""
     data = await read_stats.get_dataframe(db, subset=["kills"])
-    data = data.to_dict('split')
-    data['columns'] = [{'title': c.title()} for c in data['columns']]
-    return data
+    return frame_response(data)
 
 
 @app.get("/losses")
 async def loss_detail(request: Request):
     """Return a rendered template showing kill/loss statistics."""
     data = await read_stats.get_dataframe(db, subset=["losses"])
-    data = data.to_dict('split')
-    data['columns'] = [{'title': c.title()} for c in data['columns']]
-    return data
+    return frame_response(data)
 
 
 @app.get("/tacview")
 async def tacview_detail(request: Request):
     """Return tacview download links."""
-    data = await read_stats.query_tacview_files(db)
-    return data
+    params = datatables.parse_datatable_params(request.query_params)
+    if params:
+        return ORJSONResponse(await datatables.query_datatable(
+            db, read_stats.TACVIEW_FILES_QUERY, read_stats.TACVIEW_FILES_COLUMNS,
+            params, key='file_name'))
+    log.info("Reading tacview files...")
+    return await stream_query(db, read_stats.TACVIEW_FILES_QUERY)
+
+
+@app.get("/tacview_metrics")
+async def tacview_metrics(request: Request):
+    """Return ingest progress, throughput and phase timings of tacview files."""
+    params = datatables.parse_datatable_params(request.query_params)
+    if params:
+        return ORJSONResponse(await datatables.query_datatable(
+            db, read_stats.TACVIEW_METRICS_QUERY,
+            read_stats.TACVIEW_METRICS_COLUMNS, params, key='file_name'))
+    log.info("Reading tacview ingest metrics...")
+    return await stream_query(db, f"{read_stats.TACVIEW_METRICS_QUERY} "
+                                  "ORDER BY last_update DESC NULLS LAST")
 
 
 @app.get("/process_tacview/")
@@ -223,24 +258,72 @@ async def process_tacview(filename: str):
 @app.get("/events")
 async def event_detail(request: Request):
     """Return SlMod event records."""
+    params = datatables.parse_datatable_params(request.query_params)
+    if params:
+        return ORJSONResponse(await datatables.query_datatable(
+            db, read_stats.EVENTS_QUERY, read_stats.EVENTS_COLUMNS, params))
     data = await read_stats.read_events(db)
-    data = data.to_dict('split')
-    data['columns'] = [{'title': c.title()} for c in data['columns']]
-    return data
+    return frame_response(data)
 
 
 @app.get("/tacview_kills")
 async def tacview_kills(request: Request):
     """Get a list of tacview kills."""
-    data = await killcam.get_all_kills(db)
-    return data
+    params = datatables.parse_datatable_params(request.query_params)
+    if params:
+        return ORJSONResponse(await datatables.query_datatable(
+            db, killcam.KILLS_QUERY, killcam.KILLS_COLUMNS, params, key='id'))
+    log.info('Querying for all kills...')
+    return await stream_query(db, f"{killcam.KILLS_QUERY} ORDER BY kill_timestamp DESC")
 
 
 @app.get("/kill_coords")
-async def get_kill_coords(request: Request, kill_id: int):
-    """Get Points Preceeding kill."""
+async def get_kill_coords(
+        request: Request, kill_id: int,
+        rate: float = Query(None, gt=0, le=trajectory.MAX_RATE),
+        tolerance: float = Query(None, gt=0),
+        max_points: int = Query(None, ge=trajectory.MIN_POINTS),
+        radius: float = Query(None, gt=0)):
+    """Get Points Preceeding kill.
+
+    radius (meters) limits other objects to those passing that close to the
+    killer, target or weapon; radii beyond that of the stored replay are
+    computed live. rate resamples every track to that many frames per second; tolerance
+    (meters) and max_points simplify tracks Douglas-Peucker style. Out of
+    range values are rejected with a 422; rate is at most
+    trajectory.MAX_RATE and max_points is capped by each track's length. Clients
+    accepting application/octet-stream get float32 buffers rather than JSON,
+    see trajectory.encode_kill_binary.
+    """
     # pilot = urllib.parse.unquote(kill_id)
-    data = await killcam.get_kill(kill_id, db)
-    if not data:
-        return JSONResponse(status_code=500)
-    return JSONResponse(content=data)
+    payload = await killcam.get_kill_replay(kill_id, db)
+    if not payload:
+        return JSONResponse({'detail': 'Kill not found'}, status_code=404)
+    binary = trajectory.BINARY_MEDIA_TYPE in request.headers.get('accept', '')
+    if (binary or rate or tolerance is not None or max_points is not None or
+            radius is not None):
+        data = json.loads(gzip.decompress(payload))
+        if radius is not None:
+            stored_radius = data.get('radius')
+            if stored_radius is not None and radius > stored_radius:
+                data = await killcam.get_kill(data['impact_id'], db, radius)
+                if data is None:
+                    return JSONResponse({'detail': 'Kill not found'},
+                                        status_code=404)
+            else:
+                data = trajectory.filter_nearby(data, radius)
+        if rate or tolerance is not None or max_points is not None:
+            data = trajectory.reduce_kill(data, rate=rate, tolerance=tolerance,
+                                          max_points=max_points)
+        if binary:
+            return Response(trajectory.encode_kill_binary(data),
+                            media_type=trajectory.BINARY_MEDIA_TYPE,
+                            headers={'Vary': 'Accept'})
+        return ORJSONResponse(data, headers={'Vary': 'Accept'})
+    # Accept picks binary over these, Accept-Encoding gzip over plain.
+    vary = {'Vary': 'Accept, Accept-Encoding'}
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        return Response(payload, media_type='application/json',
+                        headers=dict(vary, **{'Content-Encoding': 'gzip'}))
+    return Response(gzip.decompress(payload), media_type='application/json',
+                    headers=vary)
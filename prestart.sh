@@ -5,12 +5,14 @@ import asyncio
 import databases
 from tacview_client import db as tac_db
 from horrible import read_stats
-from horrible.database import DATABASE_URL
+from horrible.database import DATABASE_URL, create_tables, migrate_tables
 
 async def prestart():
     db = databases.Database(DATABASE_URL)
     await db.connect()
     tac_db.create_tables()
+    create_tables()
+    migrate_tables()
 
 print('Populating weapondb and creating tacview tables...')
 asyncio.run(prestart())
@@ -0,0 +1,416 @@
+"""Micro-benchmarks for the stats pipeline, killcam payloads, API responses
+and tacview ingest.
+
+Run from the project root, eg:
+    python scripts/benchmark.py rec-keys --keys-file keys.txt
+"""
+import argparse
+import asyncio
+import datetime
+import decimal
+from functools import partial
+import gzip
+import json
+import struct
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from horrible import read_stats, responses, trajectory
+from horrible.database import DATABASE_URL
+from tests.golden import (legacy_concat_cols, legacy_parse_rec_keys,
+                          legacy_read_event_table, legacy_zero_gun_kills)
+
+
+async def fetch_rec_keys(dsn: str) -> List[str]:
+    """Collect every key of every mission_stats record, with repeats."""
+    import databases
+    db = databases.Database(dsn)
+    await db.connect()
+    recs = await db.fetch_all(
+        "SELECT json_object_keys(record::json) AS key FROM mission_stats")
+    await db.disconnect()
+    return [r['key'] for r in recs]
+
+
+def _safe_call(func, key):
+    try:
+        return func(key)
+    except ValueError as err:
+        return str(err)
+
+
+def bench_rec_keys(args) -> None:
+    """Compare the memoized classifier with the legacy regex cascade."""
+    if args.keys_file:
+        keys = Path(args.keys_file).read_text().splitlines()
+    else:
+        keys = asyncio.get_event_loop().run_until_complete(
+            fetch_rec_keys(args.dsn))
+    print(f"Corpus: {len(keys):,} keys, {len(set(keys)):,} distinct")
+
+    for name, func in [('legacy', legacy_parse_rec_keys),
+                       ('memoized', read_stats.parse_rec_keys)]:
+        secs = min(timeit.repeat(
+            lambda: [_safe_call(func, k) for k in keys],
+            number=1, repeat=args.repeat))
+        print(f"{name:>10}: {secs:.4f}s ({len(keys) / secs:,.0f} keys/sec)")
+    print(read_stats._classify_rec_key.cache_info())
+
+
+def synthetic_kv_frame(rows: int) -> pd.DataFrame:
+    """A frame shaped like collect_recs_kv output."""
+    rng = np.random.RandomState(42)
+    return pd.DataFrame({
+        'pilot': rng.choice([f"pilot_{i}" for i in range(200)], rows),
+        'category': rng.choice(['Gun', 'Air-to-Air', 'Bomb', 'Planes',
+                                'pilotDeath'], rows),
+        'metric': rng.choice(['kills', 'shot', 'numHits', 'total'], rows),
+        'stat_group': rng.choice(['weapons', 'kills', 'losses'], rows),
+        'equipment': rng.choice(['AIM-120C', 'GBU-12', 'F-16C_50'], rows),
+        'value': rng.randint(0, 10, rows),
+    })
+
+
+def bench_stats_pipeline(args) -> None:
+    """Time vectorized pipeline steps against the row-wise originals.
+
+    Their outputs are checked against each other in tests/test_stats_pipeline.py.
+    """
+    data = synthetic_kv_frame(args.rows)
+    sample = data.head(args.legacy_rows).copy()
+    print(f"Frame: {data.shape[0]:,} rows, row-wise timed on {sample.shape[0]:,}")
+
+    steps = {
+        'zero_gun_kills': (lambda df: read_stats.zero_gun_kills(df.copy()),
+                           lambda df: legacy_zero_gun_kills(df.copy())),
+        'concat_cols': (
+            lambda df: read_stats.concat_cols(
+                df, ['category', 'metric', 'stat_group'], sep='__'),
+            lambda df: legacy_concat_cols(
+                df, ['category', 'metric', 'stat_group'], sep='__')),
+    }
+    for name, (vectorized, legacy) in steps.items():
+        secs = min(timeit.repeat(lambda: vectorized(data),
+                                 number=1, repeat=args.repeat))
+        legacy_secs = min(timeit.repeat(lambda: legacy(sample),
+                                        number=1, repeat=args.repeat))
+        legacy_secs *= data.shape[0] / sample.shape[0]
+        print(f"{name:>16}: {secs:.3f}s vectorized, "
+              f"~{legacy_secs:.3f}s row-wise (extrapolated)")
+
+
+def _timed_peak(func):
+    tracemalloc.start()
+    start = timeit.default_timer()
+    func()
+    secs = timeit.default_timer() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return secs, peak
+
+
+def bench_events(args) -> None:
+    """Time the streaming event tokenizer against the eval-based reader.
+
+    Their outputs are checked against each other in tests/test_events.py.
+    """
+    file_name = Path(args.file)
+
+    def stream_batches():
+        for _ in read_stats.read_event_batches(file_name, args.batch_size):
+            pass
+
+    for name, func in [('eval', lambda: legacy_read_event_table(file_name)),
+                       ('streamed', stream_batches)]:
+        secs, peak = _timed_peak(func)
+        print(f"{name:>10}: {secs:.3f}s, peak memory {peak / 1e6:,.1f}MB")
+
+
+def synthetic_kill(objects: int, samples: int) -> Dict:
+    """A killcam payload shaped like killcam.build_kill output."""
+    rng = np.random.default_rng(0)
+    t = 3600.0 + np.cumsum(rng.uniform(0.02, 0.2, samples))
+
+    def track(obj_id):
+        start = rng.uniform(-4e5, 4e5, 3) * [1, 0.01, 1] + [0, 5000, 0]
+        coord = start + np.cumsum(rng.normal(0, 20, (samples, 3)), axis=0)
+        rot = rng.uniform(-180, 180, (samples, 3))
+        return {'id': obj_id, 'session_id': 1, 'name': f"obj-{obj_id}",
+                'type': 'Air+FixedWing', 'color': 'Red', 'cat': 'Air+FixedWing',
+                'coord': coord.round(2).tolist(), 'rot': rot.round(2).tolist(),
+                'heading': (rot[:, 2] % 360).round(2).tolist(),
+                'time_step': t.round(2).tolist()}
+
+    return {'min_ts': float(t[0]), 'max_ts': float(t[-1]), 'impact_id': 1,
+            'impact_dist': '1.5m', 'killer': track(1), 'target': track(2),
+            'weapon': track(3), 'other': [track(i) for i in range(4, objects + 1)]}
+
+
+def parse_binary_buffers(payload: bytes) -> None:
+    """What a browser does with the binary format: one typed-array view per buffer."""
+    header_len = struct.unpack_from('<I', payload)[0]
+    header = json.loads(payload[4:4 + header_len])
+    for meta in header['objects']:
+        for name, width in trajectory.TRACK_ARRAYS.items():
+            np.frombuffer(payload, dtype='<f4', count=meta['count'] * width,
+                          offset=4 + header_len + meta['offsets'][name])
+
+
+def bench_killcam_payload(args) -> None:
+    """Compare the JSON and binary /kill_coords encodings."""
+    data = synthetic_kill(args.objects, args.samples)
+    encoded = trajectory.encode_kill_binary(data)
+    decoded = trajectory.decode_kill_binary(encoded)
+    err = max(np.abs(np.array(decoded[g]['coord']) - np.array(data[g]['coord'])).max()
+              for g in trajectory.TRACK_GROUPS)
+    print(f"Payload: {args.objects} objects x {args.samples:,} samples, "
+          f"max float32 coord error {err:.4f}m")
+
+    as_json = json.dumps(data).encode()
+    formats = {
+        'json': (lambda: json.dumps(data).encode(), lambda: json.loads(as_json),
+                 as_json),
+        'binary': (lambda: trajectory.encode_kill_binary(data),
+                   lambda: parse_binary_buffers(encoded), encoded),
+    }
+    for name, (encode, parse, payload) in formats.items():
+        encode_secs = min(timeit.repeat(encode, number=1, repeat=args.repeat))
+        parse_secs = min(timeit.repeat(parse, number=1, repeat=args.repeat))
+        print(f"{name:>8}: {len(payload) / 1e6:,.2f}MB "
+              f"({len(gzip.compress(payload)) / 1e6:,.2f}MB gzipped), "
+              f"encode {encode_secs * 1e3:,.1f}ms, parse {parse_secs * 1e3:,.1f}ms")
+
+
+def synthetic_overall(pilots: int) -> pd.DataFrame:
+    """A frame shaped like calculate_overall_stats output."""
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.integers(0, 500, (pilots, 30)),
+                        columns=[f"Stat {i}" for i in range(30)])
+    data['A/A Kill Ratio'] = data['Stat 0'] / (data['Stat 1'] + 1)
+    data['Hours'] = rng.uniform(0, 300, pilots).round(2)
+    data.insert(0, 'pilot', [f"pilot-{i}" for i in range(pilots)])
+    return data
+
+
+def synthetic_kill_rows(rows: int) -> List[Dict]:
+    """Rows shaped like the /tacview_kills query result."""
+    start = datetime.datetime(2020, 1, 1)
+    return [{'kill_timestamp': str(start + datetime.timedelta(minutes=i)),
+             'killer_name': f"pilot-{i % 300}", 'killer_type': 'F/A-18C',
+             'weapon_name': 'AIM-120C', 'weapon_type': 'Air-to-Air',
+             'target_name': f"pilot-{(i + 7) % 300}", 'target_type': 'Su-27',
+             'impact_dist': decimal.Decimal(f"{i % 500 / 100:.2f}"),
+             'kill_duration': 10.0 + i % 60, 'id': i}
+            for i in range(rows)]
+
+
+async def _collect(pending) -> bytes:
+    streaming = await pending
+    return b''.join([chunk async for chunk in streaming.body_iterator])
+
+
+class _RowCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def iterate(self, query):
+        for row in self.rows:
+            yield row
+
+
+def bench_responses(args) -> None:
+    """Compare jsonable_encoder + json with the orjson response path."""
+    from fastapi.encoders import jsonable_encoder
+
+    def legacy_render(content):
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False,
+                          allow_nan=False, separators=(',', ':')).encode()
+
+    overall = synthetic_overall(args.pilots)
+
+    def legacy_overall():
+        data = overall.to_dict('split')
+        data['columns'] = [{'title': c.title()} for c in data['columns']]
+        return legacy_render(data)
+
+    kills = synthetic_kill_rows(args.kills)
+    loop = asyncio.new_event_loop()
+    cases = {
+        '/overall': (legacy_overall,
+                     lambda: responses.frame_response(overall).body),
+        '/tacview_kills': (
+            lambda: legacy_render(read_stats.dict_to_js_datatable_friendly_fmt(kills)),
+            lambda: loop.run_until_complete(_collect(
+                responses.stream_query(_RowCursor(kills), '')))),
+    }
+    for name, (legacy, fast) in cases.items():
+        if json.loads(legacy()) != json.loads(fast()):
+            raise SystemExit(f"{name}: orjson output differs from jsonable_encoder")
+        legacy_secs = min(timeit.repeat(legacy, number=1, repeat=args.repeat))
+        fast_secs = min(timeit.repeat(fast, number=1, repeat=args.repeat))
+        print(f"{name:>14}: {legacy_secs * 1e3:,.1f}ms jsonable_encoder, "
+              f"{fast_secs * 1e3:,.1f}ms orjson")
+
+
+def synthetic_acmi(file_name: Path, objects: int, frames: int) -> None:
+    """Write a text acmi file of frames time steps updating objects objects."""
+    with file_name.open('w') as fp_:
+        fp_.write("FileType=text/acmi/tacview\nFileVersion=2.2\n"
+                  "0,ReferenceTime=2020-01-01T00:00:00Z\n")
+        for obj in range(objects):
+            fp_.write(f"{obj + 1:x},T=41.1|42.2|1000,Type=Air+FixedWing,"
+                      f"Name=F-16C_50,Pilot=pilot{obj},Coalition=Enemies\n")
+        for frame in range(frames):
+            fp_.write(f"#{frame * 0.2:.2f}\n")
+            fp_.writelines(
+                f"{obj + 1:x},T=41.{frame:05d}|42.{obj:05d}|{1000 + frame}|"
+                f"0.1|2.3|45.6|1234.5|5678.9|45.6\n"
+                for obj in range(objects))
+
+
+async def _drain(reader) -> int:
+    from tacview_client import client
+    await reader.open_connection()
+    lines = 0
+    try:
+        while True:
+            await reader.read_stream()
+            lines += 1
+    except client.EndOfFileException:
+        pass
+    return lines
+
+
+async def _socket_lines(file_name: Path, port: int) -> int:
+    from tacview_client import client, serve_file
+    # Listen before connecting, so the client's 3s retry is never timed.
+    server = await asyncio.start_server(
+        partial(serve_file.handle_req, filename=file_name), '127.0.0.1', port)
+    try:
+        reader = client.AsyncStreamReader('127.0.0.1', port)
+        lines = await _drain(reader)
+        reader.writer.close()
+        return lines
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def _file_lines(file_name: Path) -> int:
+    from horrible.tacview_reader import FileStreamReader
+    reader = FileStreamReader(file_name)
+    lines = await _drain(reader)
+    reader.close_file()
+    return lines
+
+
+def bench_tacview_ingest(args) -> None:
+    """Compare the loopback serve_file socket with the in-process file reader.
+
+    Only the line feed is timed; parsing and database writes downstream of
+    read_stream are the same for both.
+    """
+    tmp_dir = tempfile.TemporaryDirectory()
+    if args.file:
+        files = [Path(args.file)]
+    else:
+        plain = Path(tmp_dir.name).joinpath('synthetic.txt.acmi')
+        synthetic_acmi(plain, args.objects, args.frames)
+        gz_file = plain.with_name('synthetic.txt.acmi.gz')
+        with plain.open('rb') as src, gzip.open(gz_file, 'wb', 6) as dest:
+            dest.write(src.read())
+        zip_file = plain.with_name('synthetic.zip.acmi')
+        with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zfile:
+            zfile.write(plain, plain.name)
+        files = [plain, gz_file, zip_file]
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for file_name in files:
+        socket_lines = loop.run_until_complete(_socket_lines(file_name, args.port))
+        file_lines = loop.run_until_complete(_file_lines(file_name))
+        if socket_lines != file_lines:
+            raise SystemExit(f"{file_name.name}: socket read {socket_lines:,} "
+                             f"lines, file reader {file_lines:,}")
+        socket_secs = min(timeit.repeat(
+            lambda: loop.run_until_complete(_socket_lines(file_name, args.port)),
+            number=1, repeat=args.repeat))
+        file_secs = min(timeit.repeat(
+            lambda: loop.run_until_complete(_file_lines(file_name)),
+            number=1, repeat=args.repeat))
+        print(f"{file_name.name:>20}: {file_lines:,} lines, "
+              f"socket {file_lines / socket_secs:,.0f} lines/s, "
+              f"in-process {file_lines / file_secs:,.0f} lines/s "
+              f"({socket_secs / file_secs:.1f}x)")
+    tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timing repeats; the best is reported.')
+    subparsers = parser.add_subparsers(dest='bench')
+    subparsers.required = True
+
+    rec_keys = subparsers.add_parser(
+        'rec-keys', help='parse_rec_keys against the legacy regex cascade.')
+    rec_keys.add_argument('--keys-file',
+                          help='Newline-delimited stat keys. Defaults to '
+                               'reading all keys from mission_stats.')
+    rec_keys.add_argument('--dsn', default=DATABASE_URL)
+    rec_keys.set_defaults(func=bench_rec_keys)
+
+    stats = subparsers.add_parser(
+        'stats-pipeline',
+        help='Vectorized stats frame steps against their row-wise originals.')
+    stats.add_argument('--rows', type=int, default=1000000)
+    stats.add_argument('--legacy-rows', type=int, default=20000,
+                       help='Rows timed with the row-wise implementations.')
+    stats.set_defaults(func=bench_stats_pipeline)
+
+    events = subparsers.add_parser(
+        'events', help='Streaming event reader against the eval-based reader.')
+    events.add_argument('--file', required=True,
+                        help='A local (optionally gzipped) mission-events file.')
+    events.add_argument('--batch-size', type=int, default=5000)
+    events.set_defaults(func=bench_events)
+
+    killcam_payload = subparsers.add_parser(
+        'killcam-payload', help='Binary /kill_coords encoding against JSON.')
+    killcam_payload.add_argument('--objects', type=int, default=40)
+    killcam_payload.add_argument('--samples', type=int, default=2000,
+                                 help='Samples per object.')
+    killcam_payload.set_defaults(func=bench_killcam_payload)
+
+    resp = subparsers.add_parser(
+        'responses', help='orjson responses against jsonable_encoder.')
+    resp.add_argument('--pilots', type=int, default=2000,
+                      help='Rows in the synthetic /overall frame.')
+    resp.add_argument('--kills', type=int, default=50000,
+                      help='Rows in the synthetic /tacview_kills table.')
+    resp.set_defaults(func=bench_responses)
+
+    ingest = subparsers.add_parser(
+        'tacview-ingest',
+        help='In-process tacview file reader against the loopback socket.')
+    ingest.add_argument('--file',
+                        help='A local (optionally gzipped or zipped) acmi '
+                             'file. Defaults to synthetic plain, gz and zip '
+                             'files.')
+    ingest.add_argument('--objects', type=int, default=200)
+    ingest.add_argument('--frames', type=int, default=5000)
+    ingest.add_argument('--port', type=int, default=5555)
+    ingest.set_defaults(func=bench_tacview_ingest)
+
+    args = parser.parse_args()
+    args.func(args)
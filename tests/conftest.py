@@ -0,0 +1,32 @@
+import pytest
+
+
+class EmptyDB:
+    """A databases.Database with nothing ingested yet."""
+
+    async def fetch_val(self, query, values=None):
+        return None
+
+    async def fetch_one(self, query, values=None):
+        return None
+
+    async def fetch_all(self, query, values=None):
+        return []
+
+    async def iterate(self, query, values=None):
+        for row in []:
+            yield row
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A test client for main.app over an empty database."""
+    for module in ['google.cloud.storage', 'tacview_client', 'databases']:
+        pytest.importorskip(module)
+    testclient = pytest.importorskip('starlette.testclient')
+    import main
+    from horrible import killcam
+    monkeypatch.setattr(main, 'db', EmptyDB())
+    monkeypatch.setattr(killcam, 'RANDOM_KILLS', killcam.RandomKillPool())
+    # Not entered as a context manager, so startup does not connect.
+    return testclient.TestClient(main.app)
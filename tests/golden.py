@@ -0,0 +1,160 @@
+"""Reference implementations the optimized stats pipeline must match.
+
+These are the row-wise and regex based originals, kept for golden tests and
+for timing in scripts/benchmark.py.
+"""
+from pathlib import Path
+import re
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from horrible import read_stats
+
+
+def legacy_parse_rec_keys(field_key: str) -> Optional[Dict]:
+    """The regex cascade parse_rec_keys used before key classification was memoized."""
+    cats: Dict[str, Optional[str]]
+    matches = re.match(r"^(times)__(\w.*)__(kills)__(\w.*)__([A-z].*)$",
+                       field_key)
+    if matches:
+        # eg: times__JF-17__kills__Planes__total
+        # times/actions per airframe
+        cats = {
+            'category': matches.groups()[3],  # eg planes
+            'metric': matches.groups()[4],  # eg: total
+            'stat_group': matches.groups()[2],  # eg kills
+            'equipment': matches.groups()[1],  # eg F/A-18C
+        }
+        return cats
+
+    matches = re.match(r"^(times)__(\w.*)__(actions)__(\w.*)__([A-z].*)$",
+                       field_key)
+    if matches:
+        # eg: times__JF-17__actions__losses__pilotDeath
+        # times/actions per airframe
+        cats = {
+            'category': matches.groups()[4],  # eg losses
+            'metric': 'total',  # eg: eject
+            'stat_group': matches.groups()[3],  # eg actions
+            'equipment': matches.groups()[1],  # eg F/A-18C
+        }
+        return cats
+
+    matches = re.match(r"^(times)__(\w.*)__(losses)__(\w.*)__([A-z].*)$",
+                       field_key)
+    if matches:
+        # eg: times__JF-17__actions__losses__pilotDeath
+        # times/actions per airframe
+        cats = {
+            'category': matches.groups()[4],  # eg losses
+            'metric': 'total',  # eg: eject
+            'stat_group': matches.groups()[2],  # eg actions
+            'equipment': matches.groups()[1],  # eg F/A-18C
+        }
+        return cats
+
+    matches = re.match(r"^(weapons)__(\w.*)__([A-z].*)$", field_key)
+    if matches:
+        # eg: weapons__Mk-20 Rockeye__kills
+        # weapons
+        cats = {
+            'category': None,
+            'metric': matches.groups()[2],  # eg: shot, numHits
+            'stat_group': matches.groups()[0],  # eg: weapons
+            'equipment': matches.groups()[1],  #eg: AIM-120C
+        }
+        if cats['metric'] == 'gun' or cats['metric'] == 'hit':
+            # These are always wrong.
+            return None
+        return cats
+
+    matches = re.match(r"^(losses)__(\w.*)__([A-z].*)$", field_key)
+    if matches:
+        # losses
+        cats = {
+            'category': matches.groups()[1],
+            'metric': matches.groups()[2],  # eg: shot, numHits
+            'stat_group': matches.groups()[0],  # eg: weapons
+            'equipment': "N/A",  #eg: AIM-120C
+        }
+        return cats
+
+    matches = re.match(r"^(kills)__(\w.*)__([A-z].*)$", field_key)
+    if matches:
+        # losses
+        cats = {
+            'category': matches.groups()[1],
+            'metric': matches.groups()[2],  # eg: shot, numHits
+            'stat_group': matches.groups()[0],  # eg: weapons
+            'equipment': "N/A",  #eg: AIM-120C
+        }
+        return cats
+
+    matches = re.match(r"^(times)__(\w.*)__([A-z].*)$", field_key)
+    if matches:
+        #eg: times__AV8BNA__total
+        # times air/total
+        cats = {
+            'category': matches.groups()[0],
+            'metric': matches.groups()[2],  # eg: shot, total/inair
+            'stat_group': 'usage',
+            'equipment': matches.groups()[1],  #eg: AIM-120C
+        }
+        return cats
+
+    matches = re.match(r"^(PvP)__(\w.*)$", field_key)
+    if matches:
+        # old format losses only
+        cats = {
+            'category': matches.groups()[0],  #
+            'metric': matches.groups()[1],  # eg: shot, numHits
+            'stat_group': matches.groups()[0],  # eg: weapons
+            'equipment': 'N/A',
+        }
+        return cats
+
+    matches = re.match(r"^([A-z]*)__(\w.*)$", field_key)
+    if matches:
+        # old format losses only
+        cats = {
+            'category': matches.groups()[1],  # eg: pilotdeath
+            'metric': "total",
+            'stat_group': matches.groups()[0],  # eg: losses
+            'equipment': 'N/A',
+        }
+
+        return cats
+
+    if field_key in ['lastJoin', 'friendlyHits', 'friendlyKills']:
+        return None
+
+    raise ValueError(f"Could not parse: {field_key}")
+
+
+def legacy_zero_gun_kills(data: pd.DataFrame) -> None:
+    """zero_gun_kills as a row-wise apply."""
+    data['value'] = data.apply(
+        lambda x: 0
+        if x['category'] == 'Gun' and x['metric'] == 'kills' else x['value'],
+        axis=1)
+
+
+def legacy_concat_cols(df: pd.DataFrame, cols: List[str], sep: str) -> pd.Series:
+    """concat_cols as a row-wise apply."""
+    return df[cols].apply(lambda x: sep.join(x.map(str)), axis=1)
+
+
+def legacy_read_event_table(file_name: Path) -> Optional[List]:
+    """read_event_table as written before the streaming tokenizer."""
+    results = []
+    fp_ = read_stats.get_filehandle_maybe_gzip(file_name)
+    for line in fp_.readlines():
+        line = line.decode('utf-8')
+        if line.strip() == 'slmod.events = {}':
+            continue
+        line = re.sub("slmod.events\\[[0-9]{1,}\\] = ", "", line)
+        rec = eval(line.replace('[', "").replace('] =', ':'))
+        results.append({'file_name': str(file_name), 'record': rec})
+    fp_.close()
+    return results
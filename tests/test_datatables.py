@@ -0,0 +1,63 @@
+import pytest
+from starlette.exceptions import HTTPException
+
+from horrible import datatables
+
+
+def test_no_draw_is_not_server_side():
+    assert datatables.parse_datatable_params({'start': '0'}) is None
+
+
+def test_parse_params():
+    params = datatables.parse_datatable_params({
+        'draw': '3', 'start': '50', 'length': '-1', 'order[0][column]': '2',
+        'order[0][dir]': 'DESC', 'search[value]': ' viper '})
+    assert params == datatables.DataTableParams(
+        draw=3, start=50, length=datatables.MAX_PAGE_LENGTH,
+        order=[(2, 'desc')], search='viper')
+
+
+@pytest.mark.parametrize('query', [
+    {'draw': 'x'}, {'draw': '1', 'start': '1.5'}, {'draw': '1', 'length': ''},
+    {'draw': '1', 'order[0][column]': 'name'}, {'draw': '-1'},
+    {'draw': '1', 'start': '-10'},
+])
+def test_malformed_params_are_rejected(query):
+    with pytest.raises(HTTPException) as err:
+        datatables.parse_datatable_params(query)
+    assert err.value.status_code == 400
+
+
+def test_malformed_params_return_400(client):
+    resp = client.get('/tacview_kills', params={'draw': 'x'})
+    assert resp.status_code == 400
+
+
+class RecordingDB:
+    """Records the queries a server-side DataTables request runs."""
+
+    def __init__(self):
+        self.queries = []
+
+    async def fetch_val(self, query, values=None):
+        self.queries.append(query)
+        return 0
+
+    async def fetch_all(self, query, values=None):
+        self.queries.append(query)
+        return []
+
+
+def test_events_paged_in_sql(client, monkeypatch):
+    import main
+    db = RecordingDB()
+    monkeypatch.setattr(main, 'db', db)
+    resp = client.get('/events', params={'draw': 2, 'start': 20, 'length': 10,
+                                         'order[0][column]': 0,
+                                         'order[0][dir]': 'desc'})
+    assert resp.status_code == 200
+    assert resp.json()['draw'] == 2
+    page = db.queries[-1]
+    assert 'mission_events' in page
+    assert 'ORDER BY event_timestamp desc' in page
+    assert 'LIMIT :length OFFSET :start' in page
@@ -0,0 +1,64 @@
+import gzip
+
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+pytest.importorskip('tacview_client')
+lupa = pytest.importorskip('lupa')
+
+from horrible import read_stats  # noqa: E402
+from tests.golden import legacy_read_event_table  # noqa: E402
+
+EVENTS = [
+    '{["type"] = "kill", ["t"] = 1.5, ["initiator"] = "F-16C_50", '
+    '["weapon"] = "AIM-120C", ["numtimes"] = 2, }',
+    '{["type"] = "hit", ["t"] = 12, ["initiatorPilotName"] = "Viper \\"Mad\\" Dog\\\\", '
+    '["note"] = "tab\\tnew\\nline", ["pos"] = {["x"] = -2.5e3, ["y"] = .5, '
+    '["z"] = {[1] = 1, [2] = {["deep"] = 3, }, }, }, }',
+    '{["type"] = "takeoff", ["t"] = 0, ["empty"] = {}, }',
+]
+# Lua the eval reader could not read: brackets inside strings, which it
+# stripped, positional fields and booleans.
+LUA_ONLY = [
+    '{["type"] = "kill", ["initiatorPilotName"] = "[JTF] Viper", '
+    '["list"] = {"a", "b", }, }',
+    '{["type"] = "takeoff", ["alive"] = false, ["pos"] = {["up"] = true}}',
+]
+
+
+def from_lua(value):
+    if lupa.lua_type(value) == 'table':
+        return {k: from_lua(v) for k, v in value.items()}
+    return value
+
+
+def lua_eval(table: str):
+    return from_lua(lupa.LuaRuntime().eval(table))
+
+
+@pytest.mark.parametrize('table', EVENTS + LUA_ONLY)
+def test_parse_lua_table_matches_lua(table):
+    assert read_stats.parse_lua_table(table) == lua_eval(table)
+
+
+@pytest.mark.parametrize('table', ['{["a"] = 1', '}', '1',
+                                   '{["a"] = bogus}'])
+def test_parse_lua_table_rejects_malformed(table):
+    with pytest.raises(ValueError):
+        read_stats.parse_lua_table(table)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_iter_event_records_matches_eval_reader(tmp_path, compress):
+    text = '\n'.join(['slmod.events = {}'] + [
+        f'slmod.events[{i}] = {event}' for i, event in enumerate(EVENTS, 1)])
+    path = tmp_path / 'events.lua'
+    data = (text + '\n').encode()
+    path.write_bytes(gzip.compress(data) if compress else data)
+
+    records = list(read_stats.iter_event_records(path))
+    assert records == legacy_read_event_table(path)
+    assert [rec['record'] for rec in records] == [lua_eval(e) for e in EVENTS]
+    batches = list(read_stats.read_event_batches(path, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert sum(batches, []) == records
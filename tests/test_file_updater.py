@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+for module in ['google.cloud.storage', 'tacview_client', 'databases',
+               'asyncpg', 'uvloop']:
+    pytest.importorskip(module)
+
+import file_updater  # noqa: E402
+
+FILE_NAME = 'tacview/Tacview-20200117-201445.zip.acmi'
+
+
+class ClaimConnection:
+    """An asyncpg connection holding one claimable tacview file."""
+
+    def __init__(self, beat_error=None):
+        self.beat_error = beat_error
+        self.updates = []
+
+    async def fetchrow(self, query, *args):
+        return {'file_name': FILE_NAME, 'session_start_time': None,
+                'reclaimed': False}
+
+    async def fetchval(self, query, *args):
+        return 0
+
+    async def execute(self, query, *args):
+        if self.beat_error and query is file_updater.METRICS_UPDATE:
+            raise self.beat_error
+        if 'processed' in query:
+            self.updates.append(' '.join(query.split()))
+
+    async def close(self):
+        pass
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    """Patch proc_tac's download and reader, returning the reader's calls."""
+    calls = []
+
+    class Cache:
+        def fetch(self, *args):
+            pass
+
+    async def consume_file(*args, **kwargs):
+        calls.append('start')
+        await asyncio.sleep(0.2)
+        calls.append('done')
+
+    monkeypatch.setattr(file_updater.gcs, 'get_blob_cache', Cache)
+    monkeypatch.setattr(file_updater, 'consume_file', consume_file)
+    return calls
+
+
+def connect_to(monkeypatch, main, beat):
+    cons = iter([main, beat])
+
+    async def connect(*args, **kwargs):
+        return next(cons)
+
+    monkeypatch.setattr(file_updater.asyncpg, 'connect', connect)
+
+
+def test_refresh_failure_keeps_ingest_processed(monkeypatch, ingest):
+    con = ClaimConnection()
+    connect_to(monkeypatch, con, ClaimConnection())
+
+    async def refresh_kills(session_start_time):
+        raise RuntimeError('refresh failed')
+
+    monkeypatch.setattr(file_updater, 'refresh_kills', refresh_kills)
+    assert run(file_updater.proc_tac('w1')) == 0
+    assert ingest == ['start', 'done']
+    assert len(con.updates) == 1
+    assert 'processed = TRUE' in con.updates[0]
+
+
+def test_dead_heartbeat_stops_ingest(monkeypatch, ingest):
+    con = ClaimConnection()
+    connect_to(monkeypatch, con, ClaimConnection(OSError('connection lost')))
+    assert run(file_updater.proc_tac('w1')) == 0
+    assert 'done' not in ingest
+    assert len(con.updates) == 1
+    assert 'processed = FALSE' in con.updates[0]
+    assert 'worker_id = $2' in con.updates[0]
@@ -0,0 +1,66 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from horrible import frametime
+
+
+@pytest.fixture
+def frame_log(tmp_path):
+    """About four minutes of frame stamps, including repeated stamps."""
+    rng = np.random.RandomState(7)
+    deltas = rng.gamma(2.0, 0.008, 20000)
+    deltas[rng.choice(deltas.size, 50, replace=False)] = 0.0
+    times = 1579292085.0 + np.cumsum(deltas)
+    text = '\n'.join(f"{t:.6f}" for t in times) + '\n'
+    path = tmp_path / 'fps_tracklog1579292085.5.log'
+    path.write_text(text)
+    return path
+
+
+def expected_rollups(path) -> pd.DataFrame:
+    times = np.loadtxt(path)
+    deltas = np.diff(times)
+    valid = deltas > 0
+    secs, fps = times[1:][valid], 1.0 / deltas[valid]
+    frames = []
+    for res in frametime.RESOLUTIONS:
+        grouped = pd.Series(fps).groupby(np.floor(secs / res) * res)
+        quantiles = grouped.quantile([0.01, 0.5, 0.99]).unstack()
+        frames.append(pd.DataFrame({
+            'resolution': res,
+            'frame_ts': pd.to_datetime(quantiles.index, unit='s'),
+            'ts_fps': grouped.size().values / res,
+            'fps_p1': quantiles[0.01].values,
+            'fps_p50': quantiles[0.5].values,
+            'fps_p99': quantiles[0.99].values,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def rollups(path, chunk_bytes) -> pd.DataFrame:
+    rows = [row for batch in frametime.frametime_batches(path, chunk_bytes)
+            for row in batch]
+    df = pd.DataFrame(rows).drop(columns='file_name')
+    df['frame_ts'] = pd.to_datetime(df['frame_ts'])
+    return df.sort_values(['resolution', 'frame_ts']).reset_index(drop=True)
+
+
+# Chunks far smaller than a second of frames, one not aligned to a line, and
+# the whole file at once.
+@pytest.mark.parametrize('chunk_bytes', [997, 64 * 1024, 8 * 1024**2])
+def test_rollups_match_pandas_quantiles(frame_log, chunk_bytes):
+    got = rollups(frame_log, chunk_bytes)
+    expected = expected_rollups(frame_log)
+    assert not got.duplicated(['resolution', 'frame_ts']).any()
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False,
+                                  check_exact=False, rtol=1e-9)
+
+
+def test_rollups_from_gzip(frame_log, tmp_path):
+    gz_path = tmp_path / 'fps_tracklog1579292085.5.log.gz'
+    gz_path.write_bytes(gzip.compress(frame_log.read_bytes()))
+    pd.testing.assert_frame_equal(rollups(gz_path, 4096),
+                                  rollups(frame_log, 4096))
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+
+from horrible.gcs import BlobCache, LocalStorage  # noqa: E402
+
+
+@pytest.fixture
+def blobs(tmp_path):
+    root = tmp_path / 'bucket'
+    (root / 'tacview').mkdir(parents=True)
+    for name in ['a', 'b']:
+        (root / 'tacview' / name).write_bytes(name.encode() * 100)
+    return LocalStorage(root)
+
+
+def test_fetch_copies_so_eviction_frees_space(blobs, tmp_path):
+    cache = BlobCache(blobs, cache_dir=tmp_path / 'cache', max_bytes=150)
+    dest = cache.fetch('tacview/a', tmp_path / 'out' / 'a')
+    assert dest.read_bytes() == b'a' * 100
+    assert dest.stat().st_nlink == 1
+
+    cache.fetch('tacview/b', tmp_path / 'out' / 'b')
+    assert [p.stat().st_size for p in cache.cache_dir.iterdir()] == [100]
+    assert dest.read_bytes() == b'a' * 100
+
+
+def test_fetch_treats_evicted_entry_as_miss(blobs, tmp_path):
+    cache = BlobCache(blobs, cache_dir=tmp_path / 'cache')
+    cache.fetch('tacview/a', tmp_path / 'out' / 'a')
+    cache.fetch('tacview/a', tmp_path / 'out' / 'a')
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    for path in cache.cache_dir.iterdir():
+        path.unlink()
+    dest = cache.fetch('tacview/a', tmp_path / 'out' / 'a')
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert dest.read_bytes() == b'a' * 100
@@ -0,0 +1,159 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+pytest.importorskip('tacview_client')
+
+from horrible import killcam, trajectory  # noqa: E402
+from horrible.database import metadata  # noqa: E402
+
+# Output columns of the impacts_valid view the kill table is filled from.
+IMPACTS_VALID_COLUMNS = {
+    'kill_timestamp', 'start_time', 'killer_name', 'killer_type', 'killer_id',
+    'target_name', 'target_type', 'target_id', 'weapon_name', 'weapon_type',
+    'weapon_id', 'impact_id', 'weapon_first_time', 'weapon_last_time',
+    'session_id', 'impact_dist', 'kill_duration', 'weapon_color',
+    'target_color', 'killer_color', 'first_seen', 'last_seen',
+}
+
+
+def test_kill_tables_created_with_others():
+    kills = metadata.tables[killcam.KILL_TABLE]
+    assert {c.name for c in kills.columns} == IMPACTS_VALID_COLUMNS
+    assert killcam.REPLAY_TABLE in metadata.tables
+
+
+def test_kill_endpoints_empty_before_ingest(client):
+    resp = client.get('/tacview_kills')
+    assert resp.status_code == 200
+    assert resp.json()['data'] == []
+
+    resp = client.get('/tacview_kills', params={'draw': 1, 'start': 0,
+                                                'length': 10})
+    assert resp.status_code == 200
+    assert resp.json()['data'] == []
+
+    assert client.get('/kill_coords', params={'kill_id': -1}).status_code == 404
+    assert client.get('/kill_coords', params={'kill_id': 7}).status_code == 404
+
+
+@pytest.mark.parametrize('params', [
+    {'rate': -1}, {'rate': 0}, {'rate': 1e9}, {'tolerance': -1},
+    {'max_points': 0}, {'max_points': -5}, {'radius': -1},
+])
+def test_kill_coords_rejects_out_of_range_params(client, params):
+    resp = client.get('/kill_coords', params=dict(params, kill_id=7))
+    assert resp.status_code == 422
+
+
+@pytest.fixture
+def stored_kill(monkeypatch):
+    kill = {'min_ts': None, 'max_ts': None, 'impact_id': 7,
+            'impact_dist': '3.2m', 'radius': 1000.0, 'killer': None,
+            'target': None, 'weapon': None, 'other': []}
+
+    async def get_kill_replay(kill_id, db):
+        return gzip.compress(json.dumps(kill).encode())
+
+    monkeypatch.setattr(killcam, 'get_kill_replay', get_kill_replay)
+    return kill
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'identity'])
+def test_kill_coords_varies_on_encoding(client, stored_kill, encoding):
+    resp = client.get('/kill_coords', params={'kill_id': 7},
+                      headers={'Accept-Encoding': encoding})
+    assert resp.status_code == 200
+    assert resp.json() == stored_kill
+    vary = {v.strip() for v in resp.headers['vary'].split(',')}
+    assert vary == {'Accept', 'Accept-Encoding'}
+
+
+def test_kill_coords_json_varies_on_accept(client, stored_kill):
+    resp = client.get('/kill_coords', params={'kill_id': 7, 'radius': 10})
+    assert resp.status_code == 200
+    assert resp.json()['impact_id'] == 7
+    assert resp.headers['vary'] == 'Accept'
+
+
+class KillTableDB:
+    """A kill table with kills, the pool having been loaded before some went."""
+
+    def __init__(self, impact_ids):
+        self.impact_ids = set(impact_ids)
+
+    async def fetch_val(self, query, values=None):
+        return max(self.impact_ids, default=None)
+
+    async def fetch_all(self, query, values=None):
+        return [{'impact_id': i} for i in sorted(self.impact_ids)]
+
+    async def fetch_one(self, query, values=None):
+        if values['impact_id'] in self.impact_ids:
+            return {'impact_id': values['impact_id']}
+        return None
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def stale_pool(monkeypatch):
+    pool = killcam.RandomKillPool()
+    pool.kill_ids, pool.watermark = [123], 456
+    monkeypatch.setattr(killcam, 'RANDOM_KILLS', pool)
+    return KillTableDB([456])
+
+
+def test_lookup_deleted_explicit_kill_is_not_found(stale_pool):
+    assert run(killcam.lookup_kill(123, stale_pool)) is None
+
+
+def test_lookup_random_kill_skips_deleted_pick(stale_pool):
+    assert run(killcam.lookup_kill(-1, stale_pool)) == {'impact_id': 456}
+
+
+def test_get_kill_unknown_id_is_none(stale_pool):
+    assert run(killcam.get_kill(999, stale_pool)) is None
+
+
+def test_kill_coords_wider_radius_for_deleted_kill(client, stored_kill):
+    resp = client.get('/kill_coords', params={'kill_id': 7, 'radius': 5000})
+    assert resp.status_code == 404
+
+
+def test_build_kill_replays_bounds_concurrency(monkeypatch):
+    running, peak, stored = [0], [0], []
+
+    async def build_kill(resp, db):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        if resp['impact_id'] == 3:
+            raise KeyError('killer')
+        return {}
+
+    async def store_replay(db, resp, data):
+        stored.append(resp['impact_id'])
+
+    monkeypatch.setattr(killcam, 'build_kill', build_kill)
+    monkeypatch.setattr(killcam, 'store_replay', store_replay)
+    db = KillTableDB(range(10))
+    assert run(killcam.build_kill_replays(db)) == 9
+    assert peak[0] == killcam.REPLAY_CONCURRENCY
+    assert sorted(stored) == [i for i in range(10) if i != 3]
+
+
+def test_kill_coords_binary(client, stored_kill):
+    resp = client.get('/kill_coords', params={'kill_id': 7},
+                      headers={'Accept': trajectory.BINARY_MEDIA_TYPE})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'] == trajectory.BINARY_MEDIA_TYPE
+    assert resp.headers['vary'] == 'Accept'
+    decoded = trajectory.decode_kill_binary(resp.content)
+    assert decoded == stored_kill
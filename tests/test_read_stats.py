@@ -0,0 +1,190 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+pytest.importorskip('tacview_client')
+
+from horrible import read_stats  # noqa: E402
+
+FILE_NAME = 'mission-stats/Operation Snowfox v122- Jan 17, 2020 at 20 14 45.lua'
+
+
+class FileTableDB:
+    """Just enough of a databases.Database for a mission_stat_files sync."""
+
+    is_connected = True
+
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self.rows = {}
+        self.queries = []
+
+    async def fetch_val(self, query, values=None):
+        return self.watermark
+
+    async def execute(self, query, values=None):
+        self.queries.append(str(query))
+        if isinstance(query, str) and query.lstrip().startswith(
+                'UPDATE mission_stat_files'):
+            self.rows[values['file_name']].update(processed=False,
+                                                  process_start=None)
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_resync_file_older_than_watermark(monkeypatch):
+    updated = datetime(2020, 1, 17, 20, 14, 45)
+    db = FileTableDB(watermark=updated + timedelta(days=30))
+    db.rows[FILE_NAME] = {'file_name': FILE_NAME, 'processed': True,
+                          'process_start': updated}
+
+    async def upsert_file_rows(table, rows, db):
+        for row in rows:
+            db.rows.setdefault(row['file_name'], row)
+        return len(rows)
+
+    blob = SimpleNamespace(name=FILE_NAME, updated=updated, size=1000)
+    bucket = SimpleNamespace(
+        client=SimpleNamespace(list_blobs=lambda *args, **kwargs: [blob]))
+    monkeypatch.setattr(read_stats, 'get_gcs_bucket', lambda: bucket)
+    monkeypatch.setattr(read_stats, 'upsert_file_rows', upsert_file_rows)
+
+    run(read_stats.resync_stat_file(db, FILE_NAME))
+    run(read_stats.sync_gs_files_with_db('mission-stats',
+                                         read_stats.stat_files, db))
+
+    assert not any(q.lstrip().startswith('DELETE') for q in db.queries)
+    assert FILE_NAME in db.rows
+    assert db.rows[FILE_NAME]['processed'] is False
+
+
+class BackfillDB:
+    """Processed mission_stat_files rows with records but no facts."""
+
+    def __init__(self, records):
+        self.records = records
+        self.backfilled = set()
+        self.facts = []
+
+    async def fetch_all(self, query, values=None):
+        if values:
+            return [{'file_name': values['file_name'], 'pilot': pilot,
+                     'record': record}
+                    for pilot, record in self.records[values['file_name']]]
+        return [{'file_name': name, 'session_start_time': None}
+                for name in self.records if name not in self.backfilled]
+
+    def connection(self):
+        return BackfillConnection(self)
+
+
+class BackfillConnection:
+
+    def __init__(self, db):
+        self.db = db
+        self.raw_connection = self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def transaction(self):
+        return self
+
+    async def execute(self, query, file_name):
+        if query.lstrip().startswith('UPDATE mission_stat_files'):
+            self.db.backfilled.add(file_name)
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.db.facts.extend(records)
+
+
+def test_backfill_marks_files_without_facts(monkeypatch):
+    db = BackfillDB({FILE_NAME: [('pilot', '{"crash": 1}')]})
+    fetches = []
+    fetch_all = db.fetch_all
+
+    async def counting_fetch_all(query, values=None):
+        fetches.append(values)
+        return await fetch_all(query, values)
+
+    monkeypatch.setattr(db, 'fetch_all', counting_fetch_all)
+
+    run(read_stats.backfill_stat_facts(db))
+    assert db.facts == []
+    assert db.backfilled == {FILE_NAME}
+
+    fetches.clear()
+    run(read_stats.backfill_stat_facts(db))
+    assert fetches == [None]
+
+
+def test_backfill_moves_stat_cache_watermark(monkeypatch):
+    db = BackfillDB({FILE_NAME: [('pilot', '{"crash": 1}')]})
+    watermark = {'last_processed': datetime(2020, 1, 17), 'processed': 1}
+
+    async def fetch_one(query):
+        assert 'facts_backfilled' in query
+        return dict(watermark, facts_backfilled=len(db.backfilled))
+
+    db.fetch_one = fetch_one
+    calls = []
+
+    @read_stats.STAT_CACHE.cached
+    async def cached_stats(db):
+        calls.append(1)
+        return pd.DataFrame()
+
+    monkeypatch.setattr(read_stats.STAT_CACHE, 'watermark', None)
+    run(cached_stats(db))
+    run(cached_stats(db))
+    assert len(calls) == 1
+
+    run(read_stats.backfill_stat_facts(db))
+    run(cached_stats(db))
+    assert len(calls) == 2
+
+
+class FrametimeDB:
+    """A frametime file spanning secs seconds, recording its tier queries."""
+
+    def __init__(self, secs):
+        self.secs = secs
+        self.queries = []
+
+    async def fetch_one(self, query, values=None):
+        return {'secs': self.secs}
+
+    async def fetch_all(self, query, values=None):
+        self.queries.append((query, values))
+        return [{'frame_ts': datetime(2020, 1, 17, 20, 14, 45), 'ts_fps': 60.0,
+                 'fps_p1': 40.0, 'fps_p50': 60.0, 'fps_p99': 70.0}]
+
+
+@pytest.mark.parametrize('secs, points, resolution, table', [
+    (None, 500, 1, 'frametimes'),
+    (400, 500, 1, 'frametimes'),
+    (500, 500, 1, 'frametimes'),
+    (501, 500, 10, 'frametime_rollups'),
+    (5000, 500, 10, 'frametime_rollups'),
+    (30000, 500, 60, 'frametime_rollups'),
+    (10**6, 500, 60, 'frametime_rollups'),
+    (4000, 5000, 1, 'frametimes'),
+])
+def test_read_frametime_picks_tier(secs, points, resolution, table):
+    db = FrametimeDB(secs)
+    out = run(read_stats.read_frametime(db, 'frametime/x.log', points))
+    assert out['resolution'] == resolution
+    query, values = db.queries[0]
+    assert f"FROM {table}" in query
+    assert values.get('resolution', 1) == resolution
+    assert out['labels'] == ['2020-01-17 20:14:45']
+    assert out['p99'] == [70.0]
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+pytest.importorskip('tacview_client')
+
+from horrible import read_stats  # noqa: E402
+from tests.golden import legacy_parse_rec_keys  # noqa: E402
+
+HEADS = ['times', 'weapons', 'losses', 'kills', 'PvP', 'friendlyHits',
+         'lastJoin', 'actions', 'x', '']
+TOKENS = ['JF-17', 'F/A-18C', 'Mk-20 Rockeye', 'kills', 'actions', 'losses',
+          'Planes', 'total', 'inAir', 'pilotDeath', 'gun', 'hit', 'numHits',
+          'Ground Units', 'Arty/MLRS', 'A', '_', '-', '1', '9x', ' ', '[', '^']
+SEPS = ['__', '__', '__', '_', '___', '']
+
+
+def classify(func, key):
+    try:
+        return func(key)
+    except ValueError as err:
+        return str(err)
+
+
+def fuzz_keys(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        parts = [rng.choice(HEADS)] + [rng.choice(TOKENS)
+                                       for _ in range(rng.randint(0, 4))]
+        yield ''.join(part + rng.choice(SEPS) for part in parts).rstrip(
+            rng.choice(['', '_']))
+
+
+@pytest.mark.parametrize('key', [
+    'times__JF-17__kills__Planes__total',
+    'times__F-16C_50__actions__losses__pilotDeath',
+    'times__F-16C_50__losses__crash__total',
+    'times__AV8BNA__total', 'times__AV8BNA__inAir',
+    'weapons__Mk-20 Rockeye__kills', 'weapons__GAU-8__gun',
+    'weapons__AIM-9X__hit', 'losses__pilotDeath', 'losses__eject__total',
+    'kills__Ground Units__Arty/MLRS', 'PvP__kills', 'PvP__', 'lastJoin',
+    'friendlyHits', 'friendlyKills', '__total', 'times____x', 'a__b__c',
+    'times__x__kills__y__1', 'times__x__kills__y___z', 'weapons__x___kills',
+])
+def test_classifier_matches_regex_cascade(key):
+    assert (classify(read_stats.parse_rec_keys, key)
+            == classify(legacy_parse_rec_keys, key))
+
+
+def test_classifier_matches_regex_cascade_fuzzed():
+    read_stats._classify_rec_key.cache_clear()
+    mismatched = [key for key in set(fuzz_keys(12000))
+                  if classify(read_stats.parse_rec_keys, key)
+                  != classify(legacy_parse_rec_keys, key)]
+    assert mismatched == []
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('orjson')
+
+from horrible import responses  # noqa: E402
+
+
+class RowsDB:
+    """Iterates rows, optionally failing after fail_after of them."""
+
+    def __init__(self, rows, fail_after=None):
+        self.rows = rows
+        self.fail_after = fail_after
+
+    async def iterate(self, query):
+        for i, row in enumerate(self.rows):
+            if i == self.fail_after:
+                raise RuntimeError('connection lost')
+            yield row
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+async def collect(db) -> bytes:
+    response = await responses.stream_query(db, 'SELECT 1')
+    return b''.join([chunk async for chunk in response.body_iterator])
+
+
+@pytest.mark.parametrize('count', [0, 1, responses.STREAM_CHUNK_ROWS + 3])
+def test_stream_query_output(count):
+    rows = [{'id': i, 'name': f"row {i}"} for i in range(count)]
+    out = responses.orjson.loads(run(collect(RowsDB(rows))))
+    assert out['data'] == [[i, f"row {i}"] for i in range(count)]
+    assert out['index'] == list(range(count))
+    assert out['columns'] == ([{'title': 'Id'}, {'title': 'Name'}]
+                              if count else [])
+
+
+def test_stream_query_fails_before_responding():
+    with pytest.raises(RuntimeError):
+        run(responses.stream_query(RowsDB([{'id': 1}], fail_after=0),
+                                   'SELECT 1'))
+
+
+def test_stat_logs_query_error_is_handled(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'db', RowsDB([{'id': 1}], fail_after=0))
+    resp = client.get('/stat_logs')
+    assert resp.status_code == 200
+    assert resp.json() == {}
@@ -0,0 +1,87 @@
+import gzip
+import os
+
+import pytest
+
+from horrible import static_assets
+from horrible.static_assets import REVALIDATE
+
+
+@pytest.mark.parametrize('path', [
+    '/static/mesh?obj_name=FixedWing.F-18C.obj',
+    '/static/mesh?obj_name=FixedWing.Not-Yet-Modelled.obj',
+    '/static/mesh?obj_name=Weapon+Missile.Not-Yet-Modelled.obj',
+    '/static/images/full_brand.png',
+    '/static/textures/waternormals.jpg',
+])
+def test_unversioned_urls_revalidate(client, path):
+    resp = client.get(path)
+    assert resp.status_code == 200
+    assert resp.headers['cache-control'] == REVALIDATE
+    etag = resp.headers['etag']
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', {'gzip', 'deflate', 'br'}),
+    ('br;q=0, gzip;q=0.5', {'gzip'}),
+    ('gzip; q=0.0, br', {'br'}),
+    ('*', {'*', 'br', 'gzip'}),
+    ('*;q=0.1, br;q=0', {'*', 'gzip'}),
+    ('identity;q=bogus', set()),
+    ('', set()),
+])
+def test_accepted_encodings(header, expected):
+    assert static_assets.accepted_encodings(header) == expected
+
+
+@pytest.fixture
+def store(tmp_path):
+    root = tmp_path / 'static'
+    root.mkdir()
+    (root / 'app.js').write_text('console.log("v1");\n' * 100)
+    return static_assets.AssetStore(root, cache_dir=tmp_path / 'cache')
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {k.replace('_', '-'): v for k, v in headers.items()}
+
+
+def test_q0_encoding_not_served(store):
+    resp = store.serve(FakeRequest(accept_encoding='gzip;q=0'), 'app.js')
+    assert 'content-encoding' not in resp.headers
+    resp = store.serve(FakeRequest(accept_encoding='gzip'), 'app.js')
+    assert resp.headers['content-encoding'] == 'gzip'
+
+
+def test_changed_asset_is_reindexed(store):
+    first = store.get('app.js')
+    assert store.get('app.js') is first
+
+    path = store.root / 'app.js'
+    path.write_text('console.log("v2");\n' * 200)
+    second = store.get('app.js')
+    assert second.etag != first.etag
+    assert (gzip.decompress(second.variants['gzip'].read_bytes())
+            == path.read_bytes())
+
+    # Same size, new content: the mtime alone gives it away.
+    stat = path.stat()
+    path.write_text('console.log("v3");\n' * 200)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert store.get('app.js').etag not in (first.etag, second.etag)
+
+
+def test_brotli_quality_is_explicit(store, monkeypatch):
+    calls = []
+
+    class Brotli:
+        @staticmethod
+        def compress(data, **kwargs):
+            calls.append(kwargs)
+            return gzip.compress(data)
+
+    monkeypatch.setattr(static_assets, 'brotli', Brotli)
+    assert 'br' in store.get('app.js').variants
+    assert calls == [{'quality': static_assets.BROTLI_QUALITY}]
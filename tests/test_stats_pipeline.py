@@ -0,0 +1,121 @@
+"""Golden checks of the optimized stats pipeline against its originals."""
+import asyncio
+import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+pytest.importorskip('tacview_client')
+pytest.importorskip('lupa')
+
+from horrible import read_stats  # noqa: E402
+from tests.golden import (legacy_concat_cols, legacy_parse_rec_keys,  # noqa: E402
+                          legacy_zero_gun_kills)
+
+DATA = Path(__file__).parent / 'data'
+FACT_COLS = ['pilot', 'session_start_date', 'stat_group', 'category',
+             'metric', 'equipment']
+WEAPONS = [{'name': 'AIM-120C', 'category': 'Air-to-Air', 'type': 'Missile'},
+           {'name': 'GBU-12', 'category': 'Bomb', 'type': 'Guided'}]
+
+
+def safe_call(func, key):
+    try:
+        return func(key)
+    except ValueError as err:
+        return str(err)
+
+
+@pytest.fixture(scope='module')
+def stat_records():
+    return read_stats.read_lua_table(DATA / 'test.lua')
+
+
+@pytest.fixture(scope='module')
+def stat_facts(stat_records):
+    """Facts from tests/data, plus synthetic ones covering every stat column."""
+    facts = pd.DataFrame(read_stats.stat_records_to_facts(
+        stat_records, datetime.datetime(2020, 1, 17)))
+    rng = np.random.RandomState(42)
+    rows = 2000
+    synthetic = pd.DataFrame({
+        'pilot': rng.choice([f"pilot_{i}" for i in range(20)], rows),
+        'session_start_date': rng.choice(
+            [datetime.date(2020, 1, d) for d in range(1, 8)], rows),
+        'stat_group': rng.choice(['weapons', 'kills', 'losses'], rows),
+        'category': rng.choice(['Gun', 'Air-to-Air', 'Air-to-Surface', 'Bomb',
+                                'pilotDeath', 'eject', 'crash', None], rows),
+        'metric': rng.choice(['kills', 'shot', 'numHits', 'total'], rows),
+        'equipment': rng.choice(['AIM-120C', 'GBU-12', 'F-16C_50'], rows),
+        'value': rng.randint(0, 10, rows),
+    })
+    facts = pd.concat([facts[FACT_COLS + ['value']], synthetic],
+                      ignore_index=True)
+    facts = facts.groupby(FACT_COLS, as_index=False, dropna=False)['value'].sum()
+    return facts.replace({np.nan: None}).to_dict('records')
+
+
+class FactsDB:
+    """Serves mission_stat_facts and weapon_types to collect_recs_kv."""
+
+    def __init__(self, facts):
+        self.facts = facts
+
+    async def fetch_all(self, query=None, values=None):
+        if isinstance(query, str) and 'mission_stat_facts' in query:
+            return self.facts
+        return WEAPONS
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_parse_rec_keys_matches_regex_cascade(stat_records):
+    keys = {key for rec in stat_records for key in rec['record']}
+    keys |= {'times__JF-17__kills__Planes__total',
+             'times__F-16C_50__actions__losses__pilotDeath',
+             'times__AV8BNA__total', 'weapons__Mk-20 Rockeye__kills',
+             'weapons__GAU-8__gun', 'losses__pilotDeath', 'PvP__kills',
+             'lastJoin', 'friendlyHits', 'nonsense'}
+    read_stats._classify_rec_key.cache_clear()
+    for key in sorted(keys):
+        assert (safe_call(read_stats.parse_rec_keys, key)
+                == safe_call(legacy_parse_rec_keys, key)), key
+    # A second pass is answered by the memoized classifier.
+    for key in sorted(keys):
+        assert (safe_call(read_stats.parse_rec_keys, key)
+                == safe_call(legacy_parse_rec_keys, key)), key
+    assert read_stats._classify_rec_key.cache_info().hits >= len(keys) - 1
+
+
+def test_pipeline_steps_match_row_wise(stat_facts):
+    data = pd.DataFrame(stat_facts)
+    legacy, vectorized = data.copy(), data.copy()
+    legacy_zero_gun_kills(legacy)
+    read_stats.zero_gun_kills(vectorized)
+    pd.testing.assert_series_equal(legacy['value'], vectorized['value'],
+                                   check_dtype=False)
+
+    for cols, sep in [(['category', 'metric'], ' '),
+                      (['category', 'metric', 'stat_group'], '__')]:
+        pd.testing.assert_series_equal(
+            legacy_concat_cols(data, cols, sep),
+            read_stats.concat_cols(data, cols, sep), check_names=False)
+
+
+@pytest.mark.parametrize('grouping_cols', [['pilot'],
+                                           ['session_start_date', 'pilot']])
+def test_overall_stats_match_row_wise(monkeypatch, stat_facts, grouping_cols):
+    overall = read_stats.calculate_overall_stats.__wrapped__
+    db = FactsDB(stat_facts)
+    vectorized = run(overall(list(grouping_cols), db))
+    monkeypatch.setattr(read_stats, 'zero_gun_kills', legacy_zero_gun_kills)
+    monkeypatch.setattr(read_stats, 'concat_cols', legacy_concat_cols)
+    legacy = run(overall(list(grouping_cols), db))
+    assert not vectorized.empty
+    assert 'Venner | Taint 1-2' in set(vectorized['pilot'])
+    pd.testing.assert_frame_equal(legacy, vectorized)
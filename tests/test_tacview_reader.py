@@ -0,0 +1,75 @@
+import asyncio
+import gzip
+import zipfile
+
+import pytest
+
+pytest.importorskip('tacview_client')
+
+from horrible import tacview_reader  # noqa: E402
+
+LINES = ['FileType=text/acmi/tacview', 'FileVersion=2.1', '#0.0',
+         '0,ReferenceTime=2020-01-17T20:14:45Z', '#0.5', '1,T=1|2|3']
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_pinned_client_records_flush_times():
+    copy_writer = pytest.importorskip('tacview_client.copy_writer')
+    assert isinstance(copy_writer.BinCopyWriter.event_times, list)
+
+
+def test_flush_metrics_count_only_new_flushes(monkeypatch):
+    class BinCopyWriter:
+        event_times = [5.0]
+
+    monkeypatch.setattr(tacview_reader, 'copy_writer',
+                        type('copy_writer', (), {'BinCopyWriter': BinCopyWriter}))
+    metrics = tacview_reader.IngestMetrics()
+    metrics.watch_flushes()
+    BinCopyWriter.event_times.extend([0.25, 0.5])
+    assert metrics.flush_count == 2
+    assert metrics.flush_secs == 0.75
+    assert metrics.flush_max_secs == 0.5
+    assert metrics.parse_secs == 0.0
+
+
+@pytest.mark.parametrize('copy_writer', [None, type('copy_writer', (), {})])
+def test_flush_metrics_unavailable_without_event_times(monkeypatch,
+                                                       copy_writer):
+    monkeypatch.setattr(tacview_reader, 'copy_writer', copy_writer)
+    metrics = tacview_reader.IngestMetrics()
+    metrics.watch_flushes()
+    values = metrics.as_dict()
+    for col in ['flush_count', 'flush_secs', 'flush_max_secs', 'parse_secs']:
+        assert values[col] is None
+
+
+@pytest.mark.parametrize('suffix', ['.acmi', '.gz', '.zip'])
+def test_file_stream_reader_counts(tmp_path, suffix):
+    data = ('\n'.join(LINES) + '\n').encode('UTF-8')
+    path = tmp_path / f'track{suffix}'
+    if suffix == '.gz':
+        path.write_bytes(gzip.compress(data))
+    elif suffix == '.zip':
+        with zipfile.ZipFile(path, 'w') as zfile:
+            zfile.writestr('track.txt.acmi', data)
+    else:
+        path.write_bytes(data)
+
+    reader = tacview_reader.FileStreamReader(path, chunk_bytes=16)
+    run(reader.open_connection())
+    lines = [LINES[0]]
+    while True:
+        try:
+            lines.append(run(reader.read_stream()))
+        except tacview_reader.client.EndOfFileException:
+            break
+    reader.close_file()
+
+    assert lines == LINES
+    assert reader.metrics.lines_read == len(LINES)
+    assert reader.metrics.events_read == len(LINES) - 2
+    assert reader.metrics.bytes_read == path.stat().st_size
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from horrible import trajectory
+
+
+def track(samples: int):
+    return {'id': 1,
+            'coord': [[float(i), 1000.0, float(i % 7)] for i in range(samples)],
+            'rot': [[0.0, 0.0, float(i % 360)] for i in range(samples)],
+            'heading': [float(i % 360) for i in range(samples)],
+            'time_step': [i * 0.5 for i in range(samples)]}
+
+
+@pytest.mark.parametrize('rate', [0, -1, trajectory.MAX_RATE + 1, 1e9])
+def test_resample_track_rejects_out_of_range_rates(rate):
+    with pytest.raises(ValueError):
+        trajectory.resample_track(track(10), rate)
+
+
+def test_resample_track_at_max_rate():
+    out = trajectory.resample_track(track(10), trajectory.MAX_RATE)
+    assert len(out['time_step']) == 4.5 * trajectory.MAX_RATE + 1
+
+
+@pytest.mark.parametrize('kwargs', [{'tolerance': 0}, {'tolerance': -1},
+                                    {'max_points': 1}, {'max_points': -5}])
+def test_simplify_track_rejects_bad_input(kwargs):
+    with pytest.raises(ValueError):
+        trajectory.simplify_track(track(10), **kwargs)
+
+
+def test_simplify_track_budget_beyond_length_keeps_every_sample():
+    rec = track(10)
+    assert trajectory.simplify_track(rec, max_points=10**9) == rec
+
+
+def stationary(samples: int):
+    rec = track(samples)
+    rec['coord'] = [[1.0, 1000.0, 2.0]] * samples
+    return rec
+
+
+@pytest.mark.parametrize('rec', [track(10), stationary(10), stationary(500)])
+@pytest.mark.parametrize('max_points', [2, 3, 50])
+def test_simplify_track_budget_holds_on_ties(rec, max_points):
+    out = trajectory.simplify_track(rec, max_points=max_points)
+    n = len(rec['time_step'])
+    assert len(out['time_step']) == min(max_points, n)
+    assert out['time_step'][0] == rec['time_step'][0]
+    assert out['time_step'][-1] == rec['time_step'][-1]
+    assert out['time_step'] == sorted(out['time_step'])
+
+
+def test_simplify_track_collinear_budget():
+    rec = track(10)
+    rec['coord'] = [[float(i), 1000.0, 0.0] for i in range(10)]
+    out = trajectory.simplify_track(rec, max_points=3)
+    assert len(out['coord']) == 3
+
+
+def test_resample_track_single_timestamp_unchanged():
+    rec = track(5)
+    rec['time_step'] = [2.0] * 5
+    assert trajectory.resample_track(rec, 10) is rec
+
+
+def test_resample_track_unsorted_duplicate_timestamps():
+    rec = {'id': 1,
+           'coord': [[0.0, 0.0, 0.0], [20.0, 0.0, 0.0], [10.0, 0.0, 0.0],
+                     [10.0, 0.0, 0.0], [99.0, 99.0, 99.0]],
+           'rot': [[0.0, 0.0, 0.0]] * 5,
+           'heading': [0.0] * 5,
+           'time_step': [0.0, 2.0, 1.0, 1.0, 2.0]}
+    out = trajectory.resample_track(rec, 2)
+    assert out['time_step'] == [0.0, 0.5, 1.0, 1.5, 2.0]
+    assert [c[0] for c in out['coord']] == [0.0, 5.0, 10.0, 15.0, 20.0]
+
+
+def kill_payload():
+    def obj(oid, offset):
+        rec = track(40)
+        rec['coord'] = [[offset + 1e5 + 3.25 * i, 2000.0 + i, -5e4 + 0.5 * i]
+                        for i in range(40)]
+        rec['time_step'] = [3600.0 + t for t in rec['time_step']]
+        rec.update(id=oid, name=f"obj {oid}", color='Red', cat='Air+FixedWing')
+        return rec
+
+    return {'min_ts': 3600.0, 'max_ts': 3619.5, 'impact_id': 7,
+            'impact_dist': '3.2m', 'killer': obj(1, 0.0),
+            'target': obj(2, 250.0), 'weapon': None,
+            'other': [obj(3, 900.0), obj(4, -900.0)]}
+
+
+def test_kill_binary_round_trip():
+    data = kill_payload()
+    payload = trajectory.encode_kill_binary(data)
+    header_len = int.from_bytes(payload[:4], 'little')
+    assert (4 + header_len) % 4 == 0
+
+    out = trajectory.decode_kill_binary(payload)
+    assert out['weapon'] is None
+    assert len(out['other']) == 2
+    for group in ['killer', 'target']:
+        assert {k: v for k, v in out[group].items()
+                if k not in trajectory.TRACK_ARRAYS} == {
+                    k: v for k, v in data[group].items()
+                    if k not in trajectory.TRACK_ARRAYS}
+    for before, after in zip([data['killer'], data['target']] + data['other'],
+                             [out['killer'], out['target']] + out['other']):
+        for name in trajectory.TRACK_ARRAYS:
+            np.testing.assert_allclose(np.asarray(after[name]),
+                                       np.asarray(before[name]), atol=1e-2)
+    assert {k: out[k] for k in ['min_ts', 'max_ts', 'impact_id',
+                                'impact_dist']} == {
+        k: data[k] for k in ['min_ts', 'max_ts', 'impact_id', 'impact_dist']}
+
+
+def test_kill_binary_round_trip_without_tracks():
+    data = {'min_ts': None, 'max_ts': None, 'impact_id': 7,
+            'impact_dist': '0m', 'killer': None, 'target': None,
+            'weapon': None, 'other': []}
+    assert trajectory.decode_kill_binary(
+        trajectory.encode_kill_binary(data)) == data